@@ -0,0 +1,158 @@
+import os
+import json
+import time
+import hashlib
+import numpy as np
+
+from frame_sources import list_images
+
+
+DEFAULT_MAX_MB = 2048
+
+
+def frame_fingerprint(path, limit=None):
+    """
+    Huella (ruta, tamaño, mtime) de los cuadros de una muestra: los archivos
+    de la carpeta (hasta `limit`) o el TIFF multipágina.
+    """
+    if os.path.isdir(path):
+        files = list_images(path)
+        if limit:
+            files = files[:limit]
+    else:
+        files = [path]
+    entries = []
+    for f in files:
+        st = os.stat(f)
+        entries.append([os.path.abspath(f), st.st_size, st.st_mtime_ns])
+    return entries
+
+
+def cache_key(path, limit=None, **config):
+    """Clave sha256 de la huella de los cuadros más los campos de config usados."""
+    payload = {"frames": frame_fingerprint(path, limit), "config": config}
+    blob = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()
+
+
+class AverageCache:
+    """
+    Caché persistente de promedios por muestra, direccionada por contenido.
+
+    Cada entrada es <root>/<kk>/<clave>.npy (promedio float32) más
+    <clave>.json con las métricas calculadas contra cada referencia. La fecha
+    de modificación del .json marca el último acceso; al superar max_bytes se
+    eliminan las entradas usadas hace más tiempo (LRU).
+    """
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def _paths(self, key):
+        folder = os.path.join(self.root, key[:2])
+        return (os.path.join(folder, f"{key}.npy"),
+                os.path.join(folder, f"{key}.json"))
+
+    def _read_meta(self, key):
+        _, meta_path = self._paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _write_meta(self, key, meta):
+        _, meta_path = self._paths(key)
+        tmp = f"{meta_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp, meta_path)
+
+    def _touch(self, key):
+        _, meta_path = self._paths(key)
+        try:
+            os.utime(meta_path)
+        except FileNotFoundError:
+            pass
+
+    def get_average(self, key):
+        """Promedio almacenado para la clave, o None si no está."""
+        avg_path, _ = self._paths(key)
+        try:
+            avg = np.load(avg_path)
+        except (FileNotFoundError, ValueError):
+            return None
+        self._touch(key)
+        return avg
+
+    def put_average(self, key, avg, frame_dtype=None):
+        """Guarda el promedio (y el tipo de los cuadros que lo formaron)."""
+        avg_path, _ = self._paths(key)
+        os.makedirs(os.path.dirname(avg_path), exist_ok=True)
+        tmp = f"{avg_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp, np.asarray(avg, dtype=np.float32))
+        os.replace(tmp, avg_path)
+        meta = self._read_meta(key) or {"created": time.time(), "metrics": {}}
+        if frame_dtype is not None:
+            meta["frame_dtype"] = np.dtype(frame_dtype).str
+        self._write_meta(key, meta)
+        self.evict()
+
+    def frame_dtype(self, key):
+        """Tipo de los cuadros del promedio almacenado, o None si no se registró."""
+        meta = self._read_meta(key)
+        dtype = meta.get("frame_dtype") if meta else None
+        return np.dtype(dtype) if dtype else None
+
+    def get_metrics(self, key, ref_key):
+        """Métricas de la muestra contra la referencia ref_key, o None."""
+        meta = self._read_meta(key)
+        if not meta:
+            return None
+        metrics = meta.get("metrics", {}).get(ref_key)
+        if metrics is not None:
+            self._touch(key)
+        return metrics
+
+    def put_metrics(self, key, ref_key, metrics):
+        meta = self._read_meta(key)
+        if meta is None:
+            return
+        meta.setdefault("metrics", {})[ref_key] = metrics
+        self._write_meta(key, meta)
+
+    def entries(self):
+        """Lista (último acceso, bytes, clave) de las entradas del caché."""
+        out = []
+        for sub in os.listdir(self.root):
+            folder = os.path.join(self.root, sub)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if not name.endswith(".json"):
+                    continue
+                key = name[:-len(".json")]
+                avg_path, meta_path = self._paths(key)
+                try:
+                    size = os.path.getsize(avg_path) + os.path.getsize(meta_path)
+                    atime = os.path.getmtime(meta_path)
+                except FileNotFoundError:
+                    continue
+                out.append((atime, size, key))
+        return out
+
+    def evict(self):
+        """Elimina las entradas menos usadas hasta quedar bajo max_bytes."""
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in entries:
+            if total <= self.max_bytes:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            total -= size
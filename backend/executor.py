@@ -0,0 +1,106 @@
+# backend/executor.py
+import asyncio
+import functools
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+from timing import count, timed
+
+
+class CPUExecutor:
+    """
+    Pool dedicado para el trabajo de imagen (decodificación, filtros, PNG).
+
+    Mantiene libre el event loop y el threadpool de Starlette. Admite como
+    máximo `workers + queue_limit` tareas a la vez; por encima responde 429
+    en lugar de encolar sin límite.
+    """
+
+    def __init__(self, workers: int, queue_limit: int, kind: str = "thread"):
+        self.workers = max(1, workers)
+        self.queue_limit = max(0, queue_limit)
+        self.kind = kind
+        self._pool = None
+        self._threads = None
+        self._inflight = 0
+
+    @property
+    def pool(self):
+        if self._pool is None:
+            if self.kind == "process":
+                self._pool = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._pool = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="spr-cpu"
+                )
+        return self._pool
+
+    @property
+    def thread_pool(self):
+        """Pool de hilos (el mismo pool si kind == "thread")."""
+        if self.kind != "process":
+            return self.pool
+        if self._threads is None:
+            self._threads = ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix="spr-cpu"
+            )
+        return self._threads
+
+    @property
+    def inflight(self) -> int:
+        return self._inflight
+
+    async def run(self, fn, *args, **kwargs):
+        return await self._submit(self.pool, fn, *args, **kwargs)
+
+    async def run_threaded(self, fn, *args, **kwargs):
+        """Como run(), pero siempre en hilos: para argumentos que no se pueden
+        enviar a otro proceso (archivos subidos, búferes compartidos)."""
+        return await self._submit(self.thread_pool, fn, *args, **kwargs)
+
+    async def _submit(self, pool, fn, *args, **kwargs):
+        # Solo se modifica desde el event loop, no requiere lock
+        if self._inflight >= self.workers + self.queue_limit:
+            count("cpu_rejected")
+            raise HTTPException(
+                status_code=429,
+                detail="Servidor ocupado procesando imágenes, reintente en unos segundos",
+                headers={"Retry-After": "1"},
+            )
+        self._inflight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # Incluye la espera en la cola del pool
+            with timed("cpu_task", fn=getattr(fn, "__name__", "?")):
+                return await loop.run_in_executor(
+                    pool, functools.partial(fn, *args, **kwargs)
+                )
+        finally:
+            self._inflight -= 1
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._threads is not None:
+            self._threads.shutdown(wait=False, cancel_futures=True)
+            self._threads = None
+
+
+cpu_executor = CPUExecutor(
+    workers=int(os.getenv("CPU_WORKERS", os.cpu_count() or 2)),
+    queue_limit=int(os.getenv("CPU_QUEUE_LIMIT", "8")),
+    kind=os.getenv("CPU_EXECUTOR", "thread"),
+)
+
+
+async def run_cpu(fn, *args, **kwargs):
+    """Ejecuta fn en el pool de CPU con control de carga (429 si está lleno)."""
+    return await cpu_executor.run(fn, *args, **kwargs)
+
+
+async def run_cpu_threaded(fn, *args, **kwargs):
+    """run_cpu en hilos, para argumentos que no se pueden serializar."""
+    return await cpu_executor.run_threaded(fn, *args, **kwargs)
@@ -0,0 +1,313 @@
+# backend/filters.py
+"""
+Motor de filtros para la referencia.
+
+Cada filtro se registra con sus parámetros tipados; compile_plan() convierte
+(filters, params) en un plan ordenado que se cachea por firma canónica. El
+plan reutiliza búferes uint8/float64 preasignados entre etapas (ping-pong) y
+cada etapa obtiene sus estadísticas de una sola reducción: un histograma de
+256 niveles para las salidas uint8, o suma / suma de cuadrados / no nulos
+para las salidas float64 (Laplaciano, Sobel).
+
+No depende de FastAPI: se usa desde la API y desde scripts por lotes.
+"""
+import hashlib
+import json
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Any, Callable
+
+import cv2
+import numpy as np
+
+from timing import timed
+
+
+# ============================================================
+# Estadísticas fusionadas
+# ============================================================
+class U8Stats:
+    """Estadísticas de una imagen uint8 a partir de un único histograma."""
+
+    def __init__(self, img: np.ndarray):
+        if img.size < 2 ** 24:
+            # calcHist recorre la imagen una vez sin temporales (conteos float32 exactos)
+            hist = cv2.calcHist([img], [0], None, [256], [0, 256]).ravel()
+        else:
+            hist = np.bincount(img.ravel(), minlength=256)
+        self.hist = hist.astype(np.int64)
+        self.size = img.size
+        levels = np.arange(256, dtype=np.float64)
+        self.sum = float(self.hist @ levels)
+        self.sum_sq = float(self.hist @ (levels * levels))
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.size
+
+    @property
+    def var(self) -> float:
+        levels = np.arange(256, dtype=np.float64)
+        return float(self.hist @ (levels - self.mean) ** 2) / self.size
+
+    @property
+    def std(self) -> float:
+        return float(np.sqrt(self.var))
+
+    @property
+    def min(self) -> int:
+        return int(np.flatnonzero(self.hist)[0])
+
+    @property
+    def max(self) -> int:
+        return int(np.flatnonzero(self.hist)[-1])
+
+    def count(self, level: int) -> int:
+        return int(self.hist[level])
+
+    def entropy(self) -> float:
+        """
+        Entropía como la calculaba np.histogram(img, bins=256): los 256
+        niveles se reparten en 256 intervalos entre el mínimo y el máximo.
+        """
+        lo, hi = self.min, self.max
+        if lo == hi:
+            lo, hi = lo - 0.5, hi + 0.5
+        counts, _ = np.histogram(
+            np.arange(256), bins=256, range=(lo, hi), weights=self.hist
+        )
+        p = counts / self.size + 1e-9
+        return float(-np.sum(p * np.log2(p)))
+
+
+class FloatStats:
+    """Suma, suma de cuadrados y no nulos de una respuesta float64."""
+
+    def __init__(self, arr: np.ndarray):
+        flat = arr.reshape(-1)
+        self.size = flat.size
+        self.sum = float(flat.sum())
+        self.sum_sq = float(np.dot(flat, flat))
+        self.nonzero = int(np.count_nonzero(flat))
+
+    @property
+    def var(self) -> float:
+        mean = self.sum / self.size
+        return max(self.sum_sq / self.size - mean * mean, 0.0)
+
+
+# ============================================================
+# Registro de filtros
+# ============================================================
+@dataclass(frozen=True)
+class Param:
+    name: str
+    type: type
+    default: Any
+    odd: bool = False
+
+    def parse(self, raw: dict):
+        value = self.type(raw.get(self.name, self.default))
+        if self.odd and value % 2 == 0:
+            value += 1
+        return value
+
+
+@dataclass(frozen=True)
+class FilterStage:
+    name: str
+    params: tuple
+    apply: Callable
+
+
+# Orden de registro = orden de aplicación
+FILTERS: dict[str, FilterStage] = {}
+
+
+def register(name: str, *params: Param):
+    """
+    Registra una etapa. La función recibe (src, ws, **params) y devuelve
+    (salida uint8, métricas).
+    """
+    def decorator(fn):
+        FILTERS[name] = FilterStage(name=name, params=params, apply=fn)
+        return fn
+    return decorator
+
+
+class Workspace:
+    """Búferes preasignados para un tamaño de imagen, reutilizados entre etapas."""
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self._u8 = (np.empty(self.shape, np.uint8), np.empty(self.shape, np.uint8))
+        self.f64 = np.empty(self.shape, np.float64)
+
+    def out_for(self, src: np.ndarray) -> np.ndarray:
+        """Búfer uint8 de salida distinto de la entrada."""
+        return self._u8[1] if src is self._u8[0] else self._u8[0]
+
+
+@register("gaussian", Param("ksize", int, 5, odd=True))
+def _gaussian(src, ws, ksize):
+    out = cv2.GaussianBlur(src, (ksize, ksize), 0, dst=ws.out_for(src))
+    st = U8Stats(out)
+    return out, {"ksize": ksize, "varianza": st.var, "energia": st.sum_sq, "media": st.mean}
+
+
+@register("median", Param("ksize", int, 5, odd=True))
+def _median(src, ws, ksize):
+    out = cv2.medianBlur(src, ksize, dst=ws.out_for(src))
+    st = U8Stats(out)
+    return out, {"ksize": ksize, "desviacion_std": st.std, "varianza": st.var}
+
+
+@register("equalize_hist")
+def _equalize_hist(src, ws):
+    out = cv2.equalizeHist(src, dst=ws.out_for(src))
+    st = U8Stats(out)
+    return out, {"contraste": float(st.max - st.min), "entropia": st.entropy()}
+
+
+@register("canny", Param("threshold1", int, 100), Param("threshold2", int, 200))
+def _canny(src, ws, threshold1, threshold2):
+    out = cv2.Canny(src, threshold1, threshold2, edges=ws.out_for(src))
+    st = U8Stats(out)
+    edges = st.size - st.count(0)
+    return out, {
+        "threshold1": threshold1,
+        "threshold2": threshold2,
+        "bordes_detectados": edges,
+        "densidad_bordes": edges / st.size,
+    }
+
+
+@register("blur", Param("ksize", int, 5, odd=True))
+def _blur(src, ws, ksize):
+    out = cv2.blur(src, (ksize, ksize), dst=ws.out_for(src))
+    return out, {"ksize": ksize, "varianza": U8Stats(out).var}
+
+
+@register("bilateral", Param("d", int, 5), Param("sigmaColor", int, 75),
+          Param("sigmaSpace", int, 75))
+def _bilateral(src, ws, d, sigmaColor, sigmaSpace):
+    out = cv2.bilateralFilter(src, d, sigmaColor, sigmaSpace, dst=ws.out_for(src))
+    return out, {
+        "d": d,
+        "sigmaColor": sigmaColor,
+        "sigmaSpace": sigmaSpace,
+        "varianza": U8Stats(out).var,
+    }
+
+
+@register("laplacian", Param("ksize", int, 1, odd=True))
+def _laplacian(src, ws, ksize):
+    lap = cv2.Laplacian(src, cv2.CV_64F, dst=ws.f64, ksize=ksize)
+    st = FloatStats(lap)
+    out = cv2.convertScaleAbs(lap, dst=ws.out_for(src))
+    return out, {
+        "ksize": ksize,
+        "varianza": st.var,
+        "energia": st.sum_sq,
+        "pixels_border": st.nonzero,
+    }
+
+
+@register("sobel", Param("dx", int, 1), Param("dy", int, 0), Param("ksize", int, 3))
+def _sobel(src, ws, dx, dy, ksize):
+    sob = cv2.Sobel(src, cv2.CV_64F, dx, dy, dst=ws.f64, ksize=ksize)
+    st = FloatStats(sob)
+    out = cv2.convertScaleAbs(sob, dst=ws.out_for(src))
+    return out, {"dx": dx, "dy": dy, "ksize": ksize, "energia": st.sum_sq}
+
+
+@register("threshold", Param("thresh", int, 127), Param("maxval", int, 255))
+def _threshold(src, ws, thresh, maxval):
+    _, out = cv2.threshold(src, thresh, maxval, cv2.THRESH_BINARY, dst=ws.out_for(src))
+    return out, {"thresh": thresh, "pixeles_blancos": U8Stats(out).count(255)}
+
+
+@register("invert")
+def _invert(src, ws):
+    out = cv2.bitwise_not(src, dst=ws.out_for(src))
+    return out, {"media": U8Stats(out).mean}
+
+
+@register("sharpen", Param("strength", float, 1))
+def _sharpen(src, ws, strength):
+    kernel = np.array([[0, -1, 0], [-1, 5 + strength, -1], [0, -1, 0]])
+    out = cv2.filter2D(src, -1, kernel, dst=ws.out_for(src))
+    return out, {"strength": strength, "varianza": U8Stats(out).var}
+
+
+# ============================================================
+# Plan compilado
+# ============================================================
+@dataclass
+class FilterPlan:
+    """Etapas activas en orden, con sus parámetros ya convertidos."""
+    signature: str
+    stages: list = field(default_factory=list)  # (FilterStage, kwargs | None, error | None)
+
+    @property
+    def ops(self) -> list:
+        return [stage.name for stage, _, _ in self.stages]
+
+    @property
+    def hash(self) -> str:
+        return hashlib.sha256(self.signature.encode("utf-8")).hexdigest()
+
+    def run(self, img: np.ndarray, workspace: Workspace = None):
+        """
+        Aplica el plan a una imagen uint8 (que no se modifica). Devuelve
+        (procesada, filter_metrics, errores). La procesada vive en los búferes
+        del workspace: cópiela si va a reutilizar el workspace.
+        """
+        if workspace is None or workspace.shape != img.shape:
+            workspace = Workspace(img.shape)
+
+        processed = img
+        filter_metrics: dict[str, Any] = {}
+        errores = []
+        for stage, kwargs, error in self.stages:
+            if error is not None:
+                errores.append(f"{stage.name}: {error}")
+                continue
+            try:
+                with timed("filter_stage", stage=stage.name):
+                    processed, filter_metrics[stage.name] = stage.apply(
+                        processed, workspace, **kwargs
+                    )
+            except Exception as e:
+                errores.append(f"{stage.name}: {e}")
+        return processed, filter_metrics, errores
+
+
+def plan_signature(filters: dict, params: dict) -> str:
+    """Firma canónica: filtros activos (en orden de registro) y sus parámetros."""
+    active = [
+        [name, (params or {}).get(name, {}) or {}]
+        for name in FILTERS
+        if (filters or {}).get(name)
+    ]
+    return json.dumps(active, sort_keys=True, default=str)
+
+
+@lru_cache(maxsize=256)
+def _compile(signature: str) -> FilterPlan:
+    plan = FilterPlan(signature=signature)
+    for name, raw in json.loads(signature):
+        stage = FILTERS[name]
+        try:
+            if not isinstance(raw, dict):
+                raise TypeError(f"parámetros inválidos: {raw!r}")
+            kwargs = {p.name: p.parse(raw) for p in stage.params}
+            plan.stages.append((stage, kwargs, None))
+        except Exception as e:
+            plan.stages.append((stage, None, e))
+    return plan
+
+
+def compile_plan(filters: dict, params: dict) -> FilterPlan:
+    """Compila (una vez por firma) el plan de filtros pedido."""
+    return _compile(plan_signature(filters, params))
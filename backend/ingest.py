@@ -0,0 +1,223 @@
+# backend/ingest.py
+"""
+Carga masiva de resultados de corridas en la tabla samples.
+
+Fuentes: los CSV de main.py (results/<run_id>/<run_id>_metrics.csv) y los
+trabajos terminados de la tabla jobs. Las filas se insertan por lotes
+(executemany, varios miles por transacción) con INSERT ... ON CONFLICT DO
+NOTHING sobre la clave natural (run_id, sample_label), así que volver a
+importar la misma corrida no duplica filas.
+
+Uso:
+    python -m backend.ingest results/                 # todos los *_metrics.csv
+    python -m backend.ingest results/run01/run01_metrics.csv --run-id run01
+    python -m backend.ingest --jobs                   # trabajos terminados
+"""
+import argparse
+import glob
+import os
+from datetime import datetime, timezone
+
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+
+from backend import database
+from backend.models import Job, Sample
+
+DEFAULT_CHUNK_SIZE = 5000
+METRICS_SUFFIX = "_metrics.csv"
+
+
+# ============================================================
+# Fuentes
+# ============================================================
+def find_metric_csvs(paths):
+    """Expande carpetas a sus *_metrics.csv (recursivo) y conserva archivos."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(glob.glob(os.path.join(path, "**", f"*{METRICS_SUFFIX}"),
+                                   recursive=True))
+        else:
+            found.append(path)
+    return sorted(set(found))
+
+
+def rows_from_csv(path, run_id=None):
+    """
+    Filas de un CSV de main.py (sample, n_value, IV, ZNCC, rSSD). El run_id
+    sale del nombre <run_id>_metrics.csv si no se indica; la fecha de la
+    fila es la del archivo.
+    """
+    if run_id is None:
+        name = os.path.basename(path)
+        run_id = name[:-len(METRICS_SUFFIX)] if name.endswith(METRICS_SUFFIX) else name
+    created = datetime.fromtimestamp(os.path.getmtime(path), tz=timezone.utc)
+
+    df = pd.read_csv(path)
+    return [
+        {
+            "run_id": run_id,
+            "sample_label": str(r["sample"]),
+            "filename": str(r["sample"]),
+            "n_value": float(r["n_value"]) if pd.notna(r.get("n_value")) else None,
+            "iv_original": float(r["IV"]),
+            "zncc": float(r["ZNCC"]),
+            "rssd": float(r["rSSD"]),
+            "rssd_unit": "pixel",
+            "params": {"source": os.path.abspath(path)},
+            "series_path": None,
+            "n_frames": None,
+            "created_at": created,
+        }
+        for r in df.to_dict("records")
+    ]
+
+
+def job_rssd(result: dict):
+    """
+    rSSD por píxel de un trabajo sample_folder. Los resultados sin
+    rssd_unit informaban la suma por cuadro: se divide por n_pixels si está
+    y, si no, no se puede convertir y queda sin rSSD.
+    """
+    if result.get("rssd_unit") == "pixel":
+        return result["rssd"]
+    if result.get("rssd") is None or not result.get("n_pixels"):
+        return None
+    return result["rssd"] / result["n_pixels"]
+
+
+def rows_from_job(job: Job):
+    """Filas de un trabajo terminado (analysis_run o sample_folder)."""
+    result = job.result or {}
+    created = job.finished_at or job.created_at
+    source = {"source": f"job:{job.id}"}
+
+    if job.kind == "analysis_run":
+        run_id = result.get("run_id") or f"job-{job.id}"
+        return [
+            {
+                "run_id": run_id,
+                "sample_label": r["sample"],
+                "filename": r["sample"],
+                "n_value": r.get("n_value"),
+                "iv_original": r["IV"],
+                "zncc": r["ZNCC"],
+                "rssd": r["rSSD"],
+                "rssd_unit": "pixel",
+                "params": source,
+                "series_path": None,
+                "n_frames": None,
+                "created_at": created,
+            }
+            for r in result.get("rows", [])
+        ]
+
+    if job.kind == "sample_folder" and result.get("n_images"):
+        label = os.path.basename(os.path.normpath(job.params["folder"]))
+        return [{
+            "run_id": f"job-{job.id}",
+            "sample_label": label,
+            "filename": label,
+            "n_value": None,
+            "iv_original": result["iv"],
+            "zncc": result["zncc"],
+            "rssd": job_rssd(result),
+            "rssd_unit": "pixel",
+            "params": {**source, "n_images": result["n_images"]},
+            "series_path": result.get("series_path"),
+            "n_frames": result.get("n_frames"),
+            "created_at": created,
+        }]
+
+    return []
+
+
+# ============================================================
+# Inserción por lotes
+# ============================================================
+def _insert_statement(engine):
+    dialect = engine.dialect.name
+    if dialect == "postgresql":
+        stmt = postgresql.insert(Sample.__table__)
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(Sample.__table__)
+    else:
+        raise ValueError(f"Dialecto no soportado para la carga masiva: {dialect}")
+    # RETURNING id devuelve solo las filas insertadas: rowcount tras un
+    # executemany no es confiable (psycopg2 informa el del último lote)
+    return (stmt.on_conflict_do_nothing(index_elements=["run_id", "sample_label"])
+            .returning(Sample.__table__.c.id))
+
+
+def bulk_insert(rows, engine=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Inserta las filas en lotes de chunk_size, una transacción por lote.
+    Las que ya existen (mismo run_id y sample_label) se omiten. Devuelve
+    (insertadas, omitidas).
+    """
+    engine = engine or database.engine
+    stmt = _insert_statement(engine)
+    inserted = 0
+    total = 0
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        total += len(chunk)
+        with engine.begin() as conn:
+            result = conn.execute(stmt, chunk)
+            inserted += len(result.fetchall())
+    return inserted, total - inserted
+
+
+def ingest_csvs(paths, run_id=None, engine=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    rows = []
+    for path in find_metric_csvs(paths):
+        rows.extend(rows_from_csv(path, run_id))
+    return bulk_insert(rows, engine, chunk_size)
+
+
+def ingest_jobs(job_ids=None, engine=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Importa los trabajos terminados (todos, o solo job_ids)."""
+    with database.SessionLocal() as db:
+        q = db.query(Job).filter(Job.status == "done")
+        if job_ids:
+            q = q.filter(Job.id.in_(job_ids))
+        rows = [row for job in q.all() for row in rows_from_job(job)]
+    return bulk_insert(rows, engine, chunk_size)
+
+
+# ============================================================
+# CLI
+# ============================================================
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Carga masiva de métricas de corridas en la tabla samples"
+    )
+    parser.add_argument("paths", nargs="*",
+                        help="CSV *_metrics.csv o carpetas donde buscarlos")
+    parser.add_argument("--run-id", default=None,
+                        help="run_id para todas las filas (por defecto, del nombre del CSV)")
+    parser.add_argument("--jobs", action="store_true",
+                        help="Importar también los trabajos terminados")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                        help="Filas por transacción")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    if not args.paths and not args.jobs:
+        raise SystemExit("Indique CSV/carpetas o --jobs")
+
+    database.init_db()
+    if args.paths:
+        inserted, skipped = ingest_csvs(args.paths, args.run_id,
+                                        chunk_size=args.chunk_size)
+        print(f"CSV: {inserted} filas insertadas, {skipped} ya existían")
+    if args.jobs:
+        inserted, skipped = ingest_jobs(chunk_size=args.chunk_size)
+        print(f"Trabajos: {inserted} filas insertadas, {skipped} ya existían")
+
+
+if __name__ == "__main__":
+    main()
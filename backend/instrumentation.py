@@ -0,0 +1,71 @@
+# backend/instrumentation.py
+"""
+Latencia de peticiones y de consultas SQL para el registro de timing.py.
+
+RequestTimingMiddleware es ASGI puro (sin BaseHTTPMiddleware) para no
+agregar una tarea por petición ni cortar las respuestas en streaming. La
+ruta se etiqueta con la plantilla de FastAPI (/samples/{sample_id}/series),
+no con la URL, para que la cantidad de series no crezca con los ids.
+"""
+import time
+
+from sqlalchemy import event
+
+from timing import count, registry
+
+
+class RequestTimingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            route = scope.get("route")
+            registry.observe(
+                "http_request",
+                time.perf_counter() - start,
+                method=scope["method"],
+                route=getattr(route, "path", "unmatched"),
+                status=status["code"],
+            )
+
+
+def instrument_engine(engine):
+    """Registra la duración de cada sentencia (db_query por operación) y los commits."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        op = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "?"
+        registry.observe("db_query", time.perf_counter() - start, op=op)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        stack = context.connection.info.get("query_start") if context.connection else None
+        if stack:
+            stack.pop()
+        count("db_errors")
+
+    @event.listens_for(engine, "commit")
+    def _commit(conn):
+        count("db_commits")
+
+    return engine
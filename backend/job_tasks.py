@@ -0,0 +1,95 @@
+# backend/job_tasks.py
+"""
+Tareas que corren en los procesos del pool de trabajos (backend/jobs.py).
+
+Este módulo no importa la app ni la base de datos: los procesos hijos solo
+cargan lo necesario para el análisis. El avance se comunica con eventos
+(job_id, tipo, datos) por una cola compartida, y la cancelación con un
+Event que se consulta en cada paso de avance.
+"""
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobContext:
+    def __init__(self, job_id, events, cancel):
+        self.job_id = job_id
+        self.events = events
+        self.cancel = cancel
+
+    def emit(self, kind, data=None):
+        self.events.put((self.job_id, kind, data))
+
+    def check(self):
+        if self.cancel.is_set():
+            raise JobCancelled()
+
+    def progress(self, done, total, **partial):
+        """Informa el avance y corta el trabajo si se pidió cancelarlo."""
+        self.check()
+        self.emit("progress", {"done": done, "total": total, **partial})
+
+
+# ============================================================
+# Tareas
+# ============================================================
+def analyze_folder_task(ctx, reference_path, folder, batch_size=32, roi=None):
+    """analyze_sample_zip sobre una carpeta de cuadros o un TIFF multipágina."""
+    from backend.series import save_series
+    from backend.speckle_processor_zip import analyze_sample_zip
+
+    def progress(done, total, means):
+        ctx.progress(done, total, partial=means)
+
+    result = analyze_sample_zip(reference_path, folder, batch_size=batch_size,
+                                roi=roi, progress=progress)
+    # La serie va a un .npy; en la tabla jobs queda solo la referencia
+    series = result.pop("series")
+    result["series_path"] = save_series(series, f"job-{ctx.job_id}")
+    result["n_frames"] = result["n_images"]
+    return result
+
+
+def analysis_run_task(ctx, config="config.yaml", store_frames=False, use_cache=True):
+    """Corrida completa de main.py (secuencial) con avance por muestra."""
+    import main as pipeline
+    from io_utils import load_config
+    from metrics import ReferenceStats
+    from run_store import RunStore
+
+    cfg = load_config(config)
+    exp = cfg["experiment"]
+    run = pipeline.prepare_run(cfg, store_frames=store_frames, use_cache=use_cache)
+
+    samples = exp["samples"]
+    ctx.progress(0, len(samples), stage="reference")
+    ref_avg, run["ref_key"] = pipeline.sample_average(
+        exp["reference_label"], run, progress=False
+    )
+    ref_stats = ReferenceStats(ref_avg)
+
+    rows = []
+    for sample in samples:
+        ctx.check()
+        rows.append(pipeline.process_sample(sample, run, ref_stats, progress=False))
+        ctx.progress(len(rows), len(samples), row=rows[-1])
+
+    RunStore(run["store_dir"]).write_index()
+    out_csv, _ = pipeline.write_results(rows, cfg["paths"]["results"], exp["run_id"])
+    return {"run_id": exp["run_id"], "csv": out_csv, "rows": rows}
+
+
+TASKS = {
+    "sample_folder": analyze_folder_task,
+    "analysis_run": analysis_run_task,
+}
+
+
+def execute(job_id, kind, params, events, cancel):
+    """Punto de entrada en el proceso hijo."""
+    ctx = JobContext(job_id, events, cancel)
+    ctx.check()
+    ctx.emit("running")
+    return TASKS[kind](ctx, **params)
@@ -0,0 +1,262 @@
+# backend/jobs.py
+"""
+Trabajos de análisis en segundo plano.
+
+Cada trabajo se registra en la tabla jobs y se ejecuta en un pool local de
+procesos (sin broker externo). Los procesos hijos envían eventos de avance
+por una cola de un multiprocessing.Manager; un hilo monitor los consume,
+actualiza la tabla y los reenvía a los suscriptores SSE. El trabajo sigue
+corriendo aunque el cliente se desconecte, y se puede cancelar: antes de
+empezar se quita de la cola, y en curso se marca su Event de cancelación.
+"""
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timezone
+
+from backend import database
+from backend.job_tasks import TASKS, JobCancelled, execute
+from backend.models import Job
+
+TERMINAL = ("done", "failed", "cancelled")
+
+# Intervalo mínimo entre escrituras de avance en la base (segundos)
+PROGRESS_FLUSH_SECONDS = 1.0
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def job_to_dict(job: Job) -> dict:
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "status": job.status,
+        "params": job.params,
+        "progress": job.progress,
+        "result": job.result,
+        "error": job.error,
+        "created_at": job.created_at.isoformat() if job.created_at else None,
+        "started_at": job.started_at.isoformat() if job.started_at else None,
+        "finished_at": job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+class JobManager:
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._loop = None
+        self._ctx = multiprocessing.get_context("spawn")
+        self._manager = None
+        self._events = None
+        self._pool = None
+        self._monitor = None
+        self._lock = threading.Lock()
+        self._futures = {}      # job_id -> Future
+        self._cancel = {}       # job_id -> Event (proxy del Manager)
+        self._progress = {}     # job_id -> último avance recibido
+        self._last_flush = {}   # job_id -> time.monotonic()
+        self._subscribers = {}  # job_id -> [asyncio.Queue]
+
+    # ------------------------------------------------------------
+    # Ciclo de vida
+    # ------------------------------------------------------------
+    def start(self, loop):
+        """Se llama al iniciar la app; marca como fallidos los trabajos que
+        quedaron a medias en un reinicio."""
+        self._loop = loop
+        with database.SessionLocal() as db:
+            (
+                db.query(Job)
+                .filter(Job.status.in_(("queued", "running")))
+                .update(
+                    {Job.status: "failed", Job.error: "Interrumpido por reinicio del servidor",
+                     Job.finished_at: _now()},
+                    synchronize_session=False,
+                )
+            )
+            db.commit()
+
+    def _ensure_pool(self):
+        if self._manager is None:
+            self._manager = self._ctx.Manager()
+            self._events = self._manager.Queue()
+            self._monitor = threading.Thread(
+                target=self._monitor_loop, name="spr-jobs", daemon=True
+            )
+            self._monitor.start()
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=self._ctx
+            )
+
+    def shutdown(self):
+        with self._lock:
+            for event in self._cancel.values():
+                event.set()
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._events is not None:
+            self._events.put(None)
+            self._monitor.join(timeout=5)
+            self._manager.shutdown()
+            self._manager = None
+            self._events = None
+
+    # ------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------
+    def submit(self, kind: str, params: dict) -> dict:
+        if kind not in TASKS:
+            raise ValueError(f"Tipo de trabajo desconocido: {kind}")
+
+        job_id = uuid.uuid4().hex
+        with database.SessionLocal() as db:
+            job = Job(id=job_id, kind=kind, status="queued", params=params)
+            db.add(job)
+            db.commit()
+            db.refresh(job)
+            snapshot = job_to_dict(job)
+
+        with self._lock:
+            self._ensure_pool()
+            cancel = self._manager.Event()
+            try:
+                future = self._pool.submit(execute, job_id, kind, params, self._events, cancel)
+            except BrokenProcessPool:
+                # Un proceso murió: se recrea el pool y se reintenta una vez
+                self._pool = None
+                self._ensure_pool()
+                future = self._pool.submit(execute, job_id, kind, params, self._events, cancel)
+            self._futures[job_id] = future
+            self._cancel[job_id] = cancel
+
+        future.add_done_callback(lambda f, job_id=job_id: self._on_done(job_id, f))
+        return snapshot
+
+    def cancel(self, job_id: str) -> bool:
+        """Pide cancelar el trabajo; False si ya había terminado."""
+        with self._lock:
+            future = self._futures.get(job_id)
+            event = self._cancel.get(job_id)
+        if future is None:
+            return False
+        if not future.cancel():
+            event.set()
+        return True
+
+    def get(self, job_id: str):
+        with database.SessionLocal() as db:
+            job = db.get(Job, job_id)
+            if job is None:
+                return None
+            snapshot = job_to_dict(job)
+        # El avance en la base se escribe con intervalo; el de memoria es el último
+        progress = self._progress.get(job_id)
+        if progress is not None and snapshot["status"] not in TERMINAL:
+            snapshot["progress"] = progress
+        return snapshot
+
+    def list(self, limit: int = 50):
+        with database.SessionLocal() as db:
+            jobs = db.query(Job).order_by(Job.created_at.desc()).limit(limit).all()
+            return [job_to_dict(j) for j in jobs]
+
+    def subscribe(self, job_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(queue)
+        return queue
+
+    def unsubscribe(self, job_id: str, queue: asyncio.Queue):
+        with self._lock:
+            queues = self._subscribers.get(job_id, [])
+            if queue in queues:
+                queues.remove(queue)
+            if not queues:
+                self._subscribers.pop(job_id, None)
+
+    # ------------------------------------------------------------
+    # Monitor
+    # ------------------------------------------------------------
+    def _on_done(self, job_id, future):
+        # Pasa por la misma cola para llegar después del último avance
+        if future.cancelled():
+            final = ("cancelled", None, None)
+        else:
+            exc = future.exception()
+            if exc is None:
+                final = ("done", future.result(), None)
+            elif isinstance(exc, JobCancelled):
+                final = ("cancelled", None, None)
+            else:
+                final = ("failed", None, f"{type(exc).__name__}: {exc}")
+        events = self._events
+        if events is not None:
+            events.put((job_id, "final", final))
+
+    def _monitor_loop(self):
+        events = self._events
+        while True:
+            try:
+                item = events.get()
+            except (EOFError, OSError):
+                return
+            if item is None:
+                return
+            job_id, kind, data = item
+            try:
+                self._handle(job_id, kind, data)
+            except Exception as e:
+                print(f"⚠️ Error registrando evento del trabajo {job_id}: {e}")
+
+    def _handle(self, job_id, kind, data):
+        if kind == "running":
+            self._update(job_id, status="running", started_at=_now())
+            self._publish(job_id, {"event": "status", "status": "running"})
+
+        elif kind == "progress":
+            self._progress[job_id] = data
+            now = time.monotonic()
+            if now - self._last_flush.get(job_id, 0.0) >= PROGRESS_FLUSH_SECONDS:
+                self._last_flush[job_id] = now
+                self._update(job_id, progress=data)
+            self._publish(job_id, {"event": "progress", "status": "running", **data})
+
+        elif kind == "final":
+            status, result, error = data
+            fields = {"status": status, "finished_at": _now(), "result": result, "error": error}
+            if job_id in self._progress:
+                fields["progress"] = self._progress.pop(job_id)
+            self._update(job_id, **fields)
+            with self._lock:
+                self._futures.pop(job_id, None)
+                self._cancel.pop(job_id, None)
+            self._last_flush.pop(job_id, None)
+            self._publish(job_id, {"event": status, "status": status,
+                                   "result": result, "error": error})
+
+    def _update(self, job_id, **fields):
+        with database.SessionLocal() as db:
+            job = db.get(Job, job_id)
+            if job is None:
+                return
+            for key, value in fields.items():
+                setattr(job, key, value)
+            db.commit()
+
+    def _publish(self, job_id, event):
+        with self._lock:
+            queues = list(self._subscribers.get(job_id, []))
+        for queue in queues:
+            self._loop.call_soon_threadsafe(queue.put_nowait, event)
+
+
+job_manager = JobManager(workers=int(os.getenv("JOB_WORKERS", "2")))
@@ -2,8 +2,12 @@
 
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+import asyncio
 import os
 import numpy as np
 
@@ -11,17 +15,25 @@ import numpy as np
 # Routers
 # -------------------------------
 from backend.routers.reference import router as reference_router
+from backend.routers.samples import router as samples_router
+from backend.routers.jobs import router as jobs_router
+from backend.routers.live import router as live_router
+from backend.routers.calibration import router as calibration_router
 
 # -------------------------------
 # Database
 # -------------------------------
-from backend.database import Base, engine, get_db
+from backend.database import get_db, init_db
 from backend import models
 
 # -------------------------------
 # Utils
 # -------------------------------
 from backend import utils
+from backend.executor import cpu_executor, run_cpu
+from backend.instrumentation import RequestTimingMiddleware
+from backend.jobs import job_manager
+from timing import registry
 
 # -------------------------------
 # OpenCV (opcional)
@@ -35,10 +47,23 @@ except Exception:
 # ============================================================
 # APP
 # ============================================================
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Esquema de la base (fuera del import, para que arrancar un worker sea rápido)
+    await run_in_threadpool(init_db)
+    # Trabajos en segundo plano (los que quedaron a medias se marcan fallidos)
+    job_manager.start(asyncio.get_running_loop())
+    yield
+    job_manager.shutdown()
+    # Pool de CPU (decodificación y filtros fuera del event loop)
+    cpu_executor.shutdown()
+
+
 app = FastAPI(
     title="SPR Speckle API",
     version="1.0.0",
     description="Backend académico para análisis de speckle SPR",
+    lifespan=lifespan,
 )
 
 # ============================================================
@@ -55,10 +80,8 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ============================================================
-# DB INIT
-# ============================================================
-Base.metadata.create_all(bind=engine)
+# Latencia por ruta (histogramas en /metrics); va por fuera de CORS
+app.add_middleware(RequestTimingMiddleware)
 
 # ============================================================
 # STATIC FILES
@@ -76,6 +99,10 @@ app.mount(
 # ROUTERS
 # ============================================================
 app.include_router(reference_router)
+app.include_router(samples_router)
+app.include_router(jobs_router)
+app.include_router(live_router)
+app.include_router(calibration_router)
 
 # ============================================================
 # HEALTH CHECK
@@ -84,6 +111,22 @@ app.include_router(reference_router)
 def ping():
     return {"status": "ok"}
 
+# ============================================================
+# MÉTRICAS (Prometheus)
+# ============================================================
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def metrics():
+    """
+    Tiempos y contadores de este proceso en formato de texto de Prometheus:
+    latencia por ruta, decodificación / codificación, etapas de filtros,
+    consultas SQL y tareas del pool de CPU. Con varios workers de uvicorn
+    cada uno expone los suyos.
+    """
+    return PlainTextResponse(
+        registry.render_prometheus(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
 # ============================================================
 # (OPCIONAL) ENDPOINT SIMPLE DE PRUEBA
 # ============================================================
@@ -96,10 +139,13 @@ async def process_reference(file: UploadFile = File(...)):
     if cv2 is None:
         raise HTTPException(status_code=500, detail="OpenCV no disponible")
 
-    image = await utils.read_image_uploadfile(file)
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    contents = await file.read()
+    try:
+        mean_intensity = await run_cpu(utils.mean_intensity, contents)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
     return {
-        "mean_intensity": float(np.mean(gray)),
+        "mean_intensity": mean_intensity,
         "message": "Imagen procesada correctamente",
     }
@@ -6,6 +6,7 @@ from sqlalchemy import (
     Boolean,
     DateTime,
     JSON,
+    Index,
 )
 from sqlalchemy.sql import func
 from backend.database import Base
@@ -37,21 +38,68 @@ class Reference(Base):
 # ============================================================
 class Sample(Base):
     __tablename__ = "samples"
+    __table_args__ = (
+        # Paginación por cursor del historial: ORDER BY created_at DESC, id DESC
+        Index("ix_samples_created_at_id", "created_at", "id"),
+        # Clave natural de las filas importadas de corridas (ver backend/ingest.py);
+        # las filas de la API la dejan en NULL
+        Index("ux_samples_run_label", "run_id", "sample_label", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
 
     filename = Column(String, nullable=False)
 
+    # iv_original: en las filas de /reference/process_active, el IV de la
+    # referencia antes de filtrar; en las de muestras (CSV de main.py,
+    # trabajos, /samples/batch), el IV medio de la muestra analizada
     iv_original = Column(Float, nullable=True)
     iv_processed = Column(Float, nullable=True)
     zncc = Column(Float, nullable=True)
+    # rSSD por píxel (media de (I - I0)², ecuación (3), como compute_all) en
+    # todas las fuentes y respuestas de la API. rssd_unit lo marca: "pixel";
+    # "sum" en filas antiguas (suma sobre la imagen) que init_db no pudo
+    # convertir, que la calibración excluye
     rssd = Column(Float, nullable=True)
+    rssd_unit = Column(String, nullable=True, default="pixel")
 
     ops = Column(JSON, nullable=True)
     params = Column(JSON, nullable=True)
     filter_metrics = Column(JSON, nullable=True)
 
+    run_id = Column(String, nullable=True)
+    sample_label = Column(String, nullable=True)
+    n_value = Column(Float, nullable=True)
+
+    # Serie por cuadro (float32 (3, N) en .npy, ver backend/series.py)
+    series_path = Column(String, nullable=True)
+    n_frames = Column(Integer, nullable=True)
+
+    created_at = Column(
+        DateTime(timezone=True),
+        server_default=func.now()
+    )
+
+
+# ============================================================
+# JOB (análisis en segundo plano)
+# ============================================================
+class Job(Base):
+    __tablename__ = "jobs"
+
+    id = Column(String(32), primary_key=True)
+
+    kind = Column(String, nullable=False)
+    status = Column(String, nullable=False, default="queued", index=True)
+
+    params = Column(JSON, nullable=True)
+    progress = Column(JSON, nullable=True)
+    result = Column(JSON, nullable=True)
+    error = Column(String, nullable=True)
+
     created_at = Column(
         DateTime(timezone=True),
         server_default=func.now()
     )
+    started_at = Column(DateTime(timezone=True), nullable=True)
+    finished_at = Column(DateTime(timezone=True), nullable=True)
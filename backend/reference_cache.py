@@ -0,0 +1,87 @@
+# backend/reference_cache.py
+"""
+Referencia activa decodificada, compartida por todo el proceso.
+
+Guarda la imagen en uint8 y float32 (solo lectura, las peticiones
+concurrentes usan el mismo búfer) y las sumas de metrics.ReferenceStats,
+de las que salen la media y la norma centrada que usa ZNCC. La base de
+datos sigue indicando cuál es la referencia activa; la entrada se reutiliza
+mientras el id coincida.
+"""
+import threading
+
+import numpy as np
+from PIL import Image
+
+from metrics import ReferenceStats
+from timing import timed
+
+
+class ActiveReference:
+    def __init__(self, ref_id: int, path: str, gray: np.ndarray):
+        self.id = ref_id
+        self.path = path
+        self.u8 = np.ascontiguousarray(gray, dtype=np.uint8)
+        self.u8.setflags(write=False)
+        self.f32 = self.u8.astype(np.float32)
+        self.f32.setflags(write=False)
+        self.stats = ReferenceStats(self.u8)
+
+    @property
+    def shape(self):
+        return self.u8.shape
+
+    @property
+    def mean(self) -> float:
+        return self.stats.mean
+
+    @property
+    def norm(self) -> float:
+        """||I0 - media||, el factor de la referencia en el denominador de ZNCC."""
+        return float(np.sqrt(self.stats.centered_sum_sq))
+
+
+@timed("image_decode")
+def load_reference(ref_id: int, path: str) -> ActiveReference:
+    """Decodifica original.png (escala de grises) y arma la entrada."""
+    gray = np.array(Image.open(path).convert("L"), dtype=np.uint8)
+    return ActiveReference(ref_id, path, gray)
+
+
+class ReferenceCache:
+    def __init__(self):
+        self._entry = None
+        self._lock = threading.Lock()
+
+    def get(self, ref_id: int):
+        """Entrada de la referencia ref_id, o None si no está cargada."""
+        with self._lock:
+            entry = self._entry
+        if entry is not None and entry.id == ref_id:
+            return entry
+        return None
+
+    def set(self, entry: ActiveReference):
+        with self._lock:
+            self._entry = entry
+
+    def invalidate(self):
+        """Se llama cuando cambia la referencia activa."""
+        with self._lock:
+            self._entry = None
+
+
+reference_cache = ReferenceCache()
+
+
+def get_reference(ref_id: int, path: str) -> ActiveReference:
+    """
+    Entrada de la caché de este proceso; decodifica la referencia si falta.
+    En modo CPU_EXECUTOR=process cada proceso del pool tiene su propia
+    caché, así que basta con enviarle el id y la ruta.
+    """
+    active = reference_cache.get(ref_id)
+    if active is None:
+        active = load_reference(ref_id, path)
+        reference_cache.set(active)
+    return active
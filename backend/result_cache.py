@@ -0,0 +1,138 @@
+# backend/result_cache.py
+"""
+Caché de resultados de /reference/process_active.
+
+La clave es (id de referencia, hash del plan de filtros); el valor son las
+métricas y los bytes de processed.png. En memoria se guarda un LRU con
+presupuesto en bytes; opcionalmente cada entrada se escribe también en
+disco (<dir>/<ref_id>/<hash>.png + .json) para sobrevivir reinicios.
+Cada carpeta <ref_id> lleva el archivo MARKER; invalidate() solo borra las
+carpetas que lo tienen, por si RESULT_CACHE_DIR apunta a un directorio con
+otros datos.
+"""
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+
+MARKER = ".result_cache"
+
+
+class ResultCache:
+    def __init__(self, max_bytes: int, disk_dir: str = None):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir or None
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self._entries = OrderedDict()  # key -> (result, png, bytes)
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    # ------------------------------------------------------------
+    def _disk_paths(self, key):
+        ref_id, plan_hash = key
+        folder = os.path.join(self.disk_dir, str(ref_id))
+        return (os.path.join(folder, f"{plan_hash}.png"),
+                os.path.join(folder, f"{plan_hash}.json"))
+
+    def _read_disk(self, key):
+        png_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+            with open(png_path, "rb") as f:
+                png = f.read()
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        return result, png
+
+    def _write_disk(self, key, result, png):
+        png_path, meta_path = self._disk_paths(key)
+        folder = os.path.dirname(png_path)
+        os.makedirs(folder, exist_ok=True)
+        marker = os.path.join(folder, MARKER)
+        if not os.path.exists(marker):
+            open(marker, "wb").close()
+        for path, data in ((png_path, png),
+                           (meta_path, json.dumps(result).encode("utf-8"))):
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+
+    def _store(self, key, result, png):
+        size = len(png) + len(json.dumps(result))
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+        self._entries[key] = (result, png, size)
+        self._bytes += size
+        while self._bytes > self.max_bytes:
+            _, (_, _, evicted) = self._entries.popitem(last=False)
+            self._bytes -= evicted
+
+    # ------------------------------------------------------------
+    def get(self, key):
+        """(métricas, bytes PNG) para la clave, o None. Cuenta aciertos y fallos."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+
+        if self.disk_dir:
+            found = self._read_disk(key)
+            if found is not None:
+                with self._lock:
+                    self._store(key, *found)
+                    self.hits += 1
+                    self.disk_hits += 1
+                return found
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, result: dict, png: bytes):
+        with self._lock:
+            self._store(key, result, png)
+        if self.disk_dir:
+            self._write_disk(key, result, png)
+
+    def invalidate(self):
+        """Vacía la caché (se llama al activar una referencia nueva)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+        if self.disk_dir and os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                folder = os.path.join(self.disk_dir, name)
+                # Solo las carpetas que creó esta caché (<ref_id> con MARKER)
+                if name.isdigit() and os.path.isfile(os.path.join(folder, MARKER)):
+                    shutil.rmtree(folder, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "disk_hits": self.disk_hits,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_dir": self.disk_dir,
+            }
+
+
+result_cache = ResultCache(
+    max_bytes=int(os.getenv("RESULT_CACHE_MB", "256")) * 1024 * 1024,
+    disk_dir=os.getenv("RESULT_CACHE_DIR", ""),
+)
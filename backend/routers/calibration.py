@@ -0,0 +1,180 @@
+from fastapi import APIRouter, HTTPException, Depends, Body
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from functools import lru_cache
+from pathlib import Path
+import math
+import re
+
+import numpy as np
+
+from backend.database import get_db
+from backend.executor import run_cpu_threaded
+from backend.models import Sample
+from calibration import DEFAULT_DEGREE, METRICS, CalibrationModel, fit_calibration
+
+router = APIRouter(prefix="/calibration", tags=["calibration"])
+CALIBRATION_DIR = Path("backend/storage/calibrations")
+NAME_RE = re.compile(r"^[A-Za-z0-9_.-]{1,64}$")
+
+# Columnas de Sample para cada métrica del modelo. En las filas de muestras
+# iv_original es el IV medio de la muestra; rssd solo se usa si está por
+# píxel (rssd_unit, ver backend/models.py)
+SAMPLE_COLUMNS = {"IV": "iv_original", "ZNCC": "zncc", "rSSD": "rssd"}
+
+
+# ============================================================
+# Utils
+# ============================================================
+def model_path(name: str) -> Path:
+    if not NAME_RE.match(name):
+        raise HTTPException(status_code=400, detail="Nombre de calibración inválido")
+    return CALIBRATION_DIR / f"{name}.json"
+
+
+@lru_cache(maxsize=32)
+def _load(path: str, mtime: float) -> CalibrationModel:
+    return CalibrationModel.load(path)
+
+
+def load_model(name: str) -> CalibrationModel:
+    """Modelo guardado (cacheado mientras el archivo no cambie)."""
+    path = model_path(name)
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"Calibración no encontrada: {name}")
+    return _load(str(path), path.stat().st_mtime)
+
+
+def finite_or_none(values) -> list:
+    return [v if math.isfinite(v) else None for v in np.asarray(values, dtype=float).tolist()]
+
+
+def parse_metrics(metrics) -> list:
+    metrics = list(metrics or METRICS)
+    unknown = [m for m in metrics if m not in METRICS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Métricas desconocidas: {', '.join(unknown)}")
+    return metrics
+
+
+def sample_value(row, metric: str) -> float:
+    """Valor de la métrica en la fila, NaN si falta o (rSSD) no está por píxel."""
+    value = getattr(row, SAMPLE_COLUMNS[metric])
+    if value is None or (metric == "rSSD" and row.rssd_unit != "pixel"):
+        return float("nan")
+    return value
+
+
+def labelled_samples(db: Session, run_ids=None):
+    """Muestras con n conocido (n_value), opcionalmente de ciertas corridas."""
+    q = db.query(Sample).filter(Sample.n_value.isnot(None))
+    if run_ids:
+        q = q.filter(Sample.run_id.in_(run_ids))
+    return q.all()
+
+
+# ============================================================
+# Ajuste
+# ============================================================
+@router.post("/fit")
+def fit(body: dict = Body(...), db: Session = Depends(get_db)):
+    """
+    Ajusta las curvas métrica(n) con las muestras de la base que tienen
+    n_value (las de las corridas run_ids, o todas) y guarda el modelo.
+    kind ("poly" o "monotone") elige el tipo de curva; con strict=true una
+    curva no monótona es un 400 en lugar de una advertencia.
+    """
+    name = body.get("name") or "default"
+    path = model_path(name)
+    metrics = parse_metrics(body.get("metrics"))
+    degree = int(body.get("degree", DEFAULT_DEGREE))
+    kind = body.get("kind", "poly")
+    strict = bool(body.get("strict", False))
+
+    rows = labelled_samples(db, body.get("run_ids"))
+    if not rows:
+        raise HTTPException(status_code=400, detail="No hay muestras con n_value para calibrar")
+
+    n = [r.n_value for r in rows]
+    table = {m: [sample_value(r, m) for r in rows] for m in metrics}
+    sources = sorted({r.run_id for r in rows if r.run_id})
+    try:
+        model = fit_calibration(n, table, metrics, degree, name=name, sources=sources,
+                                kind=kind, strict=strict)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    model.save(str(path))
+
+    return {
+        "name": name,
+        "n_range": list(model.n_range),
+        "n_samples": len(rows),
+        "sources": sources,
+        "curves": model.summary(),
+        "warnings": model.warnings,
+    }
+
+
+# ============================================================
+# Consultar modelos
+# ============================================================
+@router.get("")
+def list_models():
+    if not CALIBRATION_DIR.exists():
+        return {"items": []}
+    items = []
+    for path in sorted(CALIBRATION_DIR.glob("*.json")):
+        model = _load(str(path), path.stat().st_mtime)
+        items.append({
+            "name": path.stem,
+            "created_at": model.created_at,
+            "n_range": list(model.n_range),
+            "metrics": model.metrics,
+        })
+    return {"items": items}
+
+
+@router.get("/{name}")
+def get_model(name: str):
+    return load_model(name).to_dict()
+
+
+# ============================================================
+# Búsqueda inversa
+# ============================================================
+@router.post("/{name}/predict")
+async def predict(name: str, body: dict = Body(...)):
+    """
+    n estimado para muchos vectores de métricas en una llamada.
+
+    Acepta {"metrics": ["IV", "ZNCC"], "values": [[iv, zncc], ...]} o
+    columnas {"IV": [...], "ZNCC": [...]}. Los valores null se ignoran
+    para esa fila.
+    """
+    model = await run_in_threadpool(load_model, name)
+
+    if "values" in body:
+        metrics = list(body.get("metrics") or model.metrics)
+        values = body["values"]
+    else:
+        metrics = [m for m in model.metrics if m in body]
+        if not metrics:
+            raise HTTPException(status_code=400, detail="Envíe values o columnas de métricas")
+        lengths = {len(body[m]) for m in metrics}
+        if len(lengths) != 1:
+            raise HTTPException(status_code=400, detail="Las columnas deben tener el mismo largo")
+        values = list(zip(*(body[m] for m in metrics)))
+
+    try:
+        values = np.array(values, dtype=np.float64).reshape(-1, len(metrics))
+        n, n_std, chi2 = await run_cpu_threaded(model.predict, values, metrics)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {
+        "name": name,
+        "metrics": metrics,
+        "n": finite_or_none(n),
+        "n_std": finite_or_none(n_std),
+        "chi2": finite_or_none(chi2),
+    }
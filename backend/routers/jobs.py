@@ -0,0 +1,179 @@
+from fastapi import APIRouter, HTTPException, Depends, Body, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from pathlib import Path
+import asyncio
+import json
+import os
+
+from backend.database import get_db
+from backend.ingest import ingest_jobs
+from backend.jobs import TERMINAL, job_manager
+from backend.routers.reference import get_active_reference
+from io_utils import load_config
+
+router = APIRouter(prefix="/jobs", tags=["jobs"])
+
+# Comentario SSE para mantener viva la conexión (segundos)
+KEEPALIVE_SECONDS = 15
+
+# Los trabajos solo leen bajo estas raíces (además de paths.raw de
+# config.yaml); JOB_DATA_ROOTS agrega otras separadas por os.pathsep
+DEFAULT_CONFIG = "config.yaml"
+STORAGE_DIR = "backend/storage"
+
+
+# ============================================================
+# Utils
+# ============================================================
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def data_roots() -> list:
+    """Carpetas bajo las que un trabajo puede leer (resueltas)."""
+    roots = [STORAGE_DIR]
+    if Path(DEFAULT_CONFIG).is_file():
+        raw = (load_config(DEFAULT_CONFIG).get("paths") or {}).get("raw")
+        if raw:
+            roots.append(raw)
+    roots += [r for r in os.getenv("JOB_DATA_ROOTS", "").split(os.pathsep) if r]
+    return [Path(r).resolve() for r in roots]
+
+
+def allowed_path(path: str, what: str, roots=None) -> str:
+    """Ruta resuelta si está bajo alguna raíz permitida; si no, 400."""
+    resolved = Path(path).resolve()
+    if not any(resolved.is_relative_to(root) for root in (roots or data_roots())):
+        raise HTTPException(status_code=400, detail=f"{what} fuera de las carpetas de datos: {path}")
+    return str(resolved)
+
+
+def build_params(kind: str, params: dict, db: Session) -> dict:
+    """Valida los parámetros del trabajo y completa los valores por defecto."""
+    if kind == "sample_folder":
+        folder = params.get("folder")
+        if not folder:
+            raise HTTPException(status_code=400, detail="Falta la carpeta de cuadros (folder)")
+        folder = allowed_path(folder, "Carpeta de cuadros")
+        if not Path(folder).exists():
+            raise HTTPException(status_code=400, detail=f"Carpeta de cuadros no existe: {folder}")
+        reference_path = params.get("reference_path")
+        if reference_path:
+            reference_path = allowed_path(reference_path, "Referencia")
+        else:
+            ref = get_active_reference(db)
+            if not ref:
+                raise HTTPException(status_code=404, detail="No hay referencia activa")
+            reference_path = ref.path
+        return {
+            "reference_path": reference_path,
+            "folder": folder,
+            "batch_size": int(params.get("batch_size", 32)),
+            "roi": params.get("roi"),
+        }
+
+    if kind == "analysis_run":
+        # La configuración es la del proyecto o una guardada en storage, y
+        # los cuadros que lee (paths.raw) deben estar bajo las raíces de datos
+        config = params.get("config", DEFAULT_CONFIG)
+        roots = data_roots()
+        if Path(config).resolve() != Path(DEFAULT_CONFIG).resolve():
+            config = allowed_path(config, "Configuración", [Path(STORAGE_DIR).resolve()])
+        if not Path(config).is_file():
+            raise HTTPException(status_code=400, detail=f"Configuración no existe: {config}")
+        try:
+            raw = load_config(config)["paths"]["raw"]
+        except (KeyError, TypeError, ValueError) as e:
+            raise HTTPException(status_code=400, detail=f"Configuración inválida: {e}")
+        allowed_path(raw, "paths.raw", roots)
+        return {
+            "config": config,
+            "store_frames": bool(params.get("store_frames", False)),
+            "use_cache": bool(params.get("use_cache", True)),
+        }
+
+    raise HTTPException(status_code=400, detail=f"Tipo de trabajo desconocido: {kind}")
+
+
+# ============================================================
+# Crear / consultar / cancelar
+# ============================================================
+@router.post("")
+async def submit_job(body: dict = Body(...), db: Session = Depends(get_db)):
+    kind = body.get("kind")
+    params = await run_in_threadpool(build_params, kind, body.get("params") or {}, db)
+    return await run_in_threadpool(job_manager.submit, kind, params)
+
+
+@router.get("")
+def list_jobs(limit: int = 50):
+    return {"items": job_manager.list(limit)}
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: str):
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job["status"] in TERMINAL or not job_manager.cancel(job_id):
+        raise HTTPException(status_code=409, detail=f"El trabajo ya terminó ({job['status']})")
+    return {"id": job_id, "message": "Cancelación solicitada"}
+
+
+@router.post("/{job_id}/ingest")
+def ingest_job(job_id: str):
+    """Copia las filas del trabajo terminado a la tabla samples (idempotente)."""
+    job = job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    if job["status"] != "done":
+        raise HTTPException(status_code=409, detail=f"El trabajo no terminó ({job['status']})")
+    inserted, skipped = ingest_jobs([job_id])
+    return {"id": job_id, "inserted": inserted, "skipped": skipped}
+
+
+# ============================================================
+# Avance (Server-Sent Events)
+# ============================================================
+@router.get("/{job_id}/events")
+async def job_events(job_id: str, request: Request):
+    # Suscribirse antes de leer el estado para no perder el evento final
+    queue = job_manager.subscribe(job_id)
+    job = await run_in_threadpool(job_manager.get, job_id)
+    if not job:
+        job_manager.unsubscribe(job_id, queue)
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+
+    async def stream():
+        try:
+            yield sse("status", job)
+            if job["status"] in TERMINAL:
+                return
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse(event["event"], event)
+                if event["status"] in TERMINAL:
+                    return
+        finally:
+            # El trabajo sigue corriendo aunque el cliente se vaya
+            job_manager.unsubscribe(job_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
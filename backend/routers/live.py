@@ -0,0 +1,104 @@
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect, HTTPException, Depends
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from typing import Optional
+import json
+
+from backend.database import get_db
+from backend.executor import run_cpu_threaded
+from backend.routers.reference import get_active_reference, get_decoded_reference
+from backend.routers.samples import parse_roi
+from backend.speckle_processor_zip import decode_frame
+from frame_sources import roi_slices
+from live import LiveMetrics, crop_reference
+
+router = APIRouter(prefix="/live", tags=["live"])
+
+
+# ============================================================
+# Utils
+# ============================================================
+def live_update(live: LiveMetrics, data: bytes, roi) -> dict:
+    """Decodifica un cuadro y lo incorpora (corre en el pool de CPU)."""
+    frame = decode_frame(data)
+    return live.update(frame[roi_slices(roi, frame.shape)])
+
+
+# ============================================================
+# Cuadros por WebSocket
+# ============================================================
+@router.websocket("/ws")
+async def live_ws(
+    websocket: WebSocket,
+    window: Optional[int] = None,
+    roi: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """
+    Métricas en vivo contra la referencia activa.
+
+    El cliente envía cada cuadro como mensaje binario (PNG/TIFF/JPG) y
+    recibe un JSON con IV / ZNCC / rSSD del cuadro y del promedio acumulado
+    (de los últimos `window` cuadros si se indica). Mensajes de texto:
+    {"action": "reset"} vacía el promedio; {"action": "window", "window": N}
+    lo reinicia con otra ventana (0 o null = sin ventana).
+    """
+    await websocket.accept()
+    try:
+        roi = parse_roi(roi)
+        ref = await run_in_threadpool(get_active_reference, db)
+        if not ref:
+            raise HTTPException(status_code=404, detail="No hay referencia activa")
+        active = await get_decoded_reference(ref)
+        live = LiveMetrics(crop_reference(active.u8, roi), window=window)
+    except (HTTPException, ValueError) as e:
+        await websocket.send_json({"error": getattr(e, "detail", str(e))})
+        await websocket.close(code=1008)
+        return
+    finally:
+        # La sesión no se usa más: no retener una conexión del pool
+        db.close()
+
+    await websocket.send_json({
+        "reference_id": ref.id,
+        "shape": list(live.shape),
+        "window": live.window,
+    })
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+
+            if message.get("bytes") is not None:
+                try:
+                    result = await run_cpu_threaded(live_update, live, message["bytes"], roi)
+                except ValueError as e:
+                    await websocket.send_json({"error": str(e)})
+                    continue
+                except HTTPException as e:  # pool de CPU lleno: se descarta el cuadro
+                    await websocket.send_json({"error": e.detail, "dropped": True})
+                    continue
+                await websocket.send_json(result)
+                continue
+
+            try:
+                command = json.loads(message.get("text") or "{}")
+            except ValueError:
+                command = {}
+            action = command.get("action")
+            if action == "reset":
+                live.reset()
+            elif action == "window":
+                try:
+                    live = LiveMetrics(live.ref, window=command.get("window"))
+                except (ValueError, TypeError) as e:
+                    await websocket.send_json({"error": str(e)})
+                    continue
+            else:
+                await websocket.send_json({"error": f"Acción desconocida: {action}"})
+                continue
+            await websocket.send_json({"action": action, "window": live.window, "n": 0})
+    except WebSocketDisconnect:
+        return
@@ -1,16 +1,24 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Body, Request
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Body, Request, Query
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy import literal, select, tuple_
 from sqlalchemy.orm import Session
 from pathlib import Path
+from datetime import datetime
+from typing import Optional
 import numpy as np
 from PIL import Image
 import io
-import cv2
 import shutil
-import json
-from typing import Any
 
 from backend.database import get_db
+from backend.executor import run_cpu, run_cpu_threaded
+from backend.filters import compile_plan
 from backend.models import Reference, Sample
+from backend.reference_cache import (ActiveReference, get_reference, load_reference,
+                                     reference_cache)
+from backend.result_cache import result_cache
+from metrics import compute_all
+from timing import timed
 
 router = APIRouter(prefix="/reference", tags=["reference"])
 BASE_DIR = Path("backend/storage/references")
@@ -24,23 +32,36 @@ def abs_url(request: Request, path: str) -> str:
     return f"{base}{path}"
 
 
-# ============================================================
-# Upload referencia (IMAGEN ÚNICA)
-# ============================================================
-@router.post("/upload")
-async def upload_reference(
-    request: Request,
-    file: UploadFile = File(...),
-    db: Session = Depends(get_db),
-):
-    if not file.content_type.startswith("image/"):
-        raise HTTPException(status_code=400, detail="El archivo no es una imagen")
+@timed("image_decode")
+def decode_reference(content: bytes):
+    """
+    Decodifica bytes de imagen a escala de grises uint8 y calcula su IV.
+    Corre en el pool de CPU.
+    """
+    gray = np.array(Image.open(io.BytesIO(content)).convert("L"), dtype=np.uint8)
+    return gray, float(np.mean(gray, dtype=np.float64))
+
+
+@timed("image_encode")
+def save_png(img: np.ndarray, dest: str) -> str:
+    Path(dest).parent.mkdir(parents=True, exist_ok=True)
+    Image.fromarray(img).save(dest)
+    return dest
 
+
+def write_bytes(data: bytes, dest: str) -> str:
+    Path(dest).parent.mkdir(parents=True, exist_ok=True)
+    with open(dest, "wb") as f:
+        f.write(data)
+    return dest
+
+
+def create_active_reference(db: Session, filename: str) -> Reference:
     # Desactivar referencias anteriores
     db.query(Reference).update({Reference.active: False})
 
     ref = Reference(
-        filename=file.filename,
+        filename=filename,
         path="",
         iv=None,
         active=True,
@@ -48,21 +69,62 @@ async def upload_reference(
     db.add(ref)
     db.commit()
     db.refresh(ref)
+    return ref
+
+
+def finish_reference(db: Session, ref: Reference, path: str, iv: float) -> Reference:
+    ref.iv = iv
+    ref.path = path
+    db.commit()
+    db.refresh(ref)
+    return ref
 
-    ref_dir = BASE_DIR / str(ref.id)
-    ref_dir.mkdir(parents=True, exist_ok=True)
-    dest = ref_dir / "original.png"
+
+def get_active_reference(db: Session):
+    return db.query(Reference).filter(Reference.active == True).first()
+
+
+async def get_decoded_reference(ref: Reference) -> ActiveReference:
+    """Referencia decodificada desde la caché del proceso; la carga si falta."""
+    active = reference_cache.get(ref.id)
+    if active is None:
+        if not Path(ref.path).exists():
+            raise HTTPException(status_code=404, detail="Archivo de referencia no existe")
+        # En hilos: la entrada es para la caché de este proceso
+        active = await run_cpu_threaded(load_reference, ref.id, ref.path)
+        reference_cache.set(active)
+    return active
+
+
+# ============================================================
+# Upload referencia (IMAGEN ÚNICA)
+# ============================================================
+@router.post("/upload")
+async def upload_reference(
+    request: Request,
+    file: UploadFile = File(...),
+    db: Session = Depends(get_db),
+):
+    if not file.content_type.startswith("image/"):
+        raise HTTPException(status_code=400, detail="El archivo no es una imagen")
 
     content = await file.read()
-    image = Image.open(io.BytesIO(content)).convert("L")
-    image.save(dest)
+    try:
+        gray, iv = await run_cpu(decode_reference, content)
+    except HTTPException:
+        raise
+    except Exception:
+        raise HTTPException(status_code=400, detail="No se pudo decodificar la imagen")
 
-    img = np.array(image, dtype=np.float32)
-    ref.iv = float(np.mean(img))
-    ref.path = str(dest)
+    ref = await run_in_threadpool(create_active_reference, db, file.filename)
+    reference_cache.invalidate()
+    result_cache.invalidate()
 
-    db.commit()
-    db.refresh(ref)
+    dest = BASE_DIR / str(ref.id) / "original.png"
+    await run_cpu(save_png, gray, str(dest))
+    reference_cache.set(await run_cpu_threaded(ActiveReference, ref.id, str(dest), gray))
+
+    ref = await run_in_threadpool(finish_reference, db, ref, str(dest), iv)
 
     return {
         "message": "Referencia guardada y activada",
@@ -80,7 +142,7 @@ async def upload_reference(
 # ============================================================
 @router.get("/current")
 def get_current_reference(request: Request, db: Session = Depends(get_db)):
-    ref = db.query(Reference).filter(Reference.active == True).first()
+    ref = get_active_reference(db)
     if not ref:
         raise HTTPException(status_code=404, detail="No hay referencia activa")
 
@@ -105,6 +167,7 @@ def get_current_reference(request: Request, db: Session = Depends(get_db)):
         "iv_processed": latest.iv_processed if latest else None,
         "zncc": latest.zncc if latest else None,
         "rssd": latest.rssd if latest else None,
+        "rssd_unit": latest.rssd_unit if latest else None,
         "filter_metrics": latest.filter_metrics if latest else None,
         "active": ref.active,
         "original_url_png": abs_url(
@@ -115,291 +178,63 @@ def get_current_reference(request: Request, db: Session = Depends(get_db)):
 
 
 # ============================================================
-# Procesar referencia activa
+# Cadena de filtros (corre en el pool de CPU)
 # ============================================================
-@router.post("/process_active")
-def process_active_reference(
-    request: Request,
-    body: dict = Body(...),
-    db: Session = Depends(get_db),
-):
-    filters = body.get("filters", {})
-    params = body.get("params", {})
-
-    ref = db.query(Reference).filter(Reference.active == True).first()
-    if not ref:
-        raise HTTPException(status_code=404, detail="No hay referencia activa")
-
-    ref_path = Path(ref.path)
-    if not ref_path.exists():
-        raise HTTPException(status_code=404, detail="Archivo de referencia no existe")
-
-    orig = np.array(Image.open(ref_path).convert("L"), dtype=np.uint8)
-    processed = orig.copy()
-
-    filter_metrics: dict[str, Any] = {}
-    errores = []
-
-    # ==========================
-    # GAUSSIAN
-    # ==========================
-    if filters.get("gaussian"):
-        try:
-            p = params.get("gaussian", {})
-            k = int(p.get("ksize", 5))
-            if k % 2 == 0:
-                k += 1
-
-            processed = cv2.GaussianBlur(processed, (k, k), 0)
-
-            filter_metrics["gaussian"] = {
-                "ksize": k,
-                "varianza": float(np.var(processed)),
-                "energia": float(np.sum(processed.astype(np.float32) ** 2)),
-                "media": float(np.mean(processed)),
-            }
-        except Exception as e:
-            errores.append(f"gaussian: {e}")
-
-    # ==========================
-    # MEDIAN
-    # ==========================
-    if filters.get("median"):
-        try:
-            p = params.get("median", {})
-            k = int(p.get("ksize", 5))
-            if k % 2 == 0:
-                k += 1
-
-            processed = cv2.medianBlur(processed, k)
-
-            filter_metrics["median"] = {
-                "ksize": k,
-                "desviacion_std": float(np.std(processed)),
-                "varianza": float(np.var(processed)),
-            }
-        except Exception as e:
-            errores.append(f"median: {e}")
-
-    # ==========================
-    # EQUALIZE HIST
-    # ==========================
-    if filters.get("equalize_hist"):
-        try:
-            processed = cv2.equalizeHist(processed)
-
-            filter_metrics["equalize_hist"] = {
-                "contraste": float(processed.max() - processed.min()),
-                "entropia": float(
-                    -np.sum(
-                        (np.histogram(processed, bins=256)[0] / processed.size + 1e-9)
-                        * np.log2(
-                            np.histogram(processed, bins=256)[0] / processed.size + 1e-9
-                        )
-                    )
-                ),
-            }
-        except Exception as e:
-            errores.append(f"equalize_hist: {e}")
-
-    # ==========================
-    # CANNY
-    # ==========================
-    if filters.get("canny"):
-        try:
-            p = params.get("canny", {})
-            t1 = int(p.get("threshold1", 100))
-            t2 = int(p.get("threshold2", 200))
-
-            edges = cv2.Canny(processed, t1, t2)
-            processed = edges
-
-            filter_metrics["canny"] = {
-                "threshold1": t1,
-                "threshold2": t2,
-                "bordes_detectados": int(np.sum(edges > 0)),
-                "densidad_bordes": float(np.mean(edges > 0)),
-            }
-        except Exception as e:
-            errores.append(f"canny: {e}")
-
-    # ==========================
-    # BLUR
-    # ==========================
-    if filters.get("blur"):
-        try:
-            p = params.get("blur", {})
-            k = int(p.get("ksize", 5))
-            if k % 2 == 0:
-                k += 1
-
-            processed = cv2.blur(processed, (k, k))
-
-            filter_metrics["blur"] = {
-                "ksize": k,
-                "varianza": float(np.var(processed)),
-            }
-        except Exception as e:
-            errores.append(f"blur: {e}")
-
-    # ==========================
-    # BILATERAL
-    # ==========================
-    if filters.get("bilateral"):
-        try:
-            p = params.get("bilateral", {})
-            d = int(p.get("d", 5))
-            sc = int(p.get("sigmaColor", 75))
-            ss = int(p.get("sigmaSpace", 75))
-
-            processed = cv2.bilateralFilter(processed, d, sc, ss)
-
-            filter_metrics["bilateral"] = {
-                "d": d,
-                "sigmaColor": sc,
-                "sigmaSpace": ss,
-                "varianza": float(np.var(processed)),
-            }
-        except Exception as e:
-            errores.append(f"bilateral: {e}")
-
-    # ==========================
-    # LAPLACIAN
-    # ==========================
-    if filters.get("laplacian"):
-        try:
-            p = params.get("laplacian", {})
-            k = int(p.get("ksize", 1))
-            if k % 2 == 0:
-                k += 1
-
-            lap = cv2.Laplacian(processed, cv2.CV_64F, ksize=k)
-            processed = cv2.convertScaleAbs(lap)
-
-            filter_metrics["laplacian"] = {
-                "ksize": k,
-                "varianza": float(np.var(lap)),
-                "energia": float(np.sum(lap ** 2)),
-                "pixels_border": int(np.sum(np.abs(lap) > 0)),
-            }
-        except Exception as e:
-            errores.append(f"laplacian: {e}")
-
-    # ==========================
-    # SOBEL
-    # ==========================
-    if filters.get("sobel"):
-        try:
-            p = params.get("sobel", {})
-            dx = int(p.get("dx", 1))
-            dy = int(p.get("dy", 0))
-            k = int(p.get("ksize", 3))
-
-            sob = cv2.Sobel(processed, cv2.CV_64F, dx, dy, ksize=k)
-            processed = cv2.convertScaleAbs(sob)
-
-            filter_metrics["sobel"] = {
-                "dx": dx,
-                "dy": dy,
-                "ksize": k,
-                "energia": float(np.sum(sob ** 2)),
-            }
-        except Exception as e:
-            errores.append(f"sobel: {e}")
-
-    # ==========================
-    # THRESHOLD
-    # ==========================
-    if filters.get("threshold"):
-        try:
-            p = params.get("threshold", {})
-            th = int(p.get("thresh", 127))
-            mv = int(p.get("maxval", 255))
-
-            _, processed = cv2.threshold(
-                processed, th, mv, cv2.THRESH_BINARY
-            )
-
-            filter_metrics["threshold"] = {
-                "thresh": th,
-                "pixeles_blancos": int(np.sum(processed == 255)),
-            }
-        except Exception as e:
-            errores.append(f"threshold: {e}")
-
-    # ==========================
-    # INVERT
-    # ==========================
-    if filters.get("invert"):
-        processed = cv2.bitwise_not(processed)
-        filter_metrics["invert"] = {
-            "media": float(np.mean(processed)),
-        }
-
-    # ==========================
-    # SHARPEN
-    # ==========================
-    if filters.get("sharpen"):
-        try:
-            p = params.get("sharpen", {})
-            strength = float(p.get("strength", 1))
-
-            kernel = np.array(
-                [[0, -1, 0], [-1, 5 + strength, -1], [0, -1, 0]]
-            )
-            processed = cv2.filter2D(processed, -1, kernel)
-
-            filter_metrics["sharpen"] = {
-                "strength": strength,
-                "varianza": float(np.var(processed)),
-            }
-        except Exception as e:
-            errores.append(f"sharpen: {e}")
+def run_filter_chain(ref_id: int, ref_path: str, filters: dict, params: dict,
+                     out_path: str) -> dict:
+    """
+    Aplica los filtros a la referencia decodificada (de la caché del proceso
+    que ejecuta la tarea: solo viajan el id y la ruta, no la imagen), guarda
+    processed.png y devuelve las métricas. Si algún filtro falla devuelve
+    {"errores": [...]} sin guardar.
+    """
+    ref = get_reference(ref_id, ref_path)
+    plan = compile_plan(filters, params)
+    processed, filter_metrics, errores = plan.run(ref.u8)
 
     if errores:
-        raise HTTPException(status_code=400, detail=errores)
+        return {"errores": errores}
 
     # ============================================================
-    # Guardar imagen procesada
+    # Guardar imagen procesada (los bytes quedan para la caché)
     # ============================================================
-    out_path = ref_path.parent / "processed.png"
-    Image.fromarray(processed).save(out_path)
+    buf = io.BytesIO()
+    with timed("image_encode"):
+        Image.fromarray(processed).save(buf, format="PNG")
+    png = buf.getvalue()
+    write_bytes(png, out_path)
 
     # ============================================================
-    # Métricas globales
+    # Métricas globales (una pasada por bloques, acumulando en float64)
     # ============================================================
-    iv_processed = float(np.mean(processed))
-
-    x = orig.astype(np.float32)
-    y = processed.astype(np.float32)
+    values = compute_all(processed, ref.stats)
 
-    zncc = float(
-        np.sum((x - x.mean()) * (y - y.mean()))
-        / (np.linalg.norm(x - x.mean()) * np.linalg.norm(y - y.mean()))
-    )
+    return {
+        "iv_processed": values["IV"],
+        "zncc": values["ZNCC"],
+        "rssd": values["rSSD"],
+        "rssd_unit": "pixel",
+        "filter_metrics": filter_metrics,
+        "errores": [],
+        "png": png,
+    }
 
-    rssd = float(np.sum((x - y) ** 2))
-
-    sample = Sample(
-        filename=ref.filename,
-        iv_original=ref.iv,
-        iv_processed=iv_processed,
-        zncc=zncc,
-        rssd=rssd,
-        ops=[k for k, v in filters.items() if v],
-        params=params,
-        filter_metrics=filter_metrics,
-    )
 
+def save_sample(db: Session, sample: Sample) -> Sample:
     db.add(sample)
     db.commit()
+    return sample
 
+
+def process_response(request: Request, ref: Reference, result: dict, cached: bool) -> dict:
     return {
         "message": "Referencia activa procesada",
         "iv_original": ref.iv,
-        "iv_processed": iv_processed,
-        "zncc": zncc,
-        "rssd": rssd,
+        "iv_processed": result["iv_processed"],
+        "zncc": result["zncc"],
+        "rssd": result["rssd"],
+        "rssd_unit": result["rssd_unit"],
+        "cached": cached,
         "original_url_png": abs_url(
             request, f"/static/references/{ref.id}/original.png"
         ),
@@ -409,26 +244,157 @@ def process_active_reference(
     }
 
 
+# ============================================================
+# Procesar referencia activa
+# ============================================================
+@router.post("/process_active")
+async def process_active_reference(
+    request: Request,
+    body: dict = Body(...),
+    db: Session = Depends(get_db),
+):
+    filters = body.get("filters", {})
+    params = body.get("params", {})
+
+    ref = await run_in_threadpool(get_active_reference, db)
+    if not ref:
+        raise HTTPException(status_code=404, detail="No hay referencia activa")
+
+    out_path = Path(ref.path).parent / "processed.png"
+    key = (ref.id, compile_plan(filters, params).hash)
+
+    cached = await run_in_threadpool(result_cache.get, key)
+    if cached is not None and cached[0].get("rssd_unit") != "pixel":
+        cached = None  # entrada con rSSD sumado (anterior a rssd_unit): se recalcula
+    if cached is not None:
+        # Se reescribe siempre: otro proceso pudo dejar otro plan en processed.png
+        result, png = cached
+        await run_in_threadpool(write_bytes, png, str(out_path))
+    else:
+        if not Path(ref.path).exists():
+            raise HTTPException(status_code=404, detail="Archivo de referencia no existe")
+        result = await run_cpu(
+            run_filter_chain, ref.id, ref.path, filters, params, str(out_path)
+        )
+        if result["errores"]:
+            raise HTTPException(status_code=400, detail=result["errores"])
+        png = result.pop("png")
+        await run_in_threadpool(result_cache.put, key, result, png)
+
+    sample = Sample(
+        filename=ref.filename,
+        iv_original=ref.iv,
+        iv_processed=result["iv_processed"],
+        zncc=result["zncc"],
+        rssd=result["rssd"],
+        rssd_unit=result["rssd_unit"],
+        ops=[k for k, v in filters.items() if v],
+        params=params,
+        filter_metrics=result["filter_metrics"],
+    )
+
+    await run_in_threadpool(save_sample, db, sample)
+
+    return process_response(request, ref, result, cached=cached is not None)
+
+
+# ============================================================
+# Estadísticas de la caché de resultados
+# ============================================================
+@router.get("/cache/stats")
+def get_cache_stats():
+    return result_cache.stats()
+
+
 # ============================================================
 # Historial
 # ============================================================
-@router.get("/history")
-def get_history(request: Request, db: Session = Depends(get_db)):
-    samples = db.query(Sample).order_by(Sample.created_at.desc()).all()
+HISTORY_FIELDS = (
+    "id", "filename", "iv_original", "iv_processed", "zncc", "rssd", "rssd_unit",
+    "ops", "params", "filter_metrics", "run_id", "sample_label", "n_value",
+    "n_frames", "created_at",
+)
+JSON_FIELDS = ("ops", "params", "filter_metrics")
+
+
+def parse_fields(fields: Optional[str]) -> tuple:
+    """
+    Columnas pedidas: todas por defecto, "summary" sin las columnas JSON, o
+    una lista separada por comas (id y created_at se incluyen siempre).
+    """
+    if not fields:
+        return HISTORY_FIELDS
+    if fields == "summary":
+        return tuple(f for f in HISTORY_FIELDS if f not in JSON_FIELDS)
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(HISTORY_FIELDS)
+    if unknown:
+        raise HTTPException(
+            status_code=400, detail=f"Campos desconocidos: {', '.join(sorted(unknown))}"
+        )
+    return tuple(f for f in HISTORY_FIELDS if f in requested or f in ("id", "created_at"))
+
+
+def query_history(db: Session, limit: int, cursor: Optional[int], fields: tuple,
+                  filename: Optional[str], date_from: Optional[datetime],
+                  date_to: Optional[datetime]) -> dict:
+    """
+    Una página del historial, de la más reciente a la más antigua.
+
+    Paginación por cursor sobre (created_at, id) con el índice
+    ix_samples_created_at_id: el costo no depende de cuántas filas hay antes
+    de la página. El cursor es el id de la última fila devuelta; su
+    created_at se toma de la propia tabla para comparar valores almacenados.
+    """
+    q = db.query(*(getattr(Sample, f) for f in fields))
+    if filename:
+        q = q.filter(Sample.filename == filename)
+    if date_from:
+        q = q.filter(Sample.created_at >= date_from)
+    if date_to:
+        q = q.filter(Sample.created_at < date_to)
+
+    if cursor is not None:
+        if db.query(Sample.id).filter(Sample.id == cursor).first() is None:
+            raise HTTPException(status_code=400, detail="Cursor inválido")
+        anchor = (
+            select(Sample.created_at).where(Sample.id == cursor).scalar_subquery()
+        )
+        q = q.filter(tuple_(Sample.created_at, Sample.id) < tuple_(anchor, literal(cursor)))
+
+    rows = (
+        q.order_by(Sample.created_at.desc(), Sample.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    items = []
+    for row in rows:
+        item = dict(row._mapping)
+        if item.get("created_at") is not None:
+            item["created_at"] = item["created_at"].isoformat()
+        items.append(item)
+
     return {
-        "items": [
-            {
-                "id": s.id,
-                "filename": s.filename,
-                "iv_original": s.iv_original,
-                "iv_processed": s.iv_processed,
-                "zncc": s.zncc,
-                "rssd": s.rssd,
-                "ops": s.ops,
-                "params": s.params,
-                "filter_metrics": s.filter_metrics,
-                "created_at": s.created_at.isoformat(),
-            }
-            for s in samples
-        ]
+        "items": items,
+        "next_cursor": rows[-1].id if has_more else None,
+        "limit": limit,
     }
+
+
+@router.get("/history")
+def get_history(
+    request: Request,
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[int] = None,
+    fields: Optional[str] = None,
+    filename: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: Session = Depends(get_db),
+):
+    return query_history(
+        db, limit, cursor, parse_fields(fields), filename, date_from, date_to
+    )
@@ -0,0 +1,407 @@
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends, Query, Request
+from fastapi.responses import Response
+from starlette.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session
+from pathlib import Path
+from typing import List, Optional
+import json
+import zipfile
+
+import numpy as np
+
+from backend.database import get_db
+from backend.executor import run_cpu_threaded
+from backend.models import Sample
+from backend.routers.reference import abs_url, get_active_reference, get_decoded_reference
+from backend.series import (
+    DEFAULT_POINTS,
+    METRICS,
+    downsample,
+    load_series,
+    parse_metrics,
+    save_series,
+    series_range,
+    to_json_list,
+)
+from backend.speckle_processor_zip import (
+    DEFAULT_BATCH_SIZE,
+    analyze_frame_stream,
+    iter_upload_frames,
+    iter_zip_frames,
+    local_maps_frame_stream,
+    spectrum_frame_stream,
+)
+from local_maps import (
+    DEFAULT_BATCH_SIZE as MAP_BATCH_SIZE,
+    DEFAULT_STRIDE,
+    DEFAULT_WINDOW,
+    METRICS as MAP_METRICS,
+    encode_png,
+    map_to_image,
+)
+
+router = APIRouter(prefix="/samples", tags=["samples"])
+
+# Tope de batch_size: los búferes de cada lote se preasignan (2 x lote x
+# píxeles float32 en /batch, 3 x lote x píxeles float64 en /local-maps)
+MAX_BATCH_SIZE = 256
+MAX_MAP_BATCH_SIZE = 32
+
+
+# ============================================================
+# Utils
+# ============================================================
+def parse_roi(roi: Optional[str]):
+    """ROI opcional como JSON {"x", "y", "w", "h"}."""
+    if not roi:
+        return None
+    try:
+        value = json.loads(roi)
+        return {k: int(value[k]) for k in ("x", "y", "w", "h")}
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="ROI inválida, se espera {x, y, w, h}")
+
+
+def drop_nonfinite_frames(result: dict) -> dict:
+    """
+    Quita de la serie (y de las medias) los cuadros con alguna métrica no
+    finita, informándolos en "errores": NaN / inf no se pueden enviar en JSON.
+    """
+    keys = ("iv", "zncc", "rssd")
+    values = np.array([result["series"][k] for k in keys], dtype=np.float64)
+    finite = np.isfinite(values).all(axis=0)
+    if finite.all():
+        return result
+
+    names = result["frames"]
+    result["errores"] = result["errores"] + [
+        f"{names[i]}: métricas no finitas, se omite" for i in np.flatnonzero(~finite)
+    ]
+    result["frames"] = [name for name, ok in zip(names, finite) if ok]
+    values = values[:, finite]
+    result["series"] = {k: values[j].tolist() for j, k in enumerate(keys)}
+    result["n_images"] = int(finite.sum())
+    for j, k in enumerate(keys):
+        result[k] = float(values[j].mean()) if result["n_images"] else None
+    return result
+
+
+def save_batch_sample(db: Session, ref, name: str, result: dict, roi) -> Sample:
+    """
+    Registra el análisis como Sample con su serie por cuadro en .npy. Se
+    valida antes de escribir nada: un resultado no finito no se persiste.
+    """
+    values = [result[k] for k in METRICS] + [v for k in METRICS for v in result["series"][k]]
+    if not np.isfinite(np.asarray(values, dtype=np.float64)).all():
+        raise ValueError("El resultado tiene métricas no finitas; no se guarda")
+
+    sample = Sample(
+        filename=name,
+        iv_original=result["iv"],
+        zncc=result["zncc"],
+        rssd=result["rssd"],
+        rssd_unit=result["rssd_unit"],
+        params={"source": "batch", "reference_id": ref.id, "roi": roi},
+        n_frames=result["n_images"],
+    )
+    db.add(sample)
+    series_path = None
+    try:
+        db.flush()
+        series_path = save_series(result["series"], f"sample-{sample.id}")
+        sample.series_path = series_path
+        db.commit()
+    except Exception:
+        db.rollback()
+        if series_path:
+            Path(series_path).unlink(missing_ok=True)
+        raise
+    db.refresh(sample)
+    return sample
+
+
+def analyze_zip(ref, fileobj, batch_size: int, roi) -> dict:
+    return analyze_frame_stream(ref, iter_zip_frames(fileobj), batch_size, roi)
+
+
+def analyze_uploads(ref, uploads, batch_size: int, roi) -> dict:
+    return analyze_frame_stream(ref, iter_upload_frames(uploads), batch_size, roi)
+
+
+# ============================================================
+# Análisis por lotes contra la referencia activa
+# ============================================================
+@router.post("/batch")
+async def analyze_batch(
+    request: Request,
+    archive: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
+    batch_size: int = Form(DEFAULT_BATCH_SIZE, ge=1, le=MAX_BATCH_SIZE),
+    roi: Optional[str] = Form(None),
+    save: bool = Form(True),
+    include_series: bool = Form(True),
+    db: Session = Depends(get_db),
+):
+    """
+    Recibe un ZIP (`archive`) o varios cuadros por multipart (`files`) y
+    devuelve IV / ZNCC / rSSD por cuadro y sus promedios, contra la
+    referencia activa. Con save (por defecto) el resultado queda como Sample
+    y la serie por cuadro en un .npy servido por /samples/{id}/series.
+    """
+    if archive is None and not files:
+        raise HTTPException(status_code=400, detail="Envíe un ZIP (archive) o cuadros (files)")
+    roi = parse_roi(roi)
+
+    ref = await run_in_threadpool(get_active_reference, db)
+    if not ref:
+        raise HTTPException(status_code=404, detail="No hay referencia activa")
+    active = await get_decoded_reference(ref)
+
+    # Los archivos subidos no se pueden enviar a otro proceso: corre en hilos
+    try:
+        if archive is not None:
+            result = await run_cpu_threaded(
+                analyze_zip, active.u8, archive.file, batch_size, roi
+            )
+        else:
+            result = await run_cpu_threaded(
+                analyze_uploads, active.u8, files, batch_size, roi
+            )
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="El archivo no es un ZIP válido")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if result["n_images"]:
+        result = drop_nonfinite_frames(result)
+    if result["n_images"] == 0:
+        raise HTTPException(
+            status_code=400,
+            detail=result["errores"] or ["No se encontraron cuadros de imagen"],
+        )
+
+    response = {
+        "reference_id": ref.id,
+        "filename": ref.filename,
+        **result,
+    }
+    if save:
+        name = archive.filename if archive is not None else files[0].filename
+        try:
+            sample = await run_in_threadpool(save_batch_sample, db, ref, name, result, roi)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        response["sample_id"] = sample.id
+        response["series_url"] = abs_url(request, f"/samples/{sample.id}/series")
+    if not include_series:
+        response.pop("series")
+    return response
+
+
+# ============================================================
+# Espectro de speckle
+# ============================================================
+def spectrum_zip(fileobj, batch_size: int, roi) -> dict:
+    return spectrum_frame_stream(iter_zip_frames(fileobj), batch_size, roi)
+
+
+def spectrum_uploads(uploads, batch_size: int, roi) -> dict:
+    return spectrum_frame_stream(iter_upload_frames(uploads), batch_size, roi)
+
+
+@router.post("/spectrum")
+async def spectrum_batch(
+    archive: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
+    batch_size: int = Form(DEFAULT_BATCH_SIZE, ge=1, le=MAX_BATCH_SIZE),
+    roi: Optional[str] = Form(None),
+):
+    """
+    Espectro de potencia radial medio (freq en ciclos/píxel) y tamaño de
+    grano por cuadro (ancho a media altura de la autocorrelación, en
+    píxeles) de un ZIP o de cuadros por multipart. No usa la referencia.
+    """
+    if archive is None and not files:
+        raise HTTPException(status_code=400, detail="Envíe un ZIP (archive) o cuadros (files)")
+    roi = parse_roi(roi)
+
+    try:
+        if archive is not None:
+            result = await run_cpu_threaded(spectrum_zip, archive.file, batch_size, roi)
+        else:
+            result = await run_cpu_threaded(spectrum_uploads, files, batch_size, roi)
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="El archivo no es un ZIP válido")
+
+    if result["n_images"] == 0:
+        raise HTTPException(
+            status_code=400,
+            detail=result["errores"] or ["No se encontraron cuadros de imagen"],
+        )
+    return result
+
+
+# ============================================================
+# Mapas locales
+# ============================================================
+def local_maps_zip(ref, fileobj, window: int, stride: int, batch_size: int, roi) -> dict:
+    return local_maps_frame_stream(ref, iter_zip_frames(fileobj), window, stride, batch_size, roi)
+
+
+def local_maps_uploads(ref, uploads, window: int, stride: int, batch_size: int, roi) -> dict:
+    return local_maps_frame_stream(ref, iter_upload_frames(uploads), window, stride, batch_size, roi)
+
+
+def render_map(values, vmin, vmax, scale: int) -> bytes:
+    return encode_png(map_to_image(values, vmin, vmax, scale))
+
+
+@router.post("/local-maps")
+async def local_maps_batch(
+    archive: Optional[UploadFile] = File(None),
+    files: Optional[List[UploadFile]] = File(None),
+    window: int = Form(DEFAULT_WINDOW),
+    stride: int = Form(DEFAULT_STRIDE),
+    batch_size: int = Form(MAP_BATCH_SIZE, ge=1, le=MAX_MAP_BATCH_SIZE),
+    roi: Optional[str] = Form(None),
+    metric: str = Form("ZNCC"),
+    format: str = Form("json"),
+    vmin: Optional[float] = Form(None),
+    vmax: Optional[float] = Form(None),
+    scale: Optional[int] = Form(None, ge=1, le=32),
+    db: Session = Depends(get_db),
+):
+    """
+    Mapas locales de IV / ZNCC / rSSD (ventanas window x window cada
+    stride píxeles, promediados sobre los cuadros) contra la referencia
+    activa. format=json devuelve la grilla y los tres mapas; format=png el
+    de `metric` como imagen con paleta (rango [vmin, vmax], por defecto el
+    del mapa, ampliado `scale` veces, por defecto stride); format=binary
+    ese mapa en float32 little-endian (filas, columnas).
+    """
+    if archive is None and not files:
+        raise HTTPException(status_code=400, detail="Envíe un ZIP (archive) o cuadros (files)")
+    if metric not in MAP_METRICS:
+        raise HTTPException(status_code=400, detail=f"Métrica desconocida: {metric}")
+    if format not in ("json", "png", "binary"):
+        raise HTTPException(status_code=400, detail="format debe ser json, png o binary")
+    roi = parse_roi(roi)
+
+    ref = await run_in_threadpool(get_active_reference, db)
+    if not ref:
+        raise HTTPException(status_code=404, detail="No hay referencia activa")
+    active = await get_decoded_reference(ref)
+
+    try:
+        if archive is not None:
+            result = await run_cpu_threaded(
+                local_maps_zip, active.u8, archive.file, window, stride, batch_size, roi
+            )
+        else:
+            result = await run_cpu_threaded(
+                local_maps_uploads, active.u8, files, window, stride, batch_size, roi
+            )
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="El archivo no es un ZIP válido")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if result["n_images"] == 0:
+        raise HTTPException(
+            status_code=400,
+            detail=result["errores"] or ["No se encontraron cuadros de imagen"],
+        )
+
+    if format == "json":
+        return {"reference_id": ref.id, **result}
+
+    values = np.asarray(result["maps"][metric], dtype=np.float32)
+    headers = {
+        "X-Map-Metric": metric,
+        "X-Map-Shape": f"{values.shape[0]},{values.shape[1]}",
+        "X-Map-Window": str(result["window"]),
+        "X-Map-Stride": str(result["stride"]),
+        "X-Map-Min": repr(float(values.min())),
+        "X-Map-Max": repr(float(values.max())),
+        "X-Map-Frames": str(result["n_images"]),
+    }
+    if format == "binary":
+        return Response(
+            content=values.astype("<f4", copy=False).tobytes(),
+            media_type="application/octet-stream",
+            headers={**headers, "X-Map-Dtype": "float32"},
+        )
+    png = await run_cpu_threaded(render_map, values, vmin, vmax, scale or result["stride"])
+    return Response(content=png, media_type="image/png", headers=headers)
+
+
+# ============================================================
+# Series por cuadro
+# ============================================================
+@router.get("/{sample_id}/series")
+def get_series(
+    sample_id: int,
+    start: int = Query(0, ge=0),
+    stop: Optional[int] = Query(None, ge=0),
+    metrics: Optional[str] = None,
+    format: str = Query("json", pattern="^(json|binary)$"),
+    points: int = Query(DEFAULT_POINTS, ge=1, le=100_000),
+    db: Session = Depends(get_db),
+):
+    """
+    Rango [start, stop) de la serie por cuadro de una muestra.
+
+    format=binary devuelve float32 little-endian en orden C con forma
+    (métricas, cuadros), descrita en las cabeceras X-Series-*. format=json
+    devuelve como máximo `points` puntos por métrica (media, mínimo y máximo
+    de cada intervalo) para graficar.
+    """
+    sample = db.get(Sample, sample_id)
+    if not sample or not sample.series_path:
+        raise HTTPException(status_code=404, detail="La muestra no tiene serie por cuadro")
+    if not Path(sample.series_path).exists():
+        raise HTTPException(status_code=404, detail="Archivo de serie no existe")
+
+    try:
+        rows = parse_metrics(metrics)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    arr = load_series(sample.series_path)
+    n_frames = arr.shape[1]
+    stop = n_frames if stop is None else min(stop, n_frames)
+    if start >= stop:
+        raise HTTPException(status_code=400, detail=f"Rango vacío: [{start}, {stop}) de {n_frames}")
+
+    values = series_range(arr, start, stop, rows)
+    names = [METRICS[r] for r in rows]
+
+    if format == "binary":
+        return Response(
+            content=values.astype("<f4", copy=False).tobytes(),
+            media_type="application/octet-stream",
+            headers={
+                "X-Series-Shape": f"{values.shape[0]},{values.shape[1]}",
+                "X-Series-Dtype": "float32",
+                "X-Series-Metrics": ",".join(names),
+                "X-Series-Start": str(start),
+                "X-Series-Frames": str(n_frames),
+            },
+        )
+
+    starts, means, mins, maxs = downsample(values, points)
+    return {
+        "sample_id": sample.id,
+        "n_frames": n_frames,
+        "start": start,
+        "stop": stop,
+        "frame": (starts + start).tolist(),
+        "series": {
+            name: {
+                "mean": to_json_list(means[i]),
+                "min": to_json_list(mins[i]),
+                "max": to_json_list(maxs[i]),
+            }
+            for i, name in enumerate(names)
+        },
+    }
@@ -0,0 +1,77 @@
+# backend/series.py
+"""
+Series por cuadro (IV, ZNCC, rSSD) guardadas como archivos .npy.
+
+Cada serie es un arreglo float32 (3, N) en backend/storage/series/, y la
+fila de Sample guarda la ruta (series_path) y N (n_frames). Se leen con
+mmap, así que pedir un rango no carga la serie completa. rssd se guarda por
+píxel, la misma unidad que Sample.rssd.
+"""
+import uuid
+from pathlib import Path
+
+import numpy as np
+
+SERIES_DIR = Path("backend/storage/series")
+METRICS = ("iv", "zncc", "rssd")
+
+# Puntos por defecto de la versión submuestreada para gráficos
+DEFAULT_POINTS = 1000
+
+
+def save_series(series: dict, name: str = None) -> str:
+    """Guarda {"iv": [...], "zncc": [...], "rssd": [...]} y devuelve la ruta."""
+    arr = np.asarray([series[m] for m in METRICS], dtype=np.float32)
+    SERIES_DIR.mkdir(parents=True, exist_ok=True)
+    path = SERIES_DIR / f"{name or uuid.uuid4().hex}.npy"
+    np.save(path, arr)
+    return str(path)
+
+
+def load_series(path: str) -> np.ndarray:
+    """Serie (3, N) mapeada en memoria, de solo lectura."""
+    return np.load(path, mmap_mode="r")
+
+
+def parse_metrics(metrics: str = None) -> list:
+    """Índices de las métricas pedidas ("iv,zncc"); todas por defecto."""
+    if not metrics:
+        return list(range(len(METRICS)))
+    names = [m.strip().lower() for m in metrics.split(",") if m.strip()]
+    unknown = [m for m in names if m not in METRICS]
+    if unknown:
+        raise ValueError(f"Métricas desconocidas: {', '.join(unknown)}")
+    return [METRICS.index(m) for m in names]
+
+
+def series_range(arr: np.ndarray, start: int, stop: int, rows: list) -> np.ndarray:
+    """Copia contigua float32 (len(rows), stop - start) del rango pedido."""
+    return np.ascontiguousarray(arr[rows, start:stop], dtype=np.float32)
+
+
+def to_json_list(values: np.ndarray) -> list:
+    """Lista para JSON con NaN / inf como null."""
+    values = np.asarray(values, dtype=np.float64)
+    return np.where(np.isfinite(values), values, None).tolist()
+
+
+def downsample(values: np.ndarray, points: int):
+    """
+    Reduce cada fila a `points` intervalos con media, mínimo y máximo (la
+    envolvente conserva picos que una media sola ocultaría). Devuelve
+    (inicios de intervalo, medias, mínimos, máximos).
+    """
+    n = values.shape[1]
+    if n <= points:
+        starts = np.arange(n)
+        return starts, values, values, values
+    edges = np.linspace(0, n, points + 1).astype(np.int64)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    sums = np.add.reduceat(values.astype(np.float64), starts, axis=1)
+    return (
+        starts,
+        (sums / counts).astype(np.float32),
+        np.minimum.reduceat(values, starts, axis=1),
+        np.maximum.reduceat(values, starts, axis=1),
+    )
@@ -1,7 +1,16 @@
+import os
+import zipfile
+
 import cv2
 import numpy as np
-from pathlib import Path
-import glob
+
+from frame_sources import IMAGE_EXTS, open_frame_source, read_gray, roi_slices, to_gray
+from local_maps import LocalMapEngine
+from spectrum import SpectrumEngine
+from timing import count, timed
+
+
+DEFAULT_BATCH_SIZE = 32
 
 
 def compute_iv(img):
@@ -19,26 +28,272 @@ def compute_zncc(ref, img):
 
 
 def compute_rssd(ref, img):
-    return float(np.sum((ref.astype(np.float32) - img.astype(np.float32)) ** 2))
+    """rSSD por píxel, ecuación (3): media de (I - I0)²."""
+    return float(np.mean((ref.astype(np.float32) - img.astype(np.float32)) ** 2))
+
+
+# Unidad de rSSD en los resultados (ver Sample.rssd_unit)
+RSSD_UNIT = "pixel"
+
+
+class BatchedFrameMetrics:
+    """
+    Calcula IV / ZNCC / rSSD por cuadro procesando lotes (B, H, W).
+
+    La referencia se centra y normaliza una sola vez. Cada lote se copia a
+    un búfer float32 preasignado, se centra en el lugar y las tres métricas
+    salen de reducciones vectorizadas (acumuladas en float64):
+
+      ZNCC = <ref_c, x_c> / (P * std_ref * std_x)   (0 si std_x == 0)
+      rSSD = |(ref_c - x_c) + (mean_ref - mean_x)|^2 / P
+
+    que equivalen a compute_zncc / compute_rssd cuadro a cuadro. rSSD se
+    suma directamente sobre la diferencia (y no desarrollando el cuadrado)
+    para que un cuadro igual a la referencia dé 0 exacto, y es por píxel
+    como en metrics.compute_all y Sample.rssd.
+    """
+
+    def __init__(self, ref, batch_size=DEFAULT_BATCH_SIZE):
+        ref = np.asarray(ref, dtype=np.float32)
+        self.shape = ref.shape
+        self.size = ref.size
+        self.batch_size = max(1, int(batch_size))
+
+        self.ref_mean = float(ref.mean(dtype=np.float64))
+        self.ref_c = (ref.ravel() - np.float32(self.ref_mean)).astype(np.float32)
+        self.ref_css = float(np.dot(self.ref_c.astype(np.float64),
+                                    self.ref_c.astype(np.float64)))
+        self.ref_std = float(np.sqrt(self.ref_css / self.size))
+
+        self._buf = np.empty((self.batch_size, self.size), dtype=np.float32)
+        self._tmp = np.empty_like(self._buf)
+        self._pending = 0
+
+        self.ivs = []
+        self.znccs = []
+        self.rssds = []
+
+    def add(self, img):
+        """Agrega un cuadro 2D; procesa el lote cuando se llena."""
+        if img.shape != self.shape:
+            raise ValueError(
+                f"Dimensiones inconsistentes con la referencia: {img.shape} != {self.shape}"
+            )
+        self._buf[self._pending] = img.ravel()
+        self._pending += 1
+        if self._pending == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Procesa los cuadros pendientes del lote actual."""
+        if self._pending == 0:
+            return
+        x = self._buf[:self._pending]
+        self._pending = 0
+        self._process(x)
+
+    @timed("frame_metrics_batch")
+    def _process(self, x):
+        """Métricas de un lote (n, píxeles) ya copiado al búfer."""
+        means = x.mean(axis=1, dtype=np.float64)
+        x -= means.astype(np.float32)[:, None]
+
+        tmp = self._tmp[:len(x)]
+        np.multiply(x, x, out=tmp)
+        css = tmp.sum(axis=1, dtype=np.float64)
+        np.multiply(x, self.ref_c, out=tmp)
+        cross = tmp.sum(axis=1, dtype=np.float64)
+        stds = np.sqrt(css / self.size)
+
+        # Cuadros constantes (oscuros o saturados): ZNCC = 0, como compute_all
+        denominator = self.size * self.ref_std * stds
+        with np.errstate(divide="ignore", invalid="ignore"):
+            znccs = np.where(denominator > 0, cross / denominator, 0.0)
+
+        np.subtract(self.ref_c, x, out=tmp)
+        tmp += (self.ref_mean - means).astype(np.float32)[:, None]
+        np.square(tmp, out=tmp)
+        rssds = tmp.sum(axis=1, dtype=np.float64) / self.size
+
+        self.ivs.extend(means.tolist())
+        self.znccs.extend(znccs.tolist())
+        self.rssds.extend(rssds.tolist())
+
+    def means(self):
+        """Medias de los cuadros ya procesados (sin vaciar el lote pendiente)."""
+        if not self.ivs:
+            return {"iv": None, "zncc": None, "rssd": None, "n_images": 0}
+        return {
+            "iv": float(np.mean(self.ivs)),
+            "zncc": float(np.mean(self.znccs)),
+            "rssd": float(np.mean(self.rssds)),
+            "n_images": len(self.ivs),
+        }
+
+    def result(self):
+        """Devuelve medias y series por cuadro de las tres métricas (rSSD por píxel)."""
+        self.flush()
+        return {
+            **self.means(),
+            "n_pixels": self.size,
+            "rssd_unit": RSSD_UNIT,
+            "series": {
+                "iv": list(self.ivs),
+                "zncc": list(self.znccs),
+                "rssd": list(self.rssds),
+            },
+        }
+
+
+def analyze_sample_zip(reference_path: str, folder_path: str,
+                       batch_size: int = DEFAULT_BATCH_SIZE, roi=None,
+                       progress=None):
+    """
+    Analiza los cuadros de una carpeta de PNG o de un TIFF multipágina
+    (leído con memmap, sin extraer PNG) contra la imagen de referencia.
+    Con roi ({x, y, w, h}) las métricas se calculan solo sobre esa región.
+    Si se pasa progress(hechos, total, medias) se llama tras cada lote.
+    """
+    ref = read_gray(reference_path)
+    rows, cols = roi_slices(roi, ref.shape)
+
+    engine = BatchedFrameMetrics(ref[rows, cols], batch_size=batch_size)
+    with open_frame_source(folder_path, exts=(".png",)) as source:
+        total = len(source)
+        for i in range(total):
+            engine.add(source.read(i, roi))
+            if progress is not None and ((i + 1) % engine.batch_size == 0 or i + 1 == total):
+                engine.flush()
+                progress(i + 1, total, engine.means())
+
+    return engine.result()
+
+
+@timed("image_decode")
+def decode_frame(data: bytes):
+    """Decodifica los bytes de un cuadro conservando su profundidad."""
+    count("frames_decoded")
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError("no se pudo decodificar")
+    return to_gray(img)
+
+
+def iter_zip_frames(fileobj, exts=IMAGE_EXTS):
+    """
+    Genera (nombre, bytes) de las imágenes de un ZIP, en orden de nombre.
+
+    Solo lee el directorio central y descomprime una entrada a la vez desde
+    el archivo (no se carga el ZIP completo en memoria).
+    """
+    with zipfile.ZipFile(fileobj) as zf:
+        names = sorted(
+            info.filename for info in zf.infolist()
+            if not info.is_dir()
+            and not os.path.basename(info.filename).startswith(".")
+            and not info.filename.startswith("__MACOSX/")
+            and info.filename.lower().endswith(exts)
+        )
+        for name in names:
+            with zf.open(name) as entry:
+                yield name, entry.read()
+
+
+def iter_upload_frames(uploads, exts=IMAGE_EXTS):
+    """Genera (nombre, bytes) de archivos subidos por multipart, uno a la vez."""
+    for upload in uploads:
+        name = upload.filename or ""
+        if not name.lower().endswith(exts):
+            continue
+        upload.file.seek(0)
+        yield name, upload.file.read()
+
+
+def analyze_frame_stream(ref, frames, batch_size: int = DEFAULT_BATCH_SIZE, roi=None):
+    """
+    Analiza una secuencia de (nombre, bytes) contra la referencia por lotes.
+
+    La memoria queda acotada por el lote (batch_size cuadros float32) más un
+    cuadro comprimido y uno decodificado. Los cuadros que no se pueden
+    decodificar o no coinciden con la referencia se informan en "errores".
+    """
+    rows, cols = roi_slices(roi, ref.shape)
+    engine = BatchedFrameMetrics(ref[rows, cols], batch_size=batch_size)
+
+    names = []
+    errores = []
+    for name, data in frames:
+        try:
+            frame = decode_frame(data)
+            engine.add(frame[roi_slices(roi, frame.shape)])
+        except ValueError as e:
+            errores.append(f"{name}: {e}")
+            continue
+        names.append(name)
+
+    if not names:
+        return {"n_images": 0, "frames": [], "errores": errores}
+
+    result = engine.result()
+    result["frames"] = names
+    result["errores"] = errores
+    return result
+
+
+def spectrum_frame_stream(frames, batch_size: int = DEFAULT_BATCH_SIZE, roi=None):
+    """
+    Espectro radial y tamaño de grano de una secuencia de (nombre, bytes).
+    Todos los cuadros deben tener la forma del primero; los que no se
+    pueden decodificar o no coinciden se informan en "errores".
+    """
+    engine = None
+    names = []
+    errores = []
+    for name, data in frames:
+        try:
+            frame = decode_frame(data)
+            frame = frame[roi_slices(roi, frame.shape)]
+            if engine is None:
+                engine = SpectrumEngine(frame.shape, batch_size, keep_psd=False)
+            engine.add(frame)
+        except ValueError as e:
+            errores.append(f"{name}: {e}")
+            continue
+        names.append(name)
 
+    if engine is None:
+        return {"n_images": 0, "frames": [], "errores": errores}
 
-def analyze_sample_zip(reference_path: str, folder_path: str):
-    ref = cv2.imread(reference_path, cv2.IMREAD_GRAYSCALE)
+    result = engine.result()
+    result["frames"] = names
+    result["errores"] = errores
+    return result
 
-    images = sorted(glob.glob(str(Path(folder_path) / "*.png")))
 
-    ivs, znccs, rssds = [], [], []
+def local_maps_frame_stream(ref, frames, window: int, stride: int,
+                            batch_size: int = DEFAULT_BATCH_SIZE, roi=None):
+    """
+    Mapas locales medios (ventanas window x window cada stride píxeles) de
+    una secuencia de (nombre, bytes) contra la referencia, por lotes.
+    """
+    rows, cols = roi_slices(roi, ref.shape)
+    engine = LocalMapEngine(ref[rows, cols], window, stride, batch_size, keep_frames=False)
 
-    for im_path in images:
-        img = cv2.imread(im_path, cv2.IMREAD_GRAYSCALE)
+    names = []
+    errores = []
+    for name, data in frames:
+        try:
+            frame = decode_frame(data)
+            engine.add(frame[roi_slices(roi, frame.shape)])
+        except ValueError as e:
+            errores.append(f"{name}: {e}")
+            continue
+        names.append(name)
 
-        ivs.append(compute_iv(img))
-        znccs.append(compute_zncc(ref, img))
-        rssds.append(compute_rssd(ref, img))
+    if not names:
+        return {"n_images": 0, "frames": [], "errores": errores}
 
-    return {
-        "iv": float(np.mean(ivs)),
-        "zncc": float(np.mean(znccs)),
-        "rssd": float(np.mean(rssds)),
-        "n_images": len(images)
-    }
+    result = engine.result()
+    result["frames"] = names
+    result["errores"] = errores
+    return result
@@ -3,17 +3,32 @@ import numpy as np
 import cv2
 from fastapi import UploadFile
 
+from timing import timed
+
 async def read_image_uploadfile(file: UploadFile) -> np.ndarray:
     """
     Lee un UploadFile (FastAPI) y devuelve imagen en formato BGR (OpenCV).
     """
     contents = await file.read()
+    return decode_image(contents)
+
+@timed("image_decode")
+def decode_image(contents: bytes) -> np.ndarray:
+    """
+    Decodifica bytes de imagen a BGR (OpenCV). Es síncrona para poder
+    ejecutarla en el pool de CPU (backend.executor).
+    """
     arr = np.frombuffer(contents, np.uint8)
     img = cv2.imdecode(arr, cv2.IMREAD_COLOR)
     if img is None:
         raise ValueError("No se pudo decodificar la imagen. Formato inválido o archivo corrupto.")
     return img
 
+def mean_intensity(contents: bytes) -> float:
+    """Intensidad media en gris de una imagen codificada."""
+    gray = cv2.cvtColor(decode_image(contents), cv2.COLOR_BGR2GRAY)
+    return float(np.mean(gray))
+
 def fft_spectrum(gray: np.ndarray) -> np.ndarray:
     """
     Calcula un espectro FFT magnitude para una imagen en escala de grises.
@@ -0,0 +1,325 @@
+"""
+Benchmarks de los caminos críticos con speckle sintético.
+
+Cada caso (etapa, tamaño, cuadros) corre en un proceso nuevo, así que el
+pico de memoria medido es el de esa etapa y no el de las anteriores. Se
+reporta el mejor de --repeat tiempos (tras una pasada de calentamiento),
+cuadros/s, MB/s de datos de entrada y pico de RSS.
+
+Uso:
+    python -m benchmarks.run                              # todas las etapas
+    python -m benchmarks.run --stages metrics,filters --sizes 640,1024
+    python -m benchmarks.run --out base.json
+    python -m benchmarks.run --compare base.json          # marca regresiones
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from multiprocessing import get_context
+
+import cv2
+import numpy as np
+
+from benchmarks.synthetic import speckle_frames
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+DEFAULT_SIZES = (640, 1024, 2048)
+DEFAULT_FRAMES = (16,)
+DEFAULT_REPEAT = 3
+DEFAULT_THRESHOLD = 0.10
+# Holgura para no marcar como regresión el ruido de memoria del proceso
+RSS_SLACK_MB = 16
+RESULTS_DIR = os.path.join("benchmarks", "results")
+
+# Filtros típicos de la interfaz para la etapa "filters"
+FILTER_CHAIN = {"gaussian": True, "median": True, "equalize_hist": True, "sharpen": True}
+
+
+# ============================================================
+# Etapas: setup(frames) -> estado; run(estado) se cronometra
+# ============================================================
+STAGES = {}
+
+
+def stage(name, bits=12):
+    def decorator(setup):
+        STAGES[name] = (setup, bits)
+        return setup
+    return decorator
+
+
+@stage("decode")
+def _decode(frames):
+    """cv2.imdecode de PNG de 16 bits (cuadros de cámara)."""
+    encoded = [cv2.imencode(".png", f)[1] for f in frames]
+    return lambda: [cv2.imdecode(buf, cv2.IMREAD_UNCHANGED) for buf in encoded]
+
+
+@stage("average_images")
+def _average_images(frames):
+    """io_utils.average_images sobre la pila float32 completa."""
+    from io_utils import average_images
+
+    stack = frames.astype(np.float32)
+    return lambda: average_images(stack)
+
+
+@stage("running_average")
+def _running_average(frames):
+    """io_utils.RunningAverage cuadro a cuadro (acumulador entero)."""
+    from io_utils import RunningAverage
+
+    def run():
+        acc = RunningAverage()
+        for frame in frames:
+            acc.update(frame)
+        return acc.average()
+    return run
+
+
+@stage("metrics")
+def _metrics(frames):
+    """metrics.compute_all de cada cuadro contra una referencia fija."""
+    from metrics import ReferenceStats, compute_all
+
+    stats = ReferenceStats(frames[0].astype(np.float32))
+    return lambda: [compute_all(frame, stats) for frame in frames]
+
+
+@stage("frame_metrics")
+def _frame_metrics(frames):
+    """BatchedFrameMetrics de speckle_processor_zip (IV/ZNCC/rSSD por cuadro)."""
+    from backend.speckle_processor_zip import BatchedFrameMetrics
+
+    def run():
+        engine = BatchedFrameMetrics(frames[0])
+        for frame in frames:
+            engine.add(frame)
+        return engine.result()
+    return run
+
+
+@stage("filters", bits=8)
+def _filters(frames):
+    """Plan de filtros de la referencia (backend.filters) sobre cuadros uint8."""
+    from backend.filters import Workspace, compile_plan
+
+    plan = compile_plan(FILTER_CHAIN, {})
+    workspace = Workspace(frames.shape[1:])
+    return lambda: [plan.run(frame, workspace) for frame in frames]
+
+
+@stage("spectrum")
+def _spectrum(frames):
+    """spectrum.SpectrumEngine (rfft2 por lotes, espectro radial y grano)."""
+    from spectrum import SpectrumEngine
+
+    def run():
+        engine = SpectrumEngine(frames.shape[1:])
+        for frame in frames:
+            engine.add(frame)
+        return engine.result()
+    return run
+
+
+# ============================================================
+# Medición
+# ============================================================
+def _rss_mb(field):
+    """VmRSS / VmHWM de /proc/self/status en MB (None fuera de Linux)."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reinicia VmHWM (Linux >= 4.0). Devuelve False si no se puede."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _maxrss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def run_case(name, size, n_frames, repeat):
+    """Corre un caso (en el proceso actual) y devuelve su resultado."""
+    setup, bits = STAGES[name]
+    frames = speckle_frames(size, n_frames, bits=bits)
+    run = setup(frames)
+
+    # El pico incluye el calentamiento: ahí se reservan los búferes de la etapa
+    rss_before = _rss_mb("VmRSS")
+    exact_peak = _reset_peak_rss()
+    run()  # calentamiento: planes, cachés, páginas de los búferes
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    if exact_peak:
+        peak = _rss_mb("VmHWM")
+    else:
+        peak = _maxrss_mb() if resource is not None else None
+
+    best = min(times)
+    mb = frames.nbytes / 1e6
+    return {
+        "stage": name,
+        "size": size,
+        "frames": n_frames,
+        "dtype": frames.dtype.name,
+        "best_s": best,
+        "median_s": float(np.median(times)),
+        "frames_per_s": n_frames / best,
+        "mb_per_s": mb / best,
+        "peak_rss_mb": peak,
+        "stage_rss_mb": (peak - rss_before) if exact_peak and rss_before else None,
+    }
+
+
+def run_isolated(name, size, n_frames, repeat):
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(run_case, name, size, n_frames, repeat).result()
+
+
+def environment():
+    return {
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+
+
+# ============================================================
+# Comparación con una línea base
+# ============================================================
+def _key(r):
+    return r["stage"], r["size"], r["frames"]
+
+
+def compare(results, baseline, threshold):
+    """
+    Compara contra los resultados de la línea base del mismo caso. Es
+    regresión si cuadros/s cae más de threshold, o si la memoria propia de
+    la etapa crece más de threshold (y más de RSS_SLACK_MB).
+    """
+    base = {_key(r): r for r in baseline["results"]}
+    regressions = []
+    print(f"\n{'etapa':<16}{'tamaño':>7}{'cuadros':>8}{'cuadros/s':>12}{'base':>12}{'Δ':>8}  estado")
+    for r in results:
+        b = base.get(_key(r))
+        if b is None:
+            print(f"{r['stage']:<16}{r['size']:>7}{r['frames']:>8}{r['frames_per_s']:>12.1f}"
+                  f"{'-':>12}{'-':>8}  sin base")
+            continue
+        ratio = r["frames_per_s"] / b["frames_per_s"]
+        problems = []
+        if ratio < 1 - threshold:
+            problems.append("más lento")
+        mem, base_mem = r.get("stage_rss_mb"), b.get("stage_rss_mb")
+        if mem is not None and base_mem is not None \
+                and mem > base_mem * (1 + threshold) + RSS_SLACK_MB:
+            problems.append(f"memoria {base_mem:.0f} → {mem:.0f} MB")
+        status = "REGRESIÓN: " + ", ".join(problems) if problems else "ok"
+        print(f"{r['stage']:<16}{r['size']:>7}{r['frames']:>8}{r['frames_per_s']:>12.1f}"
+              f"{b['frames_per_s']:>12.1f}{ratio - 1:>+8.0%}  {status}")
+        if problems:
+            regressions.append({"case": list(_key(r)), "problems": problems})
+    return regressions
+
+
+# ============================================================
+# CLI
+# ============================================================
+def _int_list(text):
+    return [int(v) for v in text.split(",") if v.strip()]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmarks de speckle sintético")
+    parser.add_argument("--stages", default=",".join(STAGES),
+                        help=f"Etapas separadas por coma ({', '.join(STAGES)})")
+    parser.add_argument("--sizes", type=_int_list, default=list(DEFAULT_SIZES),
+                        help="Lados de los cuadros cuadrados, p. ej. 640,1024,2048")
+    parser.add_argument("--frames", type=_int_list, default=list(DEFAULT_FRAMES),
+                        help="Cantidades de cuadros por caso, p. ej. 16,64")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT,
+                        help="Repeticiones cronometradas (se reporta la mejor)")
+    parser.add_argument("--out", default=None,
+                        help="JSON de resultados (por defecto benchmarks/results/<fecha>.json)")
+    parser.add_argument("--compare", default=None,
+                        help="JSON de línea base contra el que marcar regresiones")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Caída relativa tolerada antes de marcar regresión")
+    parser.add_argument("--in-process", action="store_true",
+                        help="No aislar los casos en procesos (el pico de RSS se acumula)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stages = [s.strip() for s in args.stages.split(",") if s.strip()]
+    unknown = [s for s in stages if s not in STAGES]
+    if unknown:
+        raise SystemExit(f"Etapas desconocidas: {', '.join(unknown)}")
+
+    run = run_case if args.in_process else run_isolated
+    results = []
+    for name in stages:
+        for size in args.sizes:
+            for n_frames in args.frames:
+                r = run(name, size, n_frames, args.repeat)
+                results.append(r)
+                peak = "-" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.0f}"
+                print(f"{name:<16}{size:>5}² x{n_frames:<4} {r['frames_per_s']:>9.1f} cuadros/s "
+                      f"{r['mb_per_s']:>9.1f} MB/s  pico {peak:>7} MB")
+
+    report = {"environment": environment(), "repeat": args.repeat, "results": results}
+    regressions = []
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        report["baseline"] = {"path": args.compare, "environment": baseline.get("environment")}
+        report["regressions"] = regressions
+
+    out = args.out or os.path.join(
+        RESULTS_DIR, f"bench_{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n✅ Resultados guardados en: {out}")
+
+    if regressions:
+        print(f"❌ {len(regressions)} regresiones frente a {args.compare}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
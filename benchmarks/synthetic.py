@@ -0,0 +1,43 @@
+import numpy as np
+
+
+# Patrones distintos por caso: los cuadros los repiten con ruido nuevo, así
+# que generar 64 cuadros de 2048² no cuesta 64 FFT
+UNIQUE_PATTERNS = 4
+
+
+def speckle_pattern(size, grain, rng):
+    """
+    Intensidad de speckle completamente desarrollado (size x size, media 1):
+    campo con fase aleatoria filtrado por una pupila circular, de modo que
+    el grano mide del orden de `grain` píxeles.
+    """
+    f = np.fft.fftfreq(size)
+    pupil = (f[:, None] ** 2 + f[None, :] ** 2) < (0.5 / grain) ** 2
+    phase = np.exp(2j * np.pi * rng.random((size, size)))
+    field = np.fft.ifft2(pupil * phase)
+    intensity = np.abs(field) ** 2
+    return (intensity / intensity.mean()).astype(np.float32)
+
+
+def speckle_frames(size, n_frames, bits=12, grain=4.0, seed=0):
+    """
+    Pila (n_frames, size, size) de cuadros enteros (uint8 con bits <= 8,
+    si no uint16) con la estadística de una cámara: speckle escalado a un
+    cuarto del rango, ruido gaussiano y saturación en 2**bits - 1.
+    """
+    rng = np.random.default_rng(seed)
+    dtype = np.uint8 if bits <= 8 else np.uint16
+    top = 2 ** bits - 1
+    patterns = [speckle_pattern(size, grain, rng)
+                for _ in range(min(n_frames, UNIQUE_PATTERNS))]
+
+    frames = np.empty((n_frames, size, size), dtype=dtype)
+    noise = np.empty((size, size), dtype=np.float32)
+    for i in range(n_frames):
+        rng.standard_normal(dtype=np.float32, out=noise)
+        frame = patterns[i % len(patterns)] * (top / 4)
+        frame += noise * (top / 100)
+        np.clip(frame, 0, top, out=frame)
+        frames[i] = frame
+    return frames
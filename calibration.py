@@ -0,0 +1,539 @@
+"""
+Calibración del índice de refracción: curvas métrica(n) ajustadas sobre
+muestras de n conocido y búsqueda inversa n(métricas) vectorizada.
+
+Cada métrica (IV, ZNCC, rSSD) se ajusta con un polinomio en n por mínimos
+cuadrados, con n centrado y escalado para que el sistema esté bien
+condicionado. Se guardan los coeficientes, su matriz de covarianza y la
+desviación de los residuos. Con kind="monotone" la curva es en cambio una
+interpolación cúbica monótona (PCHIP) de las medias por n, que no puede
+tener dos ramas. Las curvas que no son monótonas en el rango calibrado (la
+inversa podría elegir la rama equivocada) y los grados reducidos por falta
+de puntos quedan en model.warnings; con strict=True se rechaza el ajuste.
+La inversa busca, para cada vector de métricas
+medido, el n que minimiza Σ ((y_m - p_m(n)) / σ_m(n))² sobre una grilla
+fina del rango calibrado (por bloques, como producto de matrices) y refina
+el mínimo con una parábola; la incertidumbre de n sale de la pendiente de
+las curvas en ese punto. σ_m(n)² = σ_residuos² + σ_curva(n)², con un piso
+relativo para que una métrica con pocos puntos casi sobre la curva no
+domine el costo.
+
+Uso:
+    python calibration.py fit results/*/*_metrics.csv --out calibrations/agua.json
+    python calibration.py fit results/*/*_metrics.csv --kind monotone --strict
+    python calibration.py predict calibrations/agua.json medidas.csv --out n.csv
+"""
+import argparse
+import json
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+
+METRICS = ("IV", "ZNCC", "rSSD")
+DEFAULT_DEGREE = 2
+# Tipos de curva: polinomio por mínimos cuadrados o interpolación monótona
+CURVE_KINDS = ("poly", "monotone")
+# Puntos de la grilla de la inversa y margen fuera del rango calibrado
+GRID_POINTS = 2001
+GRID_MARGIN = 0.1
+# Vectores por bloque en la inversa: acota la matriz de costos a unos MB
+PREDICT_CHUNK = 1024
+# Sin grados de libertad para estimar σ se usa esta fracción del rango
+FALLBACK_SIGMA = 0.01
+# σ mínimo de una métrica, como fracción de su variación en el rango
+SIGMA_FLOOR = 0.001
+
+
+class MetricCurve:
+    """Polinomio y(n) de una métrica, con covarianza de los coeficientes."""
+    kind = "poly"
+
+    def __init__(self, coeffs, cov, center, scale, resid_std, dof, n_points):
+        self.coeffs = np.asarray(coeffs, dtype=np.float64)  # grado mayor primero
+        self.cov = np.asarray(cov, dtype=np.float64)
+        self.center = float(center)
+        self.scale = float(scale)
+        self.resid_std = float(resid_std)
+        self.dof = int(dof)
+        self.n_points = int(n_points)
+
+    @property
+    def degree(self):
+        return len(self.coeffs) - 1
+
+    def _x(self, n):
+        return (np.asarray(n, dtype=np.float64) - self.center) / self.scale
+
+    def predict(self, n):
+        return np.polyval(self.coeffs, self._x(n))
+
+    def slope(self, n):
+        """dy/dn."""
+        return np.polyval(np.polyder(self.coeffs), self._x(n)) / self.scale
+
+    def predict_std(self, n):
+        """Desviación de la curva ajustada en n (propagando la covarianza)."""
+        x = self._x(n)
+        V = np.vander(np.atleast_1d(x), self.degree + 1)
+        return np.sqrt(np.einsum("ij,jk,ik->i", V, self.cov, V))
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "coeffs": self.coeffs.tolist(),
+            "cov": self.cov.tolist(),
+            "center": self.center,
+            "scale": self.scale,
+            "resid_std": self.resid_std,
+            "dof": self.dof,
+            "n_points": self.n_points,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = {k: v for k, v in data.items() if k != "kind"}
+        return cls(**data)
+
+
+class MonotoneCurve:
+    """
+    Curva y(n) monótona: medias por valor de n, forzadas a ser monótonas
+    (regresión isotónica) e interpoladas con Hermite cúbico y pendientes de
+    Fritsch-Carlson (PCHIP), que no crea extremos entre nodos. Fuera de los
+    nodos sigue en línea recta con la pendiente del extremo.
+    """
+    kind = "monotone"
+    degree = None
+
+    def __init__(self, nodes, values, slopes, node_std, resid_std, dof, n_points):
+        self.nodes = np.asarray(nodes, dtype=np.float64)
+        self.values = np.asarray(values, dtype=np.float64)
+        self.slopes = np.asarray(slopes, dtype=np.float64)
+        self.node_std = np.asarray(node_std, dtype=np.float64)
+        self.resid_std = float(resid_std)
+        self.dof = int(dof)
+        self.n_points = int(n_points)
+
+    def _segment(self, n):
+        n = np.asarray(n, dtype=np.float64)
+        i = np.clip(np.searchsorted(self.nodes, n) - 1, 0, len(self.nodes) - 2)
+        h = self.nodes[i + 1] - self.nodes[i]
+        return n, i, h, (n - self.nodes[i]) / h
+
+    def predict(self, n):
+        n, i, h, t = self._segment(n)
+        y0, y1 = self.values[i], self.values[i + 1]
+        m0, m1 = self.slopes[i] * h, self.slopes[i + 1] * h
+        t2, t3 = t * t, t * t * t
+        y = ((2 * t3 - 3 * t2 + 1) * y0 + (t3 - 2 * t2 + t) * m0
+             + (-2 * t3 + 3 * t2) * y1 + (t3 - t2) * m1)
+        first, last = self.nodes[0], self.nodes[-1]
+        y = np.where(n < first, self.values[0] + self.slopes[0] * (n - first), y)
+        return np.where(n > last, self.values[-1] + self.slopes[-1] * (n - last), y)
+
+    def slope(self, n):
+        """dy/dn."""
+        n, i, h, t = self._segment(n)
+        y0, y1 = self.values[i], self.values[i + 1]
+        m0, m1 = self.slopes[i], self.slopes[i + 1]
+        t2 = t * t
+        d = ((6 * t2 - 6 * t) * (y0 - y1) / h
+             + (3 * t2 - 4 * t + 1) * m0 + (3 * t2 - 2 * t) * m1)
+        d = np.where(n < self.nodes[0], self.slopes[0], d)
+        return np.where(n > self.nodes[-1], self.slopes[-1], d)
+
+    def predict_std(self, n):
+        """Desviación de la curva en n: la de la media de cada nodo, interpolada."""
+        return np.interp(np.atleast_1d(np.asarray(n, dtype=np.float64)),
+                         self.nodes, self.node_std)
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "nodes": self.nodes.tolist(),
+            "values": self.values.tolist(),
+            "slopes": self.slopes.tolist(),
+            "node_std": self.node_std.tolist(),
+            "resid_std": self.resid_std,
+            "dof": self.dof,
+            "n_points": self.n_points,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        data = {k: v for k, v in data.items() if k != "kind"}
+        return cls(**data)
+
+
+def curve_from_dict(data):
+    """Curva guardada; los modelos sin "kind" son polinomios."""
+    if data.get("kind", "poly") == "monotone":
+        return MonotoneCurve.from_dict(data)
+    return MetricCurve.from_dict(data)
+
+
+def fit_curve(n, y, degree=DEFAULT_DEGREE):
+    """
+    Ajusta y(n) con un polinomio. El grado se limita a len(n) - 2 (mínimo
+    1) para que quede al menos un grado de libertad con el que estimar σ.
+    """
+    n = np.asarray(n, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if len(np.unique(n)) < 2:
+        raise ValueError("Se necesitan al menos dos valores de n distintos")
+    degree = max(1, min(int(degree), len(np.unique(n)) - 2))
+
+    center = float(n.mean())
+    scale = float(np.ptp(n) / 2) or 1.0
+    V = np.vander((n - center) / scale, degree + 1)
+    coeffs, _, _, _ = np.linalg.lstsq(V, y, rcond=None)
+
+    resid = y - V @ coeffs
+    dof = len(n) - (degree + 1)
+    if dof > 0:
+        resid_std = float(np.sqrt(resid @ resid / dof))
+    else:
+        resid_std = float("nan")
+    sigma2 = resid_std ** 2 if dof > 0 else 0.0
+    cov = sigma2 * np.linalg.pinv(V.T @ V)
+    return MetricCurve(coeffs, cov, center, scale, resid_std, dof, len(n))
+
+
+def isotonic(y, w):
+    """Regresión isotónica creciente de y con pesos w (pool adjacent violators)."""
+    blocks = []  # [media, peso, nodos]
+    for yi, wi in zip(y, w):
+        blocks.append([yi, wi, 1])
+        while len(blocks) > 1 and blocks[-2][0] > blocks[-1][0]:
+            m2, w2, c2 = blocks.pop()
+            m1, w1, c1 = blocks.pop()
+            blocks.append([(m1 * w1 + m2 * w2) / (w1 + w2), w1 + w2, c1 + c2])
+    return np.repeat([b[0] for b in blocks], [b[2] for b in blocks])
+
+
+def pchip_slopes(x, y):
+    """
+    Pendientes de Fritsch-Carlson en los nodos: media armónica ponderada de
+    las secantes vecinas, 0 si cambian de signo; en los extremos, la secante.
+    """
+    h = np.diff(x)
+    delta = np.diff(y) / h
+    slopes = np.empty_like(y)
+    slopes[0], slopes[-1] = delta[0], delta[-1]
+    for k in range(1, len(x) - 1):
+        if delta[k - 1] * delta[k] <= 0:
+            slopes[k] = 0.0
+        else:
+            w1 = 2 * h[k] + h[k - 1]
+            w2 = h[k] + 2 * h[k - 1]
+            slopes[k] = (w1 + w2) / (w1 / delta[k - 1] + w2 / delta[k])
+    return slopes
+
+
+def fit_monotone_curve(n, y):
+    """
+    Ajusta y(n) con una MonotoneCurve. La dirección (creciente o decreciente)
+    es la de la tendencia lineal de las medias; σ de los residuos sale de la
+    dispersión alrededor de la media de cada n.
+    """
+    n = np.asarray(n, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    nodes, inverse, counts = np.unique(n, return_inverse=True, return_counts=True)
+    if len(nodes) < 2:
+        raise ValueError("Se necesitan al menos dos valores de n distintos")
+    means = np.bincount(inverse, weights=y) / counts
+
+    center = np.average(nodes, weights=counts)
+    sign = 1.0 if np.sum(counts * (nodes - center) * means) >= 0 else -1.0
+    values = sign * isotonic(sign * means, counts)
+
+    resid = y - values[inverse]
+    dof = len(n) - len(nodes)
+    if dof > 0:
+        resid_std = float(np.sqrt(resid @ resid / dof))
+        node_std = resid_std / np.sqrt(counts)
+    else:
+        resid_std = float("nan")
+        node_std = np.zeros(len(nodes))
+    return MonotoneCurve(nodes, values, pchip_slopes(nodes, values), node_std,
+                         resid_std, dof, len(n))
+
+
+def is_monotone(curve, n_range):
+    """True si la pendiente de la curva no cambia de signo en n_range."""
+    slopes = curve.slope(np.linspace(n_range[0], n_range[1], GRID_POINTS))
+    tol = 1e-9 * np.max(np.abs(slopes), initial=0.0)
+    return not (np.any(slopes > tol) and np.any(slopes < -tol))
+
+
+class CalibrationModel:
+    def __init__(self, curves, n_range, name="calibration", sources=None, created_at=None,
+                 warnings=None):
+        self.curves = curves  # {métrica: MetricCurve o MonotoneCurve}
+        self.n_range = (float(n_range[0]), float(n_range[1]))
+        self.name = name
+        self.sources = sources or []
+        self.warnings = warnings or []
+        self.created_at = created_at or datetime.now(timezone.utc).isoformat(timespec="seconds")
+        self._grid = None
+
+    @property
+    def metrics(self):
+        return list(self.curves)
+
+    # ------------------------------------------------------------
+    # Persistencia (JSON)
+    # ------------------------------------------------------------
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "created_at": self.created_at,
+            "n_range": list(self.n_range),
+            "sources": self.sources,
+            "warnings": self.warnings,
+            "curves": {m: c.to_dict() for m, c in self.curves.items()},
+        }
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def from_dict(cls, data):
+        curves = {m: curve_from_dict(c) for m, c in data["curves"].items()}
+        return cls(curves, data["n_range"], name=data.get("name", "calibration"),
+                   sources=data.get("sources"), created_at=data.get("created_at"),
+                   warnings=data.get("warnings"))
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    # ------------------------------------------------------------
+    # Inversa
+    # ------------------------------------------------------------
+    def sigma_at(self, n, metrics):
+        """
+        σ de cada métrica en cada n, (len(n), len(metrics)): dispersión de
+        los residuos más la incertidumbre de la curva ajustada en ese n, y
+        al menos SIGMA_FLOOR de lo que la métrica varía en el rango.
+        """
+        out = []
+        for m in metrics:
+            curve = self.curves[m]
+            lo, hi = curve.predict(np.array(self.n_range))
+            span = abs(hi - lo) or 1.0
+            resid = curve.resid_std if np.isfinite(curve.resid_std) else FALLBACK_SIGMA * span
+            sigma = np.sqrt(resid ** 2 + curve.predict_std(n) ** 2)
+            out.append(np.maximum(sigma, SIGMA_FLOOR * span))
+        return np.stack(out, axis=1)
+
+    def _table(self):
+        """Grilla de n y curvas evaluadas en ella (se arma una vez)."""
+        if self._grid is None:
+            lo, hi = self.n_range
+            pad = GRID_MARGIN * (hi - lo)
+            grid = np.linspace(lo - pad, hi + pad, GRID_POINTS)
+            table = np.stack([self.curves[m].predict(grid) for m in self.metrics], axis=1)
+            self._grid = (grid, table)
+        return self._grid
+
+    def predict(self, values, metrics=None):
+        """
+        n estimado para cada fila de values (k, len(metrics)). Devuelve
+        (n, n_std, chi2), arreglos de largo k; las filas con NaN ignoran
+        esa métrica, y las que no tienen ninguna dan NaN.
+        """
+        metrics = list(metrics or self.metrics)
+        unknown = [m for m in metrics if m not in self.curves]
+        if unknown:
+            raise ValueError(f"Métricas sin calibrar: {', '.join(unknown)}")
+        values = np.atleast_2d(np.asarray(values, dtype=np.float64))
+        if values.shape[1] != len(metrics):
+            raise ValueError(f"Se esperan {len(metrics)} columnas ({', '.join(metrics)})")
+
+        grid, table = self._table()
+        cols = [self.metrics.index(m) for m in metrics]
+        # Con pesos w = 1/σ² por punto de la grilla:
+        # costo = Σ w v² - 2 Σ w v t + Σ w t², tres productos de matrices
+        # por bloque. Se resta un desplazamiento por métrica para que los
+        # términos no sean mucho mayores que su diferencia.
+        t = table[:, cols]                            # (g, m)
+        offset = t.mean(axis=0)
+        t = t - offset
+        w = 1.0 / self.sigma_at(grid, metrics) ** 2   # (g, m)
+        tw = t * w
+        ttw = t * tw
+
+        n_out = np.empty(len(values))
+        chi2 = np.empty(len(values))
+        for start in range(0, len(values), PREDICT_CHUNK):
+            v = values[start:start + PREDICT_CHUNK] - offset
+            mask = np.isfinite(v)
+            v0 = np.where(mask, v, 0.0)
+            # Con NaN: Σ w t² solo de las métricas presentes
+            cost = ((v0 * v0) @ w.T
+                    - 2.0 * v0 @ tw.T
+                    + mask.astype(np.float64) @ ttw.T)
+            i = np.clip(cost.argmin(axis=1), 1, len(grid) - 2)
+            rows = np.arange(len(v))
+            c0, c1, c2 = cost[rows, i - 1], cost[rows, i], cost[rows, i + 1]
+            curvature = c0 - 2.0 * c1 + c2
+            with np.errstate(divide="ignore", invalid="ignore"):
+                shift = np.where(curvature > 0, 0.5 * (c0 - c2) / curvature, 0.0)
+            shift = np.clip(shift, -1.0, 1.0)
+            step = grid[1] - grid[0]
+            n_out[start:start + len(v)] = grid[i] + shift * step
+            chi2[start:start + len(v)] = np.maximum(c1 - 0.25 * (c0 - c2) * shift, 0.0)
+
+        # σ_n ≈ 1 / sqrt(Σ (p'_m(n) / σ_m(n))²) en el n estimado
+        slopes = np.stack([self.curves[m].slope(n_out) for m in metrics], axis=1)
+        slopes /= self.sigma_at(n_out, metrics)
+        present = np.isfinite(values)
+        slopes = np.where(present, slopes, 0.0)
+        info = np.einsum("km,km->k", slopes, slopes)
+        with np.errstate(divide="ignore"):
+            n_std = 1.0 / np.sqrt(info)
+
+        # Sin ninguna métrica el costo es 0 en toda la grilla: no hay estimación
+        empty = ~present.any(axis=1)
+        n_out[empty] = np.nan
+        n_std[empty] = np.nan
+        chi2[empty] = np.nan
+        return n_out, n_std, chi2
+
+    def summary(self):
+        return {
+            m: {"kind": c.kind, "degree": c.degree, "resid_std": c.resid_std,
+                "dof": c.dof, "n_points": c.n_points,
+                "monotone": is_monotone(c, self.n_range)}
+            for m, c in self.curves.items()
+        }
+
+
+def fit_calibration(n, table, metrics=METRICS, degree=DEFAULT_DEGREE,
+                    name="calibration", sources=None, kind="poly", strict=False):
+    """
+    Ajusta una curva por métrica. `table` es {métrica: valores} (o un
+    DataFrame) con una fila por muestra medida, alineada con n.
+
+    kind: "poly" (polinomio de grado `degree`) o "monotone" (MonotoneCurve).
+    Los grados reducidos y las curvas no monótonas en el rango calibrado se
+    anotan en model.warnings; con strict=True una curva no monótona es un
+    ValueError.
+    """
+    if kind not in CURVE_KINDS:
+        raise ValueError(f"Tipo de curva desconocido: {kind} (use {', '.join(CURVE_KINDS)})")
+    n = np.asarray(n, dtype=np.float64)
+    n_range = (np.nanmin(n), np.nanmax(n))
+    curves = {}
+    warnings = []
+    for m in metrics:
+        y = np.asarray(table[m], dtype=np.float64)
+        ok = np.isfinite(n) & np.isfinite(y)
+        if kind == "monotone":
+            curves[m] = fit_monotone_curve(n[ok], y[ok])
+            continue
+        curves[m] = fit_curve(n[ok], y[ok], degree)
+        if curves[m].degree < degree:
+            warnings.append(f"{m}: grado {degree} reducido a {curves[m].degree} "
+                            f"({len(np.unique(n[ok]))} valores de n distintos)")
+
+    bad = [m for m, c in curves.items() if not is_monotone(c, n_range)]
+    if bad:
+        message = (f"Curvas no monótonas en el rango calibrado: {', '.join(bad)}; "
+                   f"la inversa puede elegir la rama equivocada (pruebe kind=\"monotone\" "
+                   f"o un grado menor)")
+        if strict:
+            raise ValueError(message)
+        warnings.append(message)
+    return CalibrationModel(curves, n_range, name=name, sources=sources, warnings=warnings)
+
+
+def read_labelled_csvs(paths):
+    """Filas con n_value de los CSV de main.py (sample, n_value, IV, ZNCC, rSSD)."""
+    frames = [pd.read_csv(p) for p in paths]
+    df = pd.concat(frames, ignore_index=True)
+    return df[df["n_value"].notna()]
+
+
+# ============================================================
+# CLI
+# ============================================================
+def parse_args():
+    parser = argparse.ArgumentParser(description="Calibración del índice de refracción")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fit = sub.add_parser("fit", help="Ajustar curvas desde CSV de corridas")
+    fit.add_argument("csv", nargs="+", help="CSV *_metrics.csv con n_value")
+    fit.add_argument("--metrics", default=",".join(METRICS),
+                     help="Métricas a ajustar, separadas por coma")
+    fit.add_argument("--degree", type=int, default=DEFAULT_DEGREE,
+                     help="Grado del polinomio (se limita según los puntos)")
+    fit.add_argument("--kind", choices=CURVE_KINDS, default="poly",
+                     help="Polinomio o interpolación monótona (PCHIP) de las medias por n")
+    fit.add_argument("--strict", action="store_true",
+                     help="Rechazar el ajuste si alguna curva no es monótona")
+    fit.add_argument("--name", default=None, help="Nombre del modelo")
+    fit.add_argument("--out", default="calibrations/calibration.json",
+                     help="JSON donde guardar el modelo")
+
+    predict = sub.add_parser("predict", help="Estimar n desde métricas medidas")
+    predict.add_argument("model", help="JSON del modelo")
+    predict.add_argument("csv", help="CSV con columnas de métricas")
+    predict.add_argument("--metrics", default=None,
+                         help="Métricas a usar (por defecto, las del modelo presentes en el CSV)")
+    predict.add_argument("--out", default=None, help="CSV de salida (por defecto, pantalla)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    if args.command == "fit":
+        metrics = [m.strip() for m in args.metrics.split(",") if m.strip()]
+        df = read_labelled_csvs(args.csv)
+        name = args.name or os.path.splitext(os.path.basename(args.out))[0]
+        try:
+            model = fit_calibration(df["n_value"], df, metrics, args.degree, name=name,
+                                    sources=[os.path.abspath(p) for p in args.csv],
+                                    kind=args.kind, strict=args.strict)
+        except ValueError as e:
+            raise SystemExit(f"❌ {e}")
+        model.save(args.out)
+        print(f"✅ Modelo guardado en: {args.out}")
+        for m, info in model.summary().items():
+            shape = f"grado {info['degree']}" if info["kind"] == "poly" else "monótona"
+            print(f"  {m}: {shape}, σ residuos {info['resid_std']:.4g}, "
+                  f"{info['n_points']} puntos")
+        for warning in model.warnings:
+            print(f"⚠️ {warning}")
+        return
+
+    model = CalibrationModel.load(args.model)
+    df = pd.read_csv(args.csv)
+    if args.metrics:
+        metrics = [m.strip() for m in args.metrics.split(",") if m.strip()]
+    else:
+        metrics = [m for m in model.metrics if m in df.columns]
+    n, n_std, chi2 = model.predict(df[metrics].to_numpy(), metrics)
+    df["n_est"] = n
+    df["n_std"] = n_std
+    df["chi2"] = chi2
+    if args.out:
+        df.to_csv(args.out, index=False)
+        print(f"✅ Estimaciones guardadas en: {args.out}")
+    else:
+        print(df)
+
+
+if __name__ == "__main__":
+    main()
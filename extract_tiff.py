@@ -1,35 +1,54 @@
 import os
-from PIL import Image
-from datetime import datetime
+import argparse
+import cv2
 
-# Ruta correcta donde están tus .TIF
-input_folder = r"C:\Users\jorge\Downloads\SPECKELS-Dataset\SPECKELS-JORGE"
+from frame_sources import TIFF_EXTS, TiffStackSource
 
-# Carpeta de salida dentro del proyecto
-output_folder = os.path.join(
-    os.path.dirname(__file__),
-    "data",
-    datetime.now().strftime("%Y-%m-%d_run01"),
-    "raw"
-)
 
-os.makedirs(output_folder, exist_ok=True)
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Revisa pilas TIFF multipágina para el análisis"
+    )
+    parser.add_argument("input", help="Carpeta con los TIFF multipágina")
+    parser.add_argument("--png", metavar="SALIDA",
+                        help="Extraer cada página como PNG en esta carpeta (modo anterior)")
+    return parser.parse_args()
 
-print(f"\n=== Extrayendo TIFF multipágina desde: {input_folder} ===\n")
 
-for fname in os.listdir(input_folder):
-    if fname.lower().endswith((".tif", ".tiff")):
-        fpath = os.path.join(input_folder, fname)
-        print(f"📂 Procesando: {fname}")
-
-        img = Image.open(fpath)
+def main():
+    args = parse_args()
+    if args.png:
+        os.makedirs(args.png, exist_ok=True)
 
-        for i in range(img.n_frames):
-            img.seek(i)
-            out_name = f"{os.path.splitext(fname)[0]}_frame_{i:03d}.png"
-            img.save(os.path.join(output_folder, out_name))
+    print(f"\n=== Revisando TIFF multipágina en: {args.input} ===\n")
 
-        print(f"   → {img.n_frames} frames extraídos")
+    for fname in sorted(os.listdir(args.input)):
+        if not fname.lower().endswith(TIFF_EXTS):
+            continue
+        fpath = os.path.join(args.input, fname)
+        print(f"📂 Procesando: {fname}")
 
-print(f"\n=== EXTRACCIÓN COMPLETA ===")
-print(f"Las imágenes están en: {output_folder}\n")
+        with TiffStackSource(fpath) as stack:
+            if args.png:
+                for i, frame in enumerate(stack):
+                    out_name = f"{stack.name}_frame_{i:03d}.png"
+                    cv2.imwrite(os.path.join(args.png, out_name), frame)
+                print(f"   → {len(stack)} frames extraídos")
+                continue
+
+            # Sin extracción ni copia: el análisis lee la pila en su lugar
+            # (memmap si no está comprimida)
+            modo = "memmap" if stack.memmapped else "decodificación PIL"
+            print(f"   → {len(stack)} frames ({modo})")
+
+    if args.png:
+        print(f"\n=== EXTRACCIÓN COMPLETA ===")
+        print(f"Las imágenes están en: {args.png}\n")
+    else:
+        print(f"\n=== REVISIÓN COMPLETA ===")
+        print("Para analizar las pilas sin copiarlas, use en config.yaml:")
+        print(f"  paths:\n    raw: \"{os.path.abspath(args.input)}\"\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import os
+import struct
+import threading
+from abc import ABC, abstractmethod
+
+import cv2
+import numpy as np
+from PIL import Image
+
+
+IMAGE_EXTS = (".png", ".jpg", ".jpeg", ".tif", ".bmp")
+TIFF_EXTS = (".tif", ".tiff")
+
+# Etiquetas TIFF usadas para ubicar los datos de cada página
+_TAG_WIDTH = 256
+_TAG_LENGTH = 257
+_TAG_BITS = 258
+_TAG_COMPRESSION = 259
+_TAG_STRIP_OFFSETS = 273
+_TAG_SAMPLES = 277
+_TAG_ROWS_PER_STRIP = 278
+_TAG_STRIP_COUNTS = 279
+_TAG_TILE_WIDTH = 322
+_TAG_SAMPLE_FORMAT = 339
+
+# tipo TIFF -> (formato struct, bytes)
+_TIFF_TYPES = {
+    1: ("B", 1), 3: ("H", 2), 4: ("I", 4), 6: ("b", 1),
+    8: ("h", 2), 9: ("i", 4), 16: ("Q", 8), 17: ("q", 8),
+}
+
+
+def list_images(folder, exts=IMAGE_EXTS):
+    """Devuelve una lista ordenada de rutas de imágenes en la carpeta."""
+    files = [os.path.join(folder, f) for f in os.listdir(folder)
+             if f.lower().endswith(exts)]
+    return sorted(files)
+
+
+def read_gray(path):
+    """
+    Lee una imagen conservando su profundidad (8 o 16 bits) y la lleva a
+    escala de grises si tiene canales de color.
+    """
+    img = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if img is None:
+        raise ValueError(f"No se pudo decodificar: {path}")
+    return to_gray(img)
+
+
+def to_gray(img):
+    """Convierte BGR/BGRA a un canal sin cambiar el tipo; 2D se deja igual."""
+    if img.ndim == 3:
+        code = cv2.COLOR_BGRA2GRAY if img.shape[2] == 4 else cv2.COLOR_BGR2GRAY
+        img = cv2.cvtColor(img, code)
+    return img
+
+
+def roi_slices(roi, shape):
+    """
+    Convierte una ROI {x, y, w, h} (o tupla x, y, w, h) en las rebanadas
+    (filas, columnas) para un cuadro de forma `shape`. Sin ROI devuelve el
+    cuadro completo.
+    """
+    if not roi:
+        return slice(None), slice(None)
+    if isinstance(roi, dict):
+        x, y, w, h = (int(roi[k]) for k in ("x", "y", "w", "h"))
+    else:
+        x, y, w, h = (int(v) for v in roi)
+    height, width = shape[:2]
+    if x < 0 or y < 0 or w <= 0 or h <= 0 or x + w > width or y + h > height:
+        raise ValueError(
+            f"ROI {(x, y, w, h)} fuera del cuadro de {width}x{height}"
+        )
+    return slice(y, y + h), slice(x, x + w)
+
+
+class FrameSource(ABC):
+    """
+    Secuencia de cuadros 2D: len(), read(i, roi) e iteración en orden.
+
+    Con roi, read() recorta lo antes posible: las fuentes mapeadas en memoria
+    solo tocan las filas de la ROI; las que decodifican recortan antes de
+    cualquier conversión de tipo.
+    """
+
+    @abstractmethod
+    def __len__(self):
+        """Cantidad de cuadros."""
+
+    @abstractmethod
+    def read(self, i, roi=None):
+        """Cuadro i como arreglo 2D (recortado a roi si se da)."""
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.read(i)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FolderSource(FrameSource):
+    """
+    Carpeta con un archivo de imagen por cuadro, decodificado con OpenCV
+    conservando la profundidad de la cámara (uint8 o uint16).
+    """
+
+    def __init__(self, folder, exts=IMAGE_EXTS):
+        self.folder = folder
+        self.files = list_images(folder, exts)
+        self.name = os.path.basename(os.path.normpath(folder))
+
+    def __len__(self):
+        return len(self.files)
+
+    def read(self, i, roi=None):
+        img = cv2.imread(self.files[i], cv2.IMREAD_UNCHANGED)
+        if img is None:
+            raise ValueError(f"No se pudo decodificar: {self.files[i]}")
+        rows, cols = roi_slices(roi, img.shape)
+        return to_gray(img[rows, cols])
+
+
+class TiffStackSource(FrameSource):
+    """
+    TIFF multipágina leído sin copias mediante numpy.memmap.
+
+    Las páginas sin compresión, de un canal y con tiras (strips) contiguas
+    se exponen como vistas del archivo mapeado; si además están equiespaciadas
+    toda la pila es un único arreglo (N, alto, ancho). Las páginas comprimidas
+    o en mosaico (tiles) se decodifican con PIL como respaldo.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.pages = _read_tiff_pages(path)
+        self._mm = None
+        self._stack = None
+        self._pil = None
+        self._lock = threading.Lock()
+
+        if self.pages and all(p["offset"] is not None for p in self.pages):
+            self._mm = np.memmap(path, dtype=np.uint8, mode="r")
+            self._stack = self._as_stack()
+
+    @property
+    def memmapped(self):
+        """True si todas las páginas se leen directamente del archivo mapeado."""
+        return self._mm is not None
+
+    def __len__(self):
+        return len(self.pages)
+
+    def _as_stack(self):
+        first = self.pages[0]
+        shape, dtype = first["shape"], first["dtype"]
+        if any(p["shape"] != shape or p["dtype"] != dtype for p in self.pages):
+            return None
+        offsets = [p["offset"] for p in self.pages]
+        step = offsets[1] - offsets[0] if len(offsets) > 1 else 0
+        if any(b - a != step for a, b in zip(offsets, offsets[1:])) or step < 0:
+            return None
+        itemsize = dtype.itemsize
+        return np.ndarray(
+            (len(offsets),) + shape, dtype=dtype, buffer=self._mm,
+            offset=offsets[0], strides=(step, shape[1] * itemsize, itemsize),
+        )
+
+    def read(self, i, roi=None):
+        page = self.pages[i]
+        rows, cols = roi_slices(roi, page["shape"])
+        if self._stack is not None:
+            return self._stack[i, rows, cols]
+        if self._mm is not None:
+            frame = np.ndarray(page["shape"], dtype=page["dtype"],
+                               buffer=self._mm, offset=page["offset"])
+            return frame[rows, cols]
+        # Un solo manejador PIL: seek() y la decodificación van juntos bajo
+        # el lock porque iter_images puede leer desde varios hilos
+        with self._lock:
+            if self._pil is None:
+                self._pil = Image.open(self.path)
+            self._pil.seek(i)
+            img = self._pil
+            if img.mode not in ("L", "I;16", "I;16B", "I;16L", "I", "F"):
+                img = img.convert("L")
+            frame = np.array(img)
+        return frame[rows, cols]
+
+    def close(self):
+        self._stack = None
+        self._mm = None
+        with self._lock:
+            if self._pil is not None:
+                self._pil.close()
+                self._pil = None
+
+
+def _read_tiff_pages(path):
+    """
+    Recorre los IFD de un TIFF (clásico o BigTIFF) y devuelve, por página,
+    forma, dtype y el desplazamiento de sus datos si se pueden mapear
+    directamente (None en caso contrario).
+    """
+    pages = []
+    with open(path, "rb") as f:
+        order = f.read(2)
+        if order == b"II":
+            bo = "<"
+        elif order == b"MM":
+            bo = ">"
+        else:
+            raise ValueError(f"No es un archivo TIFF: {path}")
+
+        magic = struct.unpack(bo + "H", f.read(2))[0]
+        if magic == 42:
+            big = False
+            next_ifd = struct.unpack(bo + "I", f.read(4))[0]
+        elif magic == 43:
+            big = True
+            f.read(4)
+            next_ifd = struct.unpack(bo + "Q", f.read(8))[0]
+        else:
+            raise ValueError(f"Versión TIFF no soportada ({magic}): {path}")
+
+        count_fmt, entry_size, ptr_fmt = ("Q", 20, "Q") if big else ("H", 12, "I")
+        inline = 8 if big else 4
+
+        while next_ifd:
+            f.seek(next_ifd)
+            n = struct.unpack(bo + count_fmt, f.read(struct.calcsize(count_fmt)))[0]
+            raw = f.read(n * entry_size)
+            next_ifd = struct.unpack(bo + ptr_fmt, f.read(struct.calcsize(ptr_fmt)))[0]
+
+            tags = {}
+            for k in range(n):
+                entry = raw[k * entry_size:(k + 1) * entry_size]
+                if big:
+                    tag, typ, cnt = struct.unpack(bo + "HHQ", entry[:12])
+                    value = entry[12:]
+                else:
+                    tag, typ, cnt = struct.unpack(bo + "HHI", entry[:8])
+                    value = entry[8:]
+                if typ not in _TIFF_TYPES:
+                    continue
+                fmt, size = _TIFF_TYPES[typ]
+                if cnt * size <= inline:
+                    data = value[:cnt * size]
+                else:
+                    pos = f.tell()
+                    f.seek(struct.unpack(bo + ptr_fmt, value[:struct.calcsize(ptr_fmt)])[0])
+                    data = f.read(cnt * size)
+                    f.seek(pos)
+                tags[tag] = struct.unpack(bo + fmt * cnt, data)
+
+            pages.append(_describe_page(tags, bo))
+    return pages
+
+
+def _describe_page(tags, bo):
+    width = tags[_TAG_WIDTH][0]
+    height = tags[_TAG_LENGTH][0]
+    bits = tags.get(_TAG_BITS, (1,))[0]
+    sample_format = tags.get(_TAG_SAMPLE_FORMAT, (1,))[0]
+    kind = {1: "u", 2: "i", 3: "f"}.get(sample_format, "u")
+    dtype = np.dtype(f"{bo}{kind}{max(bits // 8, 1)}")
+    page = {"shape": (height, width), "dtype": dtype, "offset": None}
+
+    plain = (
+        tags.get(_TAG_COMPRESSION, (1,))[0] == 1
+        and tags.get(_TAG_SAMPLES, (1,))[0] == 1
+        and _TAG_TILE_WIDTH not in tags
+        and bits in (8, 16, 32, 64)
+        and _TAG_STRIP_OFFSETS in tags
+    )
+    if not plain:
+        return page
+
+    offsets = tags[_TAG_STRIP_OFFSETS]
+    counts = tags.get(_TAG_STRIP_COUNTS)
+    if counts is None or len(counts) != len(offsets):
+        return page
+    contiguous = all(o + c == nxt for o, c, nxt in zip(offsets, counts, offsets[1:]))
+    if contiguous and sum(counts) >= width * height * dtype.itemsize:
+        page["offset"] = offsets[0]
+    return page
+
+
+def open_frame_source(path, exts=IMAGE_EXTS):
+    """Abre una carpeta de imágenes o un TIFF multipágina como FrameSource."""
+    if os.path.isdir(path):
+        return FolderSource(path, exts)
+    if path.lower().endswith(TIFF_EXTS):
+        return TiffStackSource(path)
+    raise ValueError(f"Fuente de cuadros no soportada: {path}")
+
+
+def resolve_frame_path(raw_dir, label):
+    """
+    Ubica los cuadros de una muestra: la carpeta raw/<label> o, si no existe,
+    la pila raw/<label>.tif(f).
+    """
+    folder = os.path.join(raw_dir, label)
+    if os.path.isdir(folder):
+        return folder
+    for ext in TIFF_EXTS:
+        candidate = folder + ext
+        if os.path.isfile(candidate):
+            return candidate
+    return folder
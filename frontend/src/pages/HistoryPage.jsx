@@ -5,40 +5,42 @@ import jsPDF from "jspdf";
 import autoTable from "jspdf-autotable";
 
 const HISTORY_CLEARED_AT_KEY = "historyClearedAt";
+const PAGE_SIZE = 100;
 
 export default function HistoryPage() {
   const [rows, setRows] = useState([]);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
+  const [nextCursor, setNextCursor] = useState(null);
 
-  useEffect(() => {
-    const loadHistory = async () => {
-      setLoading(true);
-      setError("");
-
-      try {
-        const data = await fetchHistory();
-        let list = data.items || [];
-
-        // 🔑 Filtrar por limpieza previa (timestamp)
-        const clearedAt = localStorage.getItem(HISTORY_CLEARED_AT_KEY);
-        if (clearedAt) {
-          const clearedTime = Number(clearedAt);
-          list = list.filter((r) => {
-            const created = new Date(r.created_at).getTime();
-            return created > clearedTime;
-          });
-        }
-
-        setRows(list);
-      } catch (err) {
-        console.error(err);
-        setError("Error al cargar historial.");
-      } finally {
-        setLoading(false);
+  const loadHistory = async (cursor = null) => {
+    setLoading(true);
+    setError("");
+
+    try {
+      const params = { limit: PAGE_SIZE };
+      if (cursor) params.cursor = cursor;
+
+      // 🔑 Filtrar por limpieza previa (timestamp) en el servidor
+      const clearedAt = localStorage.getItem(HISTORY_CLEARED_AT_KEY);
+      if (clearedAt) {
+        params.date_from = new Date(Number(clearedAt)).toISOString();
       }
-    };
 
+      const data = await fetchHistory(params);
+      const list = data.items || [];
+
+      setRows((prev) => (cursor ? [...prev, ...list] : list));
+      setNextCursor(data.next_cursor ?? null);
+    } catch (err) {
+      console.error(err);
+      setError("Error al cargar historial.");
+    } finally {
+      setLoading(false);
+    }
+  };
+
+  useEffect(() => {
     loadHistory();
   }, []);
 
@@ -48,6 +50,7 @@ export default function HistoryPage() {
   const clearHistory = () => {
     localStorage.setItem(HISTORY_CLEARED_AT_KEY, Date.now().toString());
     setRows([]);
+    setNextCursor(null);
     setError("");
   };
 
@@ -80,7 +83,9 @@ export default function HistoryPage() {
       r.iv_original != null ? r.iv_original.toFixed(2) : "-",
       r.iv_processed != null ? r.iv_processed.toFixed(2) : "-",
       r.zncc != null ? r.zncc.toFixed(4) : "-",
-      r.rssd != null ? r.rssd.toFixed(2) : "-",
+      r.rssd != null
+        ? r.rssd.toFixed(2) + (r.rssd_unit === "sum" ? " (suma)" : "")
+        : "-",
     ]);
 
     autoTable(doc, {
@@ -231,7 +236,10 @@ export default function HistoryPage() {
                   <td className="p-3">{renderValue(r.iv_original, 2)}</td>
                   <td className="p-3">{renderValue(r.iv_processed, 2)}</td>
                   <td className="p-3">{renderValue(r.zncc, 4)}</td>
-                  <td className="p-3">{renderValue(r.rssd, 2)}</td>
+                  <td className="p-3">
+                    {renderValue(r.rssd, 2)}
+                    {r.rssd_unit === "sum" && " (suma)"}
+                  </td>
                   <td className="p-3">
                     {renderMetricsFilter(r.filter_metrics)}
                   </td>
@@ -241,6 +249,18 @@ export default function HistoryPage() {
           </table>
         </div>
       )}
+
+      {nextCursor && (
+        <div className="flex justify-center mt-4">
+          <button
+            onClick={() => loadHistory(nextCursor)}
+            disabled={loading}
+            className="bg-blue-600 hover:bg-blue-700 disabled:opacity-50 text-white px-4 py-2 rounded"
+          >
+            Cargar más
+          </button>
+        </div>
+      )}
     </section>
   );
 }
@@ -62,8 +62,8 @@ export async function processActive(payload) {
   return res.data;
 }
 
-// Obtener historial
-export async function fetchHistory() {
-  const res = await api.get("/reference/history");
+// Obtener historial (paginado: { limit, cursor, fields, filename, date_from, date_to })
+export async function fetchHistory(params = {}) {
+  const res = await api.get("/reference/history", { params });
   return res.data;
 }
@@ -1,8 +1,12 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import cv2
 import numpy as np
 from tqdm import tqdm
 import yaml
+from frame_sources import FrameSource, list_images, open_frame_source
+from timing import count, timed
 
 
 def load_config(config_path="config.yaml"):
@@ -14,31 +18,181 @@ def load_config(config_path="config.yaml"):
 
 def list_images_in_folder(folder):
     """Devuelve una lista ordenada de rutas de imágenes en la carpeta."""
-    valid_exts = (".png", ".jpg", ".jpeg", ".tif", ".bmp")
-    files = [os.path.join(folder, f) for f in os.listdir(folder)
-             if f.lower().endswith(valid_exts)]
-    return sorted(files)
+    return list_images(folder)
 
 
-def load_images(folder, limit=None):
+@timed("load_images")
+def load_images(folder, limit=None, roi=None):
     """Carga imágenes como matrices NumPy, opcionalmente limitando la cantidad."""
-    files = list_images_in_folder(folder)
-    if limit:
-        files = files[:limit]
-    images = [cv2.imread(f, cv2.IMREAD_GRAYSCALE).astype(np.float32)
-              for f in tqdm(files, desc=f"Cargando {os.path.basename(folder)}")]
+    images = list(iter_images(folder, limit=limit, roi=roi))
     return np.stack(images, axis=0)  # (N, alto, ancho)
 
 
+def iter_images(folder, limit=None, threads=1, progress=True, dtype=np.float32,
+                roi=None):
+    """
+    Genera las imágenes de la carpeta una a una (float32 por defecto), sin
+    apilarlas.
+
+    `folder` puede ser una carpeta de imágenes, un TIFF multipágina, que se
+    lee directamente del archivo mapeado (ver frame_sources), o un
+    FrameSource ya abierto. Con roi ({x, y, w, h} de config.yaml) cada cuadro
+    se recorta al leerlo, antes de convertir el tipo. Con dtype=None se
+    entregan los cuadros en su tipo original. Con threads > 1 decodifica en paralelo (cv2.imread libera
+    el GIL), manteniendo el orden y como máximo 2 * threads cuadros en memoria.
+    """
+    if isinstance(folder, FrameSource):
+        opened = nullcontext(folder)
+    else:
+        opened = open_frame_source(folder)
+
+    with opened as source:
+        n = len(source)
+        if limit:
+            n = min(n, limit)
+        indices = tqdm(range(n), desc=f"Cargando {source.name}",
+                       disable=not progress)
+
+        def read(i):
+            with timed("frame_decode"):
+                frame = source.read(i, roi)
+                frame = frame if dtype is None else frame.astype(dtype)
+            count("frames_decoded")
+            return frame
+
+        if threads <= 1:
+            for i in indices:
+                yield read(i)
+            return
+
+        window = 2 * threads
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            pending = []
+            for i in indices:
+                pending.append(pool.submit(read, i))
+                if len(pending) >= window:
+                    yield pending.pop(0).result()
+            for fut in pending:
+                yield fut.result()
+
+
+@timed("average_images")
 def average_images(images):
     """Calcula el promedio de intensidad de un conjunto de imágenes."""
     avg_img = np.mean(images, axis=0)
     return avg_img
 
 
-def save_image(img, path):
-    """Guarda una imagen en escala de grises."""
-    cv2.imwrite(path, img.astype(np.uint8))
+def _accumulator_dtype(frame_dtype):
+    """Tipo de la suma: entero para cuadros enteros, float64 en otro caso."""
+    if frame_dtype.kind == "u":
+        return np.uint32 if frame_dtype.itemsize <= 2 else np.uint64
+    if frame_dtype.kind == "i":
+        return np.int64
+    return np.float64
+
+
+class RunningAverage:
+    """
+    Acumulador incremental del promedio de intensidad.
+
+    Los cuadros enteros (8/16 bits) se suman en uint32, que pasa a uint64
+    antes de poder desbordarse; los de punto flotante en float64. La suma es
+    exacta, así que el promedio final (float32) coincide bit a bit con
+    average_images. Con track_variance=True lleva además la varianza por
+    píxel mediante el algoritmo de Welford.
+    """
+
+    def __init__(self, track_variance=False):
+        self.count = 0
+        self.track_variance = track_variance
+        self.frame_dtype = None
+        self._sum = None
+        self._limit = None
+        self._mean = None
+        self._m2 = None
+
+    @timed("average_update")
+    def update(self, frame):
+        """Incorpora un cuadro (2D) al acumulador."""
+        if self._sum is None:
+            self.frame_dtype = frame.dtype
+            self._sum = np.zeros(frame.shape, dtype=_accumulator_dtype(frame.dtype))
+            if self._sum.dtype == np.uint32:
+                # cuadros que caben en la suma antes de desbordar uint32
+                self._limit = np.iinfo(np.uint32).max // np.iinfo(frame.dtype).max
+            if self.track_variance:
+                self._mean = np.zeros(frame.shape, dtype=np.float64)
+                self._m2 = np.zeros(frame.shape, dtype=np.float64)
+        elif frame.shape != self._sum.shape:
+            raise ValueError(
+                f"Dimensiones inconsistentes: {frame.shape} != {self._sum.shape}"
+            )
+
+        if self._limit is not None and self.count >= self._limit:
+            self._sum = self._sum.astype(np.uint64)
+            self._limit = None
+
+        self.count += 1
+        self._sum += frame
+
+        if self.track_variance:
+            delta = frame - self._mean
+            self._mean += delta / self.count
+            delta *= frame - self._mean
+            self._m2 += delta
+
+    def average(self):
+        """Devuelve el promedio acumulado como float32."""
+        if self.count == 0:
+            raise ValueError("No se acumuló ningún cuadro")
+        return (self._sum / self.count).astype(np.float32)
+
+    def variance(self, ddof=0):
+        """Devuelve la varianza por píxel (float64) acumulada con Welford."""
+        if not self.track_variance:
+            raise ValueError("El acumulador se creó sin track_variance")
+        if self.count - ddof <= 0:
+            raise ValueError("No hay suficientes cuadros para la varianza")
+        return self._m2 / (self.count - ddof)
+
+
+def stream_average(folder, limit=None, with_variance=False, threads=1,
+                   progress=True, roi=None):
+    """
+    Promedia las imágenes de la carpeta leyéndolas de a una.
+
+    La memoria máxima es un cuadro más el acumulador, en lugar de la pila
+    (N, alto, ancho) de load_images. Devuelve el promedio float32 o, con
+    with_variance=True, la tupla (promedio, varianza).
+    """
+    acc = RunningAverage(track_variance=with_variance)
+    for frame in iter_images(folder, limit=limit, threads=threads,
+                             progress=progress, dtype=None, roi=roi):
+        acc.update(frame)
+    if with_variance:
+        return acc.average(), acc.variance()
+    return acc.average()
+
+
+@timed("image_encode", format="png")
+def frame_bits(dtype):
+    """Bits por píxel de un tipo de cuadro entero (8 para el resto)."""
+    dtype = np.dtype(dtype)
+    return 8 * dtype.itemsize if dtype.kind in "ui" else 8
+
+
+def save_image(img, path, bits=8):
+    """
+    Guarda una imagen en escala de grises: en 8 bits como hasta ahora o, con
+    bits > 8, como PNG de 16 bits redondeado (para no perder la profundidad
+    de la cámara).
+    """
+    if bits > 8:
+        img = np.clip(np.rint(img), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+    else:
+        img = img.astype(np.uint8)
+    cv2.imwrite(path, img)
 
 
 def ensure_dir(path):
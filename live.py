@@ -0,0 +1,214 @@
+"""
+Métricas en vivo mientras la cámara sigue grabando.
+
+LiveMetrics actualiza el promedio de la muestra y su IV / ZNCC / rSSD
+contra la referencia con cada cuadro nuevo, en O(píxeles) y sin releer los
+anteriores: guarda la suma por píxel S (float64, exacta para cuadros
+enteros). Con window=N el promedio es el de los últimos N cuadros (el que
+sale se resta de S).
+
+Uso:
+    python live.py --reference data/.../ref/frame_000.png --watch data/.../n13311
+    python live.py --reference ref.png --watch carpeta --window 50 --roi 200,120,640,640 --csv vivo.csv
+"""
+import argparse
+import csv
+import os
+import time
+from collections import deque
+
+import numpy as np
+
+from frame_sources import IMAGE_EXTS, read_gray, roi_slices
+from metrics import ReferenceStats, compute_all
+
+
+# Espera entre revisiones de la carpeta (segundos)
+DEFAULT_POLL = 0.5
+
+
+class LiveMetrics:
+    """
+    Promedio incremental (total o en ventana deslizante) y métricas contra
+    la referencia, del cuadro nuevo y del promedio, en cada update().
+
+    Por cuadro: S += x y metrics.compute_all del cuadro y del promedio
+    A = S / n, con sumas centradas por bloque (sin Σx² - 2Σxy + Σy², que
+    pierde precisión con cuadros de media alta y poco contraste).
+    """
+
+    def __init__(self, reference, window=None):
+        # window=None o 0: promedio de todos los cuadros
+        self.ref = reference if isinstance(reference, ReferenceStats) \
+            else ReferenceStats(reference)
+        self.shape = self.ref.shape
+        window = int(window) if window else 0
+        if window < 0:
+            raise ValueError(f"window debe ser >= 0 (0 = sin ventana): {window}")
+        self.window = window or None
+        self.reset()
+
+    def reset(self):
+        """Vacía el promedio (la referencia se conserva)."""
+        self._sum = np.zeros(self.shape, dtype=np.float64)
+        self._frames = deque()
+        self.count = 0  # cuadros en el promedio actual
+        self.total = 0
+
+    def update(self, frame):
+        """Incorpora un cuadro y devuelve las métricas del cuadro y del promedio."""
+        if frame.shape != self.shape:
+            raise ValueError(f"Dimensiones inconsistentes: {frame.shape} != {self.shape}")
+        self._sum += frame
+        self.count += 1
+        self.total += 1
+        if self.window:
+            # Se guarda el cuadro (en su tipo original) para restarlo al salir
+            self._frames.append(frame.copy())
+            if self.count > self.window:
+                self._sum -= self._frames.popleft()
+                self.count -= 1
+
+        return {
+            "frame": self.total,
+            "n": self.count,
+            "frame_metrics": compute_all(frame, self.ref),
+            "average": compute_all(self._sum / self.count, self.ref),
+        }
+
+    def average(self):
+        """Promedio actual como float32 (alto, ancho)."""
+        if not self.count:
+            raise ValueError("No se acumuló ningún cuadro")
+        return (self._sum / self.count).astype(np.float32)
+
+
+def crop_reference(reference, roi):
+    """
+    Recorta la referencia a la ROI, salvo que ya tenga el tamaño de la ROI
+    (p. ej. un average.npy del RunStore, que se guarda recortado).
+    """
+    if not roi:
+        return reference
+    rows, cols = roi_slices(roi, reference.shape)
+    if reference.shape == (rows.stop - rows.start, cols.stop - cols.start):
+        return reference
+    return reference[rows, cols]
+
+
+# ============================================================
+# Carpeta vigilada
+# ============================================================
+def watch_directory(folder, exts=IMAGE_EXTS, poll=DEFAULT_POLL, idle_timeout=None,
+                    skip_existing=False):
+    """
+    Genera las rutas de imágenes nuevas de la carpeta, en orden de nombre,
+    cuando terminan de escribirse (mismo tamaño en dos revisiones seguidas).
+    Termina tras idle_timeout segundos sin archivos nuevos (None = nunca).
+    """
+    seen = set()
+    if skip_existing and os.path.isdir(folder):
+        seen.update(os.path.join(folder, f) for f in os.listdir(folder))
+    sizes = {}
+    last_new = time.monotonic()
+    while True:
+        names = sorted(os.listdir(folder)) if os.path.isdir(folder) else []
+        for name in names:
+            path = os.path.join(folder, name)
+            if path in seen or not name.lower().endswith(exts):
+                continue
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            if size > 0 and sizes.get(path) == size:
+                seen.add(path)
+                sizes.pop(path)
+                last_new = time.monotonic()
+                yield path
+            else:
+                sizes[path] = size
+        if idle_timeout is not None and time.monotonic() - last_new > idle_timeout:
+            return
+        time.sleep(poll)
+
+
+# ============================================================
+# CLI
+# ============================================================
+def parse_roi(text):
+    if not text:
+        return None
+    x, y, w, h = (int(v) for v in text.split(","))
+    return {"x": x, "y": y, "w": w, "h": h}
+
+
+def load_reference(path):
+    """Imagen de referencia (o promedio .npy del RunStore)."""
+    if path.endswith(".npy"):
+        return np.load(path)
+    return read_gray(path)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Métricas en vivo de una carpeta de cuadros")
+    parser.add_argument("--reference", required=True,
+                        help="Imagen de referencia o promedio .npy")
+    parser.add_argument("--watch", required=True,
+                        help="Carpeta donde la cámara escribe los cuadros")
+    parser.add_argument("--window", type=int, default=None,
+                        help="Promediar solo los últimos N cuadros")
+    parser.add_argument("--roi", default=None, help="ROI como x,y,w,h")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL,
+                        help="Segundos entre revisiones de la carpeta")
+    parser.add_argument("--idle-timeout", type=float, default=None,
+                        help="Terminar tras N segundos sin cuadros nuevos")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="Ignorar los cuadros que ya estaban en la carpeta")
+    parser.add_argument("--csv", default=None, help="Agregar cada actualización a este CSV")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    roi = parse_roi(args.roi)
+    live = LiveMetrics(crop_reference(load_reference(args.reference), roi),
+                       window=args.window)
+
+    out = open(args.csv, "a", newline="", encoding="utf-8") if args.csv else None
+    writer = None
+    if out is not None:
+        writer = csv.writer(out)
+        if out.tell() == 0:
+            writer.writerow(["file", "frame", "n", "IV", "ZNCC", "rSSD",
+                             "avg_IV", "avg_ZNCC", "avg_rSSD"])
+
+    print(f"Vigilando {args.watch} (Ctrl+C para terminar)")
+    try:
+        for path in watch_directory(args.watch, poll=args.poll,
+                                    idle_timeout=args.idle_timeout,
+                                    skip_existing=args.skip_existing):
+            try:
+                frame = read_gray(path)
+                r = live.update(frame[roi_slices(roi, frame.shape)])
+            except ValueError as e:
+                print(f"⚠️ {os.path.basename(path)}: {e}")
+                continue
+            f, a = r["frame_metrics"], r["average"]
+            print(f"{os.path.basename(path)}  #{r['frame']:<5} n={r['n']:<4} "
+                  f"ZNCC {f['ZNCC']:.4f}  promedio: IV {a['IV']:.2f}  "
+                  f"ZNCC {a['ZNCC']:.4f}  rSSD {a['rSSD']:.1f}")
+            if writer is not None:
+                writer.writerow([os.path.basename(path), r["frame"], r["n"],
+                                 f["IV"], f["ZNCC"], f["rSSD"],
+                                 a["IV"], a["ZNCC"], a["rSSD"]])
+                out.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if out is not None:
+            out.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""
+Mapas locales de IV / ZNCC / rSSD por ventanas (p. ej. 32x32 cada 8 px).
+
+Las sumas de cada ventana (Σx, Σx², Σx·y y las de la referencia Σy, Σy²)
+salen de tablas de áreas sumadas (imágenes integrales): cuatro lecturas por
+ventana sin importar su tamaño, tras una pasada O(píxeles) por cuadro.
+"""
+import cv2
+import numpy as np
+
+from timing import timed
+
+
+DEFAULT_WINDOW = 32
+DEFAULT_STRIDE = 8
+
+# Cuadros por lote en LocalMapEngine: los temporales son float64
+# (3, lote, alto, ancho), unos 25 MB por cuadro de 1024x1024
+DEFAULT_BATCH_SIZE = 4
+
+METRICS = ("IV", "ZNCC", "rSSD")
+
+
+class WindowGrid:
+    """
+    Ventanas cuadradas de lado `window` cada `stride` píxeles que caben en
+    la imagen. Solo hacen falta las filas y columnas de la imagen integral
+    en los bordes de las ventanas (inicio y fin), así que se guardan esos
+    índices y, para cada ventana, su posición dentro de ellos.
+    """
+
+    def __init__(self, shape, window=DEFAULT_WINDOW, stride=DEFAULT_STRIDE):
+        h, w = shape
+        window, stride = int(window), int(stride)
+        if window < 2 or stride < 1:
+            raise ValueError("Se requiere window >= 2 y stride >= 1")
+        if window > min(h, w):
+            raise ValueError(f"La ventana ({window}) no cabe en la imagen {h}x{w}")
+        self.image_shape = (h, w)
+        self.window = window
+        self.stride = stride
+        self.size = window * window
+
+        rows = np.arange(0, h - window + 1, stride)
+        cols = np.arange(0, w - window + 1, stride)
+        self.shape = (len(rows), len(cols))
+        self.rows, self._r0, self._r1 = _edges(rows, window)
+        self.cols, self._c0, self._c1 = _edges(cols, window)
+
+        # Centro de cada ventana en píxeles de la imagen (o de la ROI)
+        self.y = rows + window / 2
+        self.x = cols + window / 2
+
+    def sums(self, q):
+        """
+        Suma de cada ventana para un lote (..., alto, ancho) float64:
+        imagen integral restringida a los bordes y cuatro lecturas. El
+        acumulado por columnas se hace en el lugar (q se sobrescribe).
+        """
+        lead = q.shape[:-2]
+        h, w = self.image_shape
+        rows = np.empty(lead + (len(self.rows), w + 1), dtype=np.float64)
+        rows[..., 0] = 0.0
+
+        # Acumulado por columnas hasta cada fila borde (exclusiva)
+        acc = np.cumsum(q, axis=-2, out=q)
+        top = self.rows == 0
+        rows[..., top, 1:] = 0.0
+        rows[..., ~top, 1:] = acc[..., self.rows[~top] - 1, :]
+        np.cumsum(rows[..., 1:], axis=-1, out=rows[..., 1:])
+
+        sat = rows[..., self.cols]
+        r0, r1 = self._r0[:, None], self._r1[:, None]
+        c0, c1 = self._c0[None, :], self._c1[None, :]
+        return sat[..., r1, c1] - sat[..., r0, c1] - sat[..., r1, c0] + sat[..., r0, c0]
+
+
+def _edges(starts, window):
+    """Bordes únicos (inicio y fin de ventana) y el índice de cada uno."""
+    edges, inverse = np.unique(np.concatenate([starts, starts + window]),
+                               return_inverse=True)
+    return edges, inverse[:len(starts)], inverse[len(starts):]
+
+
+class LocalMapEngine:
+    """
+    Mapas locales por cuadro contra una referencia, por lotes.
+
+    A cada cuadro se le resta su media global (y a la referencia la suya)
+    antes de integrar, para no perder precisión al restar sumas grandes.
+    Por ventana, con n = window² píxeles y x, y ya centrados:
+
+      ZNCC = (Σxy - ΣxΣy/n) / sqrt((Σx² - (Σx)²/n) (Σy² - (Σy)²/n))
+      rSSD = (Σx² - 2Σxy + Σy² + 2d(Σx - Σy) + n d²) / n,  d = media_x - media_y
+
+    iguales a metrics.ZNCC / metrics.rSSD sobre el recorte de la ventana
+    (ZNCC = 0 si alguna de las dos ventanas es uniforme). Los mapas son
+    float32 (filas, columnas de la grilla).
+    """
+
+    def __init__(self, reference, window=DEFAULT_WINDOW, stride=DEFAULT_STRIDE,
+                 batch_size=DEFAULT_BATCH_SIZE, keep_frames=True):
+        ref = np.asarray(reference, dtype=np.float64)
+        self.grid = WindowGrid(ref.shape, window, stride)
+        self.shape = ref.shape
+        self.batch_size = max(1, int(batch_size))
+        self.keep_frames = keep_frames
+
+        self.ref_mean = float(ref.mean())
+        self._ref = ref - self.ref_mean
+        sy, syy = self.grid.sums(np.stack([self._ref, self._ref * self._ref]))
+        self._sy = sy
+        self._syy = syy
+        self._vary = np.maximum(syy - sy * sy / self.grid.size, 0.0)
+
+        self._buf = np.empty((3, self.batch_size) + self.shape, dtype=np.float64)
+        self._pending = 0
+        self._means = []
+        self._sums = {m: np.zeros(self.grid.shape, dtype=np.float64) for m in METRICS}
+        self.frames = {m: [] for m in METRICS}
+        self.count = 0
+
+    def add(self, frame):
+        """Agrega un cuadro 2D; procesa el lote cuando se llena."""
+        if frame.shape != self.shape:
+            raise ValueError(
+                f"Dimensiones inconsistentes con la referencia: {frame.shape} != {self.shape}"
+            )
+        x = self._buf[0, self._pending]
+        x[...] = frame
+        mean = x.mean()
+        x -= mean
+        self._means.append(mean)
+        self._pending += 1
+        if self._pending == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Procesa los cuadros pendientes del lote actual."""
+        if self._pending == 0:
+            return
+        n = self._pending
+        means = np.array(self._means)
+        self._pending = 0
+        self._means = []
+        self._process(self._buf[:, :n], means)
+
+    @timed("local_maps_batch")
+    def _process(self, q, means):
+        """Mapas de un lote (x centrado en q[0]) ya copiado al búfer."""
+        x = q[0]
+        np.multiply(x, x, out=q[1])
+        np.multiply(x, self._ref, out=q[2])
+        sx, sxx, sxy = self.grid.sums(q)
+
+        n = self.grid.size
+        sy, syy = self._sy, self._syy
+        d = (means - self.ref_mean)[:, None, None]
+
+        varx = np.maximum(sxx - sx * sx / n, 0.0)
+        denominator = np.sqrt(varx * self._vary)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            zncc = np.where(denominator > 0, (sxy - sx * sy / n) / denominator, 0.0)
+        maps = {
+            "IV": sx / n + means[:, None, None],
+            "ZNCC": zncc,
+            "rSSD": (sxx - 2.0 * sxy + syy + 2.0 * d * (sx - sy)) / n + d * d,
+        }
+
+        self.count += len(means)
+        for m, values in maps.items():
+            self._sums[m] += values.sum(axis=0)
+            if self.keep_frames:
+                self.frames[m].append(values.astype(np.float32))
+
+    def maps(self):
+        """Media por ventana de los mapas de todos los cuadros (float32)."""
+        self.flush()
+        if not self.count:
+            raise ValueError("No se agregó ningún cuadro")
+        return {m: (s / self.count).astype(np.float32) for m, s in self._sums.items()}
+
+    def frame_maps(self):
+        """Mapas por cuadro, float32 (cuadros, filas, columnas)."""
+        self.flush()
+        return {
+            m: np.concatenate(parts) if parts
+            else np.empty((0,) + self.grid.shape, dtype=np.float32)
+            for m, parts in self.frames.items()
+        }
+
+    def result(self):
+        """Grilla, mapas medios (listas) y resumen por métrica."""
+        maps = self.maps()
+        return {
+            "n_images": self.count,
+            "window": self.grid.window,
+            "stride": self.grid.stride,
+            "grid": list(self.grid.shape),
+            "x": self.grid.x.tolist(),
+            "y": self.grid.y.tolist(),
+            "summary": map_summary(maps),
+            "maps": {m: v.tolist() for m, v in maps.items()},
+        }
+
+
+def local_maps(image, reference, window=DEFAULT_WINDOW, stride=DEFAULT_STRIDE):
+    """Mapas de una sola imagen (p. ej. el promedio de la muestra)."""
+    engine = LocalMapEngine(reference, window, stride, batch_size=1, keep_frames=False)
+    engine.add(image)
+    return engine.maps()
+
+
+def analyze_local_maps(frames, reference, window=DEFAULT_WINDOW, stride=DEFAULT_STRIDE,
+                       batch_size=DEFAULT_BATCH_SIZE, keep_frames=False):
+    """
+    Mapas de una secuencia de cuadros 2D. Devuelve el engine ya vaciado
+    (maps() y frame_maps()) o None si no hubo cuadros.
+    """
+    engine = LocalMapEngine(reference, window, stride, batch_size, keep_frames)
+    for frame in frames:
+        engine.add(frame)
+    engine.flush()
+    return engine if engine.count else None
+
+
+def map_summary(maps):
+    """Media, mínimo y máximo de cada mapa."""
+    return {
+        m: {"mean": float(v.mean()), "min": float(v.min()), "max": float(v.max())}
+        for m, v in maps.items()
+    }
+
+
+# ============================================================
+# Imágenes
+# ============================================================
+def map_to_image(values, vmin=None, vmax=None, scale=1, colormap=cv2.COLORMAP_VIRIDIS):
+    """
+    Mapa 2D como imagen uint8: [vmin, vmax] (por defecto el rango del mapa)
+    a 0..255, ampliado `scale` veces sin interpolar y con paleta de colores
+    (BGR) salvo colormap=None (escala de grises).
+    """
+    values = np.asarray(values, dtype=np.float32)
+    lo = float(np.nanmin(values)) if vmin is None else float(vmin)
+    hi = float(np.nanmax(values)) if vmax is None else float(vmax)
+    span = hi - lo if hi > lo else 1.0
+    img = np.clip((values - lo) * (255.0 / span), 0, 255)
+    img = np.nan_to_num(img).astype(np.uint8)
+    if scale > 1:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_NEAREST)
+    if colormap is not None:
+        img = cv2.applyColorMap(img, colormap)
+    return img
+
+
+@timed("image_encode")
+def encode_png(img):
+    ok, buf = cv2.imencode(".png", img)
+    if not ok:
+        raise ValueError("No se pudo codificar el mapa como PNG")
+    return buf.tobytes()
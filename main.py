@@ -1,75 +1,410 @@
 import os
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import cv2
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
-from io_utils import load_config, load_images, average_images, save_image, ensure_dir
-from metrics import IV, ZNCC, rSSD
+from io_utils import (load_config, iter_images, RunningAverage, save_image, ensure_dir,
+                      frame_bits)
+from frame_sources import resolve_frame_path
+from metrics import ReferenceStats, compute_all
+from spectrum import DEFAULT_BATCH_SIZE as SPECTRUM_BATCH_SIZE, analyze_spectrum
+from local_maps import (DEFAULT_STRIDE as MAP_STRIDE, DEFAULT_WINDOW as MAP_WINDOW,
+                        analyze_local_maps, local_maps, map_to_image)
+from run_store import RunStore, describe_source
+from timing import process_memory, registry, timed
+from avg_cache import AverageCache, cache_key
 
 
-def main():
-    # === 1. Leer archivo de configuración ===
-    cfg = load_config("config.yaml")
-    paths = cfg["paths"]
-    exp = cfg["experiment"]
+# Referencia compartida por los procesos de trabajo (ver _attach_reference)
+_SHARED_REF = None
+_SHARED_SHM = None
+_SHARED_STATS = None
 
-    run_id = exp["run_id"]
-    base_dir = paths["base"]
-    raw_dir = paths["raw"]
-    processed_dir = paths["processed"]
-    results_dir = paths["results"]
 
-    ensure_dir(processed_dir)
-    ensure_dir(results_dir)
+def open_cache(run):
+    """AverageCache de la corrida, o None si está desactivado."""
+    if run["cache_dir"] is None:
+        return None
+    return AverageCache(run["cache_dir"], run["cache_max_bytes"])
 
-    # === 2. Cargar imágenes de referencia ===
-    print("\n=== Cargando referencia ===")
-    ref_folder = os.path.join(raw_dir, exp["reference_label"])
-    ref_images = load_images(ref_folder, limit=exp["frames_per_sample"])
-    ref_avg = average_images(ref_images)
-    save_image(ref_avg, os.path.join(processed_dir, "avg", f"{exp['reference_label']}_avg.png"))
 
-    # === 3. Calcular métricas ===
-    data_rows = []
+def sample_source(label, run):
+    """Ruta de los cuadros crudos de la muestra y su origen para el RunStore."""
+    exp = run["exp"]
+    folder = resolve_frame_path(run["raw_dir"], label)
+    return folder, describe_source(folder, exp["frames_per_sample"], exp.get("roi"))
 
-    print("\n=== Analizando muestras ===")
-    for sample in exp["samples"]:
-        label = sample["label"]
-        n_value = sample["n"]
 
-        folder = os.path.join(raw_dir, label)
-        print(f"\nProcesando muestra: {label} (n={n_value})")
+def sample_average(label, run, threads=1, progress=True):
+    """
+    Promedio float32 de una muestra y su clave en el caché (o None).
+
+    Con run["from_store"] se lee del RunStore sin decodificar nada. Si la
+    huella de los cuadros y la configuración coinciden con una entrada del
+    caché, se reutiliza ese promedio. En otro caso se promedian los cuadros
+    crudos (archivándolos en el almacén si run["store_frames"]); el promedio
+    se guarda en el caché, en el almacén y como PNG, de 8 o 16 bits según
+    el tipo de los cuadros (no camera_bits: una cámara de 16 bits puede
+    entregar cuadros de 8).
+    """
+    exp = run["exp"]
+    store = RunStore(run["store_dir"])
+    if run["from_store"]:
+        return np.asarray(store.read_average(label)), None
+
+    folder, source = sample_source(label, run)
+    save_path = os.path.join(run["processed_dir"], "avg", f"{label}_avg.png")
+
+    cache = open_cache(run)
+    key = None
+    if cache is not None:
+        key = cache_key(folder, exp["frames_per_sample"],
+                        frames_per_sample=exp["frames_per_sample"],
+                        roi=exp.get("roi"),
+                        camera_bits=exp.get("camera_bits"),
+                        depth="native")
+        avg_img = None if run["store_frames"] else cache.get_average(key)
+        frame_dtype = cache.frame_dtype(key) if avg_img is not None else None
+        if frame_dtype is not None:
+            print(f"Promedio de {label} tomado del caché")
+            store.write_average(label, avg_img, source)
+            save_image(avg_img, save_path, bits=frame_bits(frame_dtype))
+            return avg_img, key
+
+    frames = iter_images(folder, limit=exp["frames_per_sample"],
+                         threads=threads, progress=progress, dtype=None,
+                         roi=exp.get("roi"))
+    if run["store_frames"]:
+        frames = store.record_frames(label, frames, source)
+
+    acc = RunningAverage()
+    for frame in frames:
+        acc.update(frame)
+    avg_img = acc.average()
+
+    if cache is not None:
+        cache.put_average(key, avg_img, acc.frame_dtype)
+    store.write_average(label, avg_img, source)
+    save_image(avg_img, save_path, bits=frame_bits(acc.frame_dtype))
+    return avg_img, key
+
 
-        # 3.1 Cargar imágenes y calcular promedio
-        imgs = load_images(folder, limit=exp["frames_per_sample"])
-        avg_img = average_images(imgs)
+def process_sample(sample, run, ref_stats, threads=1, progress=True):
+    """Promedia una muestra, calcula sus métricas y devuelve la fila del CSV."""
+    label = sample["label"]
+    n_value = sample["n"]
 
-        # 3.2 Calcular métricas
-        iv_val = IV(avg_img)
-        zncc_val = ZNCC(avg_img, ref_avg)
-        rssd_val = rSSD(avg_img, ref_avg)
+    print(f"\nProcesando muestra: {label} (n={n_value})")
 
-        # 3.3 Guardar imagen promedio
-        save_path = os.path.join(processed_dir, "avg", f"{label}_avg.png")
-        save_image(avg_img, save_path)
+    # 3.1 Cargar imágenes (o el promedio almacenado) y calcular promedio
+    avg_img, key = sample_average(label, run, threads=threads, progress=progress)
 
-        # 3.4 Almacenar resultados en lista
-        data_rows.append({
+    # 3.2 Calcular métricas (una sola pasada; términos de la referencia ya
+    # calculados), salvo que el caché ya las tenga para esta referencia
+    cache = open_cache(run) if key and run["ref_key"] else None
+    values = cache.get_metrics(key, run["ref_key"]) if cache else None
+    if values is None:
+        values = compute_all(avg_img, ref_stats)
+        if cache:
+            cache.put_metrics(key, run["ref_key"], values)
+
+    return {
+        "sample": label,
+        "n_value": n_value,
+        "IV": values["IV"],
+        "ZNCC": values["ZNCC"],
+        "rSSD": values["rSSD"]
+    }
+
+
+def sample_frames(label, run, threads=1, progress=True):
+    """
+    Cuadros de una muestra para las etapas por cuadro (espectro, mapas
+    locales): los del RunStore (ya recortados a la ROI) si se archivaron
+    desde los mismos cuadros crudos, con la misma ROI y límite; si no, los
+    crudos. Con run["from_store"] se usan los almacenados sin comparar.
+    """
+    exp = run["exp"]
+    store = RunStore(run["store_dir"])
+    if run["from_store"] and store.frame_count(label):
+        return iter_images(store.frame_source(label), limit=exp["frames_per_sample"],
+                           threads=threads, progress=progress, dtype=None)
+    folder, source = sample_source(label, run)
+    if store.frame_count(label, source):
+        frames, roi = store.frame_source(label, source), None
+    else:
+        frames, roi = folder, exp.get("roi")
+    return iter_images(frames, limit=exp["frames_per_sample"], threads=threads,
+                       progress=progress, dtype=None, roi=roi)
+
+
+def spectrum_stage(labels, run, batch_size=SPECTRUM_BATCH_SIZE, threads=1,
+                   progress=True):
+    """
+    Espectro de potencia radial y tamaño de grano por cuadro de cada
+    muestra (ver spectrum.SpectrumEngine). Devuelve las filas del resumen y
+    los arreglos por cuadro de cada muestra.
+    """
+    rows = []
+    arrays = {}
+    for label in labels:
+        print(f"\nEspectro de: {label}")
+        engine = analyze_spectrum(sample_frames(label, run, threads, progress),
+                                  batch_size=batch_size, keep_psd=True)
+        if engine is None:
+            print(f"⚠️ {label}: sin cuadros, se omite el espectro")
+            continue
+        result = engine.result()
+        rows.append({
             "sample": label,
-            "n_value": n_value,
-            "IV": iv_val,
-            "ZNCC": zncc_val,
-            "rSSD": rssd_val
+            "n_frames": result["n_images"],
+            "grain_px": result["grain"],
+            "grain_x_px": result["grain_x"],
+            "grain_y_px": result["grain_y"],
         })
+        arrays["freq"] = engine.plan.freq
+        arrays[f"{label}__psd"] = engine.psd_frames()
+        arrays[f"{label}__grain"] = np.asarray(result["series"]["grain"], dtype=np.float32)
+    return rows, arrays
 
-    # === 4. Exportar resultados a CSV ===
+
+def write_spectrum(rows, arrays, results_dir, run_id):
+    """
+    Exporta <run_id>_spectrum.csv (tamaño de grano medio por muestra) y
+    <run_id>_spectrum.npz (freq y, por muestra, <label>__psd (cuadros,
+    anillos) y <label>__grain).
+    """
+    out_csv = os.path.join(results_dir, f"{run_id}_spectrum.csv")
+    pd.DataFrame(rows).to_csv(out_csv, index=False)
+    np.savez(os.path.join(results_dir, f"{run_id}_spectrum.npz"), **arrays)
+    return out_csv
+
+
+def local_maps_stage(labels, run, ref_avg, window=MAP_WINDOW, stride=MAP_STRIDE,
+                     per_frame=False, threads=1, progress=True):
+    """
+    Mapas locales de IV / ZNCC / rSSD (ventanas window x window cada stride
+    píxeles) del promedio de cada muestra contra el de la referencia, y con
+    per_frame también los de cada cuadro. Se guardan en el RunStore y el de
+    ZNCC como PNG en <processed>/maps; devuelve las filas del resumen.
+    Salvo con run["from_store"], el promedio almacenado debe ser de los
+    cuadros crudos actuales (lo escribe sample_average en esta corrida).
+    """
+    store = RunStore(run["store_dir"])
+    maps_dir = os.path.join(run["processed_dir"], "maps")
+    ensure_dir(maps_dir)
+
+    rows = []
+    for label in labels:
+        print(f"\nMapas locales de: {label}")
+        source = None if run["from_store"] else sample_source(label, run)[1]
+        maps = local_maps(np.asarray(store.read_average(label, source)), ref_avg,
+                          window, stride)
+        frame_maps = None
+        if per_frame:
+            engine = analyze_local_maps(sample_frames(label, run, threads, progress),
+                                        ref_avg, window, stride, keep_frames=True)
+            frame_maps = engine.frame_maps() if engine is not None else None
+        store.write_maps(label, maps, window, stride, frame_maps,
+                         source=store.meta(label)["average"].get("source"))
+        cv2.imwrite(os.path.join(maps_dir, f"{label}_zncc.png"),
+                    map_to_image(maps["ZNCC"], scale=stride))
+
+        rows.append({
+            "sample": label,
+            "grid": "x".join(str(v) for v in maps["ZNCC"].shape),
+            "zncc_mean": float(maps["ZNCC"].mean()),
+            "zncc_min": float(maps["ZNCC"].min()),
+            "rssd_mean": float(maps["rSSD"].mean()),
+            "rssd_max": float(maps["rSSD"].max()),
+        })
+    store.write_index()
+    return rows
+
+
+def _attach_reference(shm_name, shape, dtype):
+    """Inicializador de cada proceso: mapea la referencia en memoria compartida."""
+    global _SHARED_REF, _SHARED_SHM, _SHARED_STATS
+    _SHARED_SHM = shared_memory.SharedMemory(name=shm_name)
+    _SHARED_REF = np.ndarray(shape, dtype=dtype, buffer=_SHARED_SHM.buf)
+    _SHARED_REF.flags.writeable = False
+    _SHARED_STATS = ReferenceStats(_SHARED_REF)
+
+
+def _process_sample_worker(sample, run, threads):
+    """Fila de la muestra y los tiempos medidos en este proceso para ella."""
+    registry.reset()
+    row = process_sample(sample, run, _SHARED_STATS, threads=threads,
+                         progress=False)
+    peak = process_memory()[1]
+    if peak is not None:
+        registry.set("worker_peak_rss_bytes", peak)
+    return row, registry.snapshot()
+
+
+def run_parallel(samples, run, ref_avg, workers):
+    """
+    Procesa las muestras en un pool de procesos.
+
+    La referencia se copia una sola vez a memoria compartida; los procesos la
+    leen sin serializarla. Si hay más procesos que muestras, el sobrante se
+    usa como hilos de decodificación dentro de cada muestra. Las filas se
+    devuelven en el orden de config.yaml; los tiempos de cada proceso se
+    suman al registro de timing de este.
+    """
+    n_procs = max(1, min(workers, len(samples)))
+    threads = max(1, workers // n_procs)
+
+    shm = shared_memory.SharedMemory(create=True, size=ref_avg.nbytes)
+    shared = np.ndarray(ref_avg.shape, dtype=ref_avg.dtype, buffer=shm.buf)
+    shared[:] = ref_avg
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_procs,
+            initializer=_attach_reference,
+            initargs=(shm.name, ref_avg.shape, ref_avg.dtype.str),
+        ) as pool:
+            futures = [
+                pool.submit(_process_sample_worker, sample, run, threads)
+                for sample in samples
+            ]
+            rows = []
+            for f in futures:
+                row, timings = f.result()
+                registry.merge(timings)
+                rows.append(row)
+            return rows
+    finally:
+        del shared
+        shm.close()
+        shm.unlink()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Análisis de speckle SPR")
+    parser.add_argument("--config", default="config.yaml",
+                        help="Ruta del archivo de configuración")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Procesos en paralelo (1 = modo secuencial)")
+    parser.add_argument("--store-frames", action="store_true",
+                        help="Archivar los cuadros crudos en el almacén de la corrida")
+    parser.add_argument("--from-store", action="store_true",
+                        help="Recalcular métricas desde los promedios almacenados")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="No usar el caché de promedios")
+    parser.add_argument("--spectrum", action="store_true",
+                        help="Calcular espectro radial y tamaño de grano por cuadro")
+    parser.add_argument("--spectrum-batch", type=int, default=SPECTRUM_BATCH_SIZE,
+                        help="Cuadros por lote de FFT en la etapa de espectro")
+    parser.add_argument("--local-maps", action="store_true",
+                        help="Calcular mapas locales de ZNCC / rSSD por ventanas")
+    parser.add_argument("--map-window", type=int, default=MAP_WINDOW,
+                        help="Lado de la ventana de los mapas locales (píxeles)")
+    parser.add_argument("--map-stride", type=int, default=MAP_STRIDE,
+                        help="Paso entre ventanas de los mapas locales (píxeles)")
+    parser.add_argument("--map-frames", action="store_true",
+                        help="Guardar también los mapas locales de cada cuadro")
+    return parser.parse_args()
+
+
+def prepare_run(cfg, store_frames=False, from_store=False, use_cache=True):
+    """Crea las carpetas de salida y arma el diccionario `run` de la corrida."""
+    paths = cfg["paths"]
+    processed_dir = paths["processed"]
+
+    ensure_dir(processed_dir)
+    ensure_dir(os.path.join(processed_dir, "avg"))
+    ensure_dir(paths["results"])
+
+    cache_cfg = cfg.get("cache") or {}
+    use_cache = use_cache and cache_cfg.get("enabled", True)
+    return {
+        "exp": cfg["experiment"],
+        "raw_dir": paths["raw"],
+        "processed_dir": processed_dir,
+        "store_dir": os.path.join(processed_dir, "store"),
+        "store_frames": store_frames,
+        "from_store": from_store,
+        "cache_dir": cache_cfg.get("dir", "./cache") if use_cache else None,
+        "cache_max_bytes": int(cache_cfg.get("max_mb", 2048)) * 1024 * 1024,
+        "ref_key": None,
+    }
+
+
+def write_results(data_rows, results_dir, run_id):
+    """Exporta las filas de métricas a <results>/<run_id>_metrics.csv."""
     df = pd.DataFrame(data_rows)
     out_csv = os.path.join(results_dir, f"{run_id}_metrics.csv")
     df.to_csv(out_csv, index=False)
+    return out_csv, df
+
+
+def main():
+    args = parse_args()
+
+    # === 1. Leer archivo de configuración ===
+    cfg = load_config(args.config)
+    exp = cfg["experiment"]
+    run = prepare_run(cfg, store_frames=args.store_frames,
+                      from_store=args.from_store, use_cache=not args.no_cache)
+
+    # === 2. Cargar imágenes de referencia ===
+    print("\n=== Cargando referencia ===")
+    with timed("run_stage", stage="reference"):
+        ref_avg, run["ref_key"] = sample_average(exp["reference_label"], run,
+                                                 threads=max(1, args.workers))
+
+    # === 3. Calcular métricas ===
+    print("\n=== Analizando muestras ===")
+    with timed("run_stage", stage="samples"):
+        if args.workers > 1:
+            data_rows = run_parallel(exp["samples"], run, ref_avg, args.workers)
+        else:
+            ref_stats = ReferenceStats(ref_avg)
+            data_rows = [
+                process_sample(sample, run, ref_stats)
+                for sample in exp["samples"]
+            ]
+
+    if not args.from_store:
+        RunStore(run["store_dir"]).write_index()
+
+    # === 4. Exportar resultados a CSV ===
+    out_csv, df = write_results(data_rows, cfg["paths"]["results"], exp["run_id"])
     print(f"\n✅ Resultados guardados en: {out_csv}")
 
+    # === 5. Espectro de speckle (opcional) ===
+    if args.spectrum:
+        print("\n=== Espectro de speckle ===")
+        labels = [exp["reference_label"]] + [s["label"] for s in exp["samples"]]
+        with timed("run_stage", stage="spectrum"):
+            spec_rows, arrays = spectrum_stage(labels, run,
+                                               batch_size=args.spectrum_batch,
+                                               threads=max(1, args.workers))
+        spec_csv = write_spectrum(spec_rows, arrays, cfg["paths"]["results"],
+                                  exp["run_id"])
+        print(f"✅ Espectro guardado en: {spec_csv}")
+
+    # === 6. Mapas locales (opcional) ===
+    if args.local_maps:
+        print("\n=== Mapas locales ===")
+        labels = [s["label"] for s in exp["samples"]]
+        with timed("run_stage", stage="local_maps"):
+            map_rows = local_maps_stage(labels, run, ref_avg,
+                                        window=args.map_window,
+                                        stride=args.map_stride,
+                                        per_frame=args.map_frames,
+                                        threads=max(1, args.workers))
+        maps_csv = os.path.join(cfg["paths"]["results"], f"{exp['run_id']}_local_maps.csv")
+        pd.DataFrame(map_rows).to_csv(maps_csv, index=False)
+        print(f"✅ Mapas locales guardados en: {maps_csv}")
+
     print("\n=== Análisis completado con éxito ===")
     print(df)
+    print(registry.format_summary())
 
 
 if __name__ == "__main__":
@@ -1,5 +1,11 @@
 import numpy as np
 
+from timing import timed
+
+
+# Filas por bloque en compute_all: acota los temporales a unos pocos MB
+DEFAULT_BLOCK_ROWS = 256
+
 
 def IV(I):
     """
@@ -52,4 +58,112 @@ def rSSD(I, I0):
     """
     M, N = I.shape
     return np.sum((I - I0)**2) / (M * N)
-pygame.cursors.load_xbm(cursorfile, maskfile)
\ No newline at end of file
+
+
+class _Moments:
+    """
+    Medias y sumas centradas Σdx² y Σdx·dy de dos imágenes, acumuladas
+    por bloques con la fórmula de combinación de Chan et al.: cada bloque se
+    centra en su propia media, así que no se restan sumas grandes como en
+    Σx² - (Σx)²/n, que con cuadros de 16 bits de media alta y poco contraste
+    pierde todos los dígitos.
+    """
+    __slots__ = ("n", "mean_x", "mean_y", "m2x", "cxy")
+
+    def __init__(self):
+        self.n = 0
+        self.mean_x = self.mean_y = 0.0
+        self.m2x = self.cxy = 0.0
+
+    def merge(self, n, mean_x, mean_y, m2x, cxy):
+        total = self.n + n
+        dx = mean_x - self.mean_x
+        dy = mean_y - self.mean_y
+        w = self.n * n / total
+        self.m2x += m2x + dx * dx * w
+        self.cxy += cxy + dx * dy * w
+        self.mean_x += dx * n / total
+        self.mean_y += dy * n / total
+        self.n = total
+
+
+class ReferenceStats:
+    """
+    Términos de la referencia I0 que no dependen de la muestra: número de
+    píxeles, media, sum((I0 - Ī0)^2) y la media de cada bloque de filas.
+
+    Se calculan una sola vez por corrida y se reutilizan en compute_all
+    para todas las muestras.
+    """
+
+    def __init__(self, I0, block_rows=DEFAULT_BLOCK_ROWS):
+        self.image = I0
+        self.shape = I0.shape
+        self.size = I0.size
+        self.block_rows = block_rows
+
+        acc = _Moments()
+        self.block_means = []
+        for r in range(0, I0.shape[0], block_rows):
+            y = I0[r:r + block_rows].astype(np.float64)
+            mean = y.mean()
+            y -= mean
+            acc.merge(y.size, mean, 0.0, np.vdot(y, y), 0.0)
+            self.block_means.append(float(mean))
+        self.mean = float(acc.mean_x)
+        self.centered_sum_sq = float(acc.m2x)
+
+    @property
+    def sum(self):
+        return self.mean * self.size
+
+
+@timed("compute_all")
+def compute_all(I, I0, block_rows=DEFAULT_BLOCK_ROWS):
+    """
+    Calcula IV, ZNCC y rSSD en una sola pasada por bloques de filas.
+
+    Por bloque centra x e y en sus medias y acumula en float64 Σdx², Σdx·dy
+    y Σ(x - y)², sin temporales del tamaño de la imagen; los bloques se
+    combinan con _Moments y ZNCC sale de las sumas centradas:
+
+    ZNCC = Σdx·dy / sqrt(Σdx² · Σdy²)
+
+    Donde:
+      - I: imagen promedio (muestra)
+      - I0: imagen promedio (referencia) o un ReferenceStats ya calculado
+      - block_rows: filas por bloque (si I0 es un ReferenceStats se usan
+        las suyas)
+
+    Devuelve un diccionario {"IV", "ZNCC", "rSSD"}.
+    """
+    ref = I0 if isinstance(I0, ReferenceStats) else ReferenceStats(I0, block_rows)
+    if I.shape != ref.shape:
+        raise ValueError(f"Dimensiones inconsistentes: {I.shape} != {ref.shape}")
+
+    acc = _Moments()
+    sdd = 0.0
+    rows = ref.block_rows
+    for k, r in enumerate(range(0, I.shape[0], rows)):
+        x = I[r:r + rows].astype(np.float64)
+        y = ref.image[r:r + rows].astype(np.float64)
+        mean_x = x.mean()
+        mean_y = ref.block_means[k]
+        x -= mean_x
+        y -= mean_y
+        m2x = np.vdot(x, x)
+        cxy = np.vdot(x, y)
+        acc.merge(x.size, mean_x, mean_y, m2x, cxy)
+        # x - y = dx - dy + (media_x - media_y), sin expandir el cuadrado
+        x -= y
+        x += mean_x - mean_y
+        sdd += np.vdot(x, x)
+
+    denominator = np.sqrt(acc.m2x * ref.centered_sum_sq)
+    zncc = 0.0 if denominator == 0 else float(acc.cxy / denominator)
+
+    return {
+        "IV": float(acc.mean_x),
+        "ZNCC": zncc,
+        "rSSD": float(sdd / ref.size),
+    }
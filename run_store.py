@@ -0,0 +1,310 @@
+import os
+import json
+import numpy as np
+
+from avg_cache import cache_key
+from frame_sources import FrameSource, roi_slices
+
+
+DEFAULT_CHUNK_FRAMES = 32
+STORE_VERSION = 1
+
+
+def _write_json(path, data):
+    """Escribe JSON de forma atómica (archivo temporal + os.replace)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def describe_source(path, limit=None, roi=None):
+    """
+    Origen de los datos de una muestra para meta.json: ruta de los cuadros
+    crudos, ROI, límite de cuadros y huella (tamaño y mtime de los archivos,
+    ver avg_cache.cache_key). Se normaliza como JSON para compararlo con lo
+    leído de meta.json.
+    """
+    source = {
+        "path": os.path.abspath(path),
+        "roi": roi or None,
+        "limit": limit,
+        "fingerprint": cache_key(path, limit, roi=roi),
+    }
+    return json.loads(json.dumps(source, default=str))
+
+
+class RunStore:
+    """
+    Almacén binario de una corrida bajo paths.processed.
+
+    Estructura:
+      index.json                       índice de muestras (JSON pequeño)
+      <label>/meta.json                metadatos de la muestra
+      <label>/frames_00000.npy ...     cuadros crudos en bloques (chunk, alto, ancho)
+      <label>/average.npy              promedio float32
+      <label>/map_<métrica>.npy        mapas locales float32 (filas, columnas)
+      <label>/frame_maps_<métrica>.npy mapas locales por cuadro (opcional)
+
+    Todos los .npy se leen con mmap, así que leer una muestra o un rango de
+    cuadros no decodifica ni copia el resto. Cada muestra escribe solo su
+    carpeta; index.json lo regenera write_index() al terminar la corrida.
+
+    Los cuadros, el promedio y los mapas guardan en meta.json el origen del
+    que salieron (describe_source). Los métodos de lectura aceptan source=:
+    si se da y no coincide con el guardado, la parte se trata como ausente,
+    para no mezclar datos de una corrida anterior con otra ROI o con cuadros
+    crudos que cambiaron.
+    """
+
+    def __init__(self, root, chunk_frames=DEFAULT_CHUNK_FRAMES):
+        self.root = root
+        self.chunk_frames = chunk_frames
+        os.makedirs(root, exist_ok=True)
+
+    # ------------------------------------------------------------------
+    # Metadatos
+    # ------------------------------------------------------------------
+    def _sample_dir(self, label):
+        return os.path.join(self.root, label)
+
+    def _meta_path(self, label):
+        return os.path.join(self._sample_dir(label), "meta.json")
+
+    def meta(self, label):
+        """Metadatos de una muestra ({} si no está en el almacén)."""
+        path = self._meta_path(label)
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def matches(self, label, part, source):
+        """True si la parte ("frames", "average", "maps") existe y, con source, es de ese origen."""
+        info = self.meta(label).get(part)
+        if not info:
+            return False
+        return source is None or info.get("source") == source
+
+    def _update_meta(self, label, **fields):
+        os.makedirs(self._sample_dir(label), exist_ok=True)
+        meta = self.meta(label)
+        meta.update(fields)
+        _write_json(self._meta_path(label), meta)
+
+    def samples(self):
+        """Etiquetas de las muestras almacenadas."""
+        return sorted(
+            d for d in os.listdir(self.root)
+            if os.path.exists(self._meta_path(d))
+        )
+
+    def write_index(self):
+        """Regenera index.json a partir de los meta.json de cada muestra."""
+        index = {
+            "version": STORE_VERSION,
+            "chunk_frames": self.chunk_frames,
+            "samples": {label: self.meta(label) for label in self.samples()},
+        }
+        _write_json(os.path.join(self.root, "index.json"), index)
+        return index
+
+    def index(self):
+        """Lee index.json (o lo regenera si todavía no existe)."""
+        path = os.path.join(self.root, "index.json")
+        if not os.path.exists(path):
+            return self.write_index()
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    # ------------------------------------------------------------------
+    # Promedios
+    # ------------------------------------------------------------------
+    def write_average(self, label, avg, source=None):
+        """Guarda el promedio de la muestra como float32 (y su origen)."""
+        os.makedirs(self._sample_dir(label), exist_ok=True)
+        avg = np.asarray(avg, dtype=np.float32)
+        np.save(os.path.join(self._sample_dir(label), "average.npy"), avg)
+        self._update_meta(label, average={"shape": list(avg.shape),
+                                          "dtype": "float32",
+                                          "source": source})
+
+    def has_average(self, label, source=None):
+        return self.matches(label, "average", source)
+
+    def read_average(self, label, source=None):
+        """Promedio float32 de la muestra, mapeado en memoria (solo lectura)."""
+        path = os.path.join(self._sample_dir(label), "average.npy")
+        if not os.path.exists(path) or not self.has_average(label, source):
+            raise KeyError(f"La muestra '{label}' no tiene promedio almacenado"
+                           + ("" if source is None else " para este origen"))
+        return np.load(path, mmap_mode="r")
+
+    # ------------------------------------------------------------------
+    # Mapas locales
+    # ------------------------------------------------------------------
+    def _map_path(self, label, metric, frames=False):
+        prefix = "frame_maps" if frames else "map"
+        return os.path.join(self._sample_dir(label), f"{prefix}_{metric.lower()}.npy")
+
+    def write_maps(self, label, maps, window, stride, frame_maps=None, source=None):
+        """
+        Guarda los mapas locales float32 de la muestra ({métrica: (filas,
+        columnas)}) y, opcionalmente, los de cada cuadro (cuadros, filas,
+        columnas), con el origen de los datos.
+        """
+        os.makedirs(self._sample_dir(label), exist_ok=True)
+        shape = None
+        for metric, values in maps.items():
+            values = np.asarray(values, dtype=np.float32)
+            np.save(self._map_path(label, metric), values)
+            shape = values.shape
+        n_frames = 0
+        for metric, values in (frame_maps or {}).items():
+            values = np.asarray(values, dtype=np.float32)
+            np.save(self._map_path(label, metric, frames=True), values)
+            n_frames = len(values)
+        self._update_meta(label, maps={
+            "metrics": list(maps),
+            "window": int(window),
+            "stride": int(stride),
+            "shape": list(shape),
+            "frames": n_frames,
+            "source": source,
+        })
+
+    def read_map(self, label, metric, frames=False, source=None):
+        """Mapa local float32 de la muestra (o de sus cuadros), con mmap."""
+        info = self.meta(label).get("maps") if self.matches(label, "maps", source) else None
+        if not info or metric not in info["metrics"] or (frames and not info["frames"]):
+            raise KeyError(f"La muestra '{label}' no tiene mapa {metric} almacenado")
+        return np.load(self._map_path(label, metric, frames), mmap_mode="r")
+
+    # ------------------------------------------------------------------
+    # Cuadros crudos
+    # ------------------------------------------------------------------
+    def _chunk_path(self, label, k):
+        return os.path.join(self._sample_dir(label), f"frames_{k:05d}.npy")
+
+    def clear_frames(self, label):
+        """Borra los bloques de cuadros de la muestra y su entrada en meta.json."""
+        folder = self._sample_dir(label)
+        if not os.path.isdir(folder):
+            return
+        for name in os.listdir(folder):
+            if name.startswith("frames_") and name.endswith(".npy"):
+                os.remove(os.path.join(folder, name))
+        meta = self.meta(label)
+        if meta.pop("frames", None) is not None:
+            _write_json(self._meta_path(label), meta)
+
+    def record_frames(self, label, frames, source=None):
+        """
+        Generador que guarda los cuadros en bloques a medida que pasan y los
+        vuelve a entregar, para archivar mientras se promedia. Los bloques de
+        una adquisición anterior de la misma muestra se borran antes; source
+        (describe_source) queda en meta.json.
+        """
+        self.clear_frames(label)
+        os.makedirs(self._sample_dir(label), exist_ok=True)
+        chunk = None
+        k = 0
+        filled = 0
+        count = 0
+        for frame in frames:
+            if chunk is None:
+                chunk = np.empty((self.chunk_frames,) + frame.shape, dtype=frame.dtype)
+            chunk[filled] = frame
+            filled += 1
+            count += 1
+            if filled == self.chunk_frames:
+                np.save(self._chunk_path(label, k), chunk)
+                k += 1
+                filled = 0
+            yield frame
+
+        if filled:
+            np.save(self._chunk_path(label, k), chunk[:filled])
+            k += 1
+        if chunk is not None:
+            self._update_meta(label, frames={
+                "count": count,
+                "shape": list(chunk.shape[1:]),
+                "dtype": chunk.dtype.str,
+                "chunk_frames": self.chunk_frames,
+                "chunks": k,
+                "source": source,
+            })
+
+    def write_frames(self, label, frames, source=None):
+        """Guarda una secuencia de cuadros y devuelve cuántos se escribieron."""
+        return sum(1 for _ in self.record_frames(label, frames, source))
+
+    def frame_count(self, label, source=None):
+        """Cuadros almacenados de la muestra (0 si no hay o son de otro origen)."""
+        if not self.matches(label, "frames", source):
+            return 0
+        return self.meta(label)["frames"]["count"]
+
+    def read_frames(self, label, start=0, stop=None, roi=None, source=None):
+        """
+        Cuadros [start, stop) de la muestra como arreglo (n, alto, ancho),
+        opcionalmente recortados a la ROI. Si el rango cae en un solo bloque
+        se devuelve una vista mapeada.
+        """
+        info = self.meta(label).get("frames") if self.matches(label, "frames", source) else None
+        if not info:
+            raise KeyError(f"La muestra '{label}' no tiene cuadros almacenados")
+        count = info["count"]
+        size = info["chunk_frames"]
+        stop = count if stop is None else min(stop, count)
+        rows, cols = roi_slices(roi, info["shape"])
+        if start >= stop:
+            empty = np.empty((0,) + tuple(info["shape"]), dtype=info["dtype"])
+            return empty[:, rows, cols]
+
+        parts = []
+        for k in range(start // size, (stop - 1) // size + 1):
+            chunk = np.load(self._chunk_path(label, k), mmap_mode="r")
+            lo = max(start - k * size, 0)
+            hi = min(stop - k * size, len(chunk))
+            parts.append(chunk[lo:hi, rows, cols])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts, axis=0)
+
+    def frame_source(self, label, source=None):
+        """Los cuadros almacenados como FrameSource (para io_utils.iter_images)."""
+        if not self.matches(label, "frames", source):
+            raise KeyError(f"La muestra '{label}' no tiene cuadros almacenados"
+                           + ("" if source is None else " para este origen"))
+        return StoreFrameSource(self, label)
+
+
+class StoreFrameSource(FrameSource):
+    """Cuadros de una muestra del RunStore, leídos por bloque con mmap."""
+
+    def __init__(self, store, label):
+        self.store = store
+        self.name = label
+        info = store.meta(label).get("frames")
+        if not info:
+            raise KeyError(f"La muestra '{label}' no tiene cuadros almacenados")
+        self.count = info["count"]
+        self.chunk_frames = info["chunk_frames"]
+        self._cached = (None, None)
+
+    def __len__(self):
+        return self.count
+
+    def read(self, i, roi=None):
+        k = i // self.chunk_frames
+        cached_k, chunk = self._cached
+        if cached_k != k:
+            chunk = np.load(self.store._chunk_path(self.name, k), mmap_mode="r")
+            self._cached = (k, chunk)
+        rows, cols = roi_slices(roi, chunk.shape[1:])
+        return chunk[i - k * self.chunk_frames, rows, cols]
+
+    def close(self):
+        self._cached = (None, None)
@@ -0,0 +1,215 @@
+from functools import lru_cache
+
+import numpy as np
+
+from timing import timed
+
+
+# Cuadros por lote en SpectrumEngine: acota los temporales de la FFT
+DEFAULT_BATCH_SIZE = 16
+
+# Planes por forma de cuadro que se conservan (cada uno guarda los índices
+# de la media radial, del tamaño del semiplano de rfft2)
+PLAN_CACHE_SIZE = 16
+
+
+class SpectrumPlan:
+    """
+    Todo lo que depende solo de la forma (alto, ancho) del cuadro.
+
+    rfft2 entrega el semiplano kx >= 0 (alto, ancho // 2 + 1). Cada
+    frecuencia se asigna a un anillo de radio entero k = round(N * |f|),
+    con N = min(alto, ancho) y |f| en ciclos por píxel, hasta el Nyquist
+    del lado menor. Las columnas interiores del semiplano tienen peso 2,
+    porque representan también a su conjugada, de modo que la media por
+    anillo es la del espectro completo. Los índices quedan ordenados por
+    anillo para sumar con np.add.reduceat.
+    """
+
+    def __init__(self, shape):
+        h, w = shape
+        self.shape = (h, w)
+        self.size = h * w
+        self.n = min(h, w)
+        self.n_bins = self.n // 2 + 1
+
+        fy = np.fft.fftfreq(h)[:, None]
+        fx = np.fft.rfftfreq(w)[None, :]
+        ring = np.rint(self.n * np.sqrt(fy ** 2 + fx ** 2)).astype(np.int64).ravel()
+
+        weight = np.full((h, w // 2 + 1), 2.0)
+        weight[:, 0] = 1.0
+        if w % 2 == 0:
+            weight[:, -1] = 1.0
+        self._col_weight = weight[0].astype(np.float32)
+        weight = weight.ravel()
+
+        inside = np.flatnonzero(ring < self.n_bins)
+        order = np.argsort(ring[inside], kind="stable")
+        self.index = inside[order]
+        self.weight = weight[self.index].astype(np.float32)
+        ring = ring[self.index]
+        self.starts = np.searchsorted(ring, np.arange(self.n_bins))
+        self.counts = np.add.reduceat(self.weight.astype(np.float64), self.starts)
+
+        # Frecuencia central de cada anillo (ciclos por píxel)
+        self.freq = np.arange(self.n_bins) / self.n
+
+    def axis_autocorrelation(self, power):
+        """
+        Autocorrelación normalizada a lo largo de x (fila 0) y de y
+        (columna 0) para desfases 0..ancho/2 y 0..alto/2.
+
+        Por el teorema de proyección, la fila 0 de la autocorrelación es la
+        transformada inversa 1D de la potencia sumada sobre ky, y la columna
+        0 la de la potencia sumada sobre kx (con los pesos del semiplano):
+        no hace falta la irfft2 completa.
+        """
+        h, w = self.shape
+        acf_x = np.fft.irfft(power.sum(axis=1, dtype=np.float64), n=w)[:, :w // 2 + 1]
+        proj_y = (power * self._col_weight).sum(axis=2, dtype=np.float64)
+        acf_y = np.fft.ifft(proj_y).real[:, :h // 2 + 1]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return acf_x / acf_x[:, :1], acf_y / acf_y[:, :1]
+
+    def radial(self, power):
+        """Media radial de potencias (lote, alto, ancho // 2 + 1)."""
+        flat = power.reshape(len(power), -1)
+        sums = np.add.reduceat(flat[:, self.index] * self.weight, self.starts,
+                               axis=1, dtype=np.float64)
+        return sums / self.counts
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def spectrum_plan(shape):
+    return SpectrumPlan(tuple(shape))
+
+
+def fwhm(profile):
+    """
+    Ancho a media altura de perfiles de autocorrelación (lote, desfases)
+    normalizados a 1 en el desfase 0: dos veces el primer desfase donde el
+    perfil cruza 0.5, interpolado linealmente. NaN si no llega a cruzar.
+    """
+    below = profile < 0.5
+    first = below.argmax(axis=1)
+    rows = np.arange(len(profile))
+    hi = profile[rows, np.maximum(first - 1, 0)]
+    lo = profile[rows, first]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lag = first - 1 + (hi - 0.5) / (hi - lo)
+    return np.where(below.any(axis=1) & (first > 0), 2.0 * lag, np.nan)
+
+
+def _mean_or_none(values):
+    values = values[~np.isnan(values)]
+    return float(values.mean()) if len(values) else None
+
+
+def _nan_to_none(values):
+    return [None if np.isnan(v) else float(v) for v in values]
+
+
+class SpectrumEngine:
+    """
+    Espectro de potencia radial y tamaño de grano por cuadro, por lotes.
+
+    Los cuadros se copian a un búfer float32 (lote, alto, ancho) y cada
+    lote se transforma con una sola llamada a rfft2 (complex64). A cada
+    cuadro se le resta su media antes, así que el componente DC no domina.
+    La autocorrelación sale de la potencia (Wiener–Khinchin) y el tamaño
+    de grano es su ancho a media altura en x e y, en píxeles.
+    """
+
+    def __init__(self, shape, batch_size=DEFAULT_BATCH_SIZE, keep_psd=True):
+        self.plan = spectrum_plan(tuple(shape))
+        self.batch_size = max(1, int(batch_size))
+        self.keep_psd = keep_psd
+        self._buf = np.empty((self.batch_size, *self.plan.shape), dtype=np.float32)
+        self._pending = 0
+        self._psd_sum = np.zeros(self.plan.n_bins, dtype=np.float64)
+        self.psds = []
+        self.grain_x = []
+        self.grain_y = []
+
+    def add(self, frame):
+        if frame.shape != self.plan.shape:
+            raise ValueError(
+                f"Dimensiones inconsistentes: {frame.shape} != {self.plan.shape}"
+            )
+        self._buf[self._pending] = frame
+        self._pending += 1
+        if self._pending == self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """Procesa los cuadros pendientes del lote actual."""
+        if self._pending == 0:
+            return
+        x = self._buf[:self._pending]
+        self._pending = 0
+        self._process(x)
+
+    @timed("spectrum_batch")
+    def _process(self, x):
+        """Espectro y grano de un lote (n, alto, ancho) ya copiado al búfer."""
+        x -= x.mean(axis=(1, 2), dtype=np.float64).astype(np.float32)[:, None, None]
+        spec = np.fft.rfft2(x)
+        power = np.square(spec.real)
+        power += np.square(spec.imag)
+        del spec
+        power /= self.plan.size
+
+        psd = self.plan.radial(power)
+        self._psd_sum += psd.sum(axis=0)
+        if self.keep_psd:
+            self.psds.append(psd.astype(np.float32))
+
+        acf_x, acf_y = self.plan.axis_autocorrelation(power)
+        self.grain_x.extend(fwhm(acf_x).tolist())
+        self.grain_y.extend(fwhm(acf_y).tolist())
+
+    def result(self):
+        """
+        Espectro radial medio, tamaño de grano medio y series por cuadro.
+        Los cuadros cuya autocorrelación no cae a la mitad dan None.
+        """
+        self.flush()
+        gx = np.asarray(self.grain_x)
+        gy = np.asarray(self.grain_y)
+        grain = (gx + gy) / 2
+        return {
+            "n_images": len(grain),
+            "freq": self.plan.freq.tolist(),
+            "psd": (self._psd_sum / max(len(grain), 1)).tolist(),
+            "grain": _mean_or_none(grain),
+            "grain_x": _mean_or_none(gx),
+            "grain_y": _mean_or_none(gy),
+            "series": {
+                "grain": _nan_to_none(grain),
+                "grain_x": _nan_to_none(gx),
+                "grain_y": _nan_to_none(gy),
+            },
+        }
+
+    def psd_frames(self):
+        """Espectros radiales por cuadro, float32 (cuadros, anillos)."""
+        self.flush()
+        if not self.psds:
+            return np.empty((0, self.plan.n_bins), dtype=np.float32)
+        return np.concatenate(self.psds)
+
+
+def analyze_spectrum(frames, batch_size=DEFAULT_BATCH_SIZE, keep_psd=False):
+    """
+    Espectro y tamaño de grano de una secuencia de cuadros 2D. Devuelve
+    el engine ya vaciado (result() y psd_frames()) o None si no hubo cuadros.
+    """
+    engine = None
+    for frame in frames:
+        if engine is None:
+            engine = SpectrumEngine(frame.shape, batch_size, keep_psd=keep_psd)
+        engine.add(frame)
+    if engine is not None:
+        engine.flush()
+    return engine
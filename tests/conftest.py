@@ -0,0 +1,5 @@
+import os
+
+# backend.database crea el motor al importarse: las pruebas usan SQLite en
+# memoria en lugar del PostgreSQL por defecto
+os.environ.setdefault("DATABASE_URL", "sqlite://")
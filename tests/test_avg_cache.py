@@ -0,0 +1,64 @@
+import os
+
+import cv2
+import numpy as np
+
+from avg_cache import AverageCache, cache_key
+
+
+def _write_frames(folder, count=3, seed=0):
+    rng = np.random.default_rng(seed)
+    frames = [rng.integers(0, 256, (16, 16)).astype(np.uint8) for _ in range(count)]
+    for i, frame in enumerate(frames):
+        cv2.imwrite(os.path.join(folder, f"frame_{i:03d}.png"), frame)
+    return frames
+
+
+def test_hit_then_miss_after_mtime_change(tmp_path):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    frames = _write_frames(str(raw))
+    cache = AverageCache(str(tmp_path / "cache"))
+
+    key = cache_key(str(raw), roi=None)
+    assert cache.get_average(key) is None
+    avg = np.mean(frames, axis=0)
+    cache.put_average(key, avg, frame_dtype=np.uint8)
+    cache.put_metrics(key, "ref", {"ZNCC": 0.5})
+
+    again = cache_key(str(raw), roi=None)
+    assert again == key
+    np.testing.assert_array_equal(cache.get_average(again), avg.astype(np.float32))
+    assert cache.frame_dtype(again) == np.uint8
+    assert cache.get_metrics(again, "ref") == {"ZNCC": 0.5}
+    assert cache.get_metrics(again, "other") is None
+
+    # Mismo contenido, otra fecha: la huella cambia y la entrada no se usa
+    first = raw / "frame_000.png"
+    st = os.stat(first)
+    os.utime(first, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    changed = cache_key(str(raw), roi=None)
+    assert changed != key
+    assert cache.get_average(changed) is None
+
+
+def test_key_depends_on_limit_and_config(tmp_path):
+    _write_frames(str(tmp_path))
+    base = cache_key(str(tmp_path), roi=None)
+    assert cache_key(str(tmp_path), 2, roi=None) != base
+    assert cache_key(str(tmp_path), roi={"x": 0, "y": 0, "w": 8, "h": 8}) != base
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = AverageCache(str(tmp_path))
+    avg = np.zeros((64, 64), dtype=np.float32)
+    for key in ("aa" + "0" * 62, "bb" + "0" * 62):
+        cache.put_average(key, avg)
+    entry = sum(size for _, size, _ in cache.entries()) // 2
+    old = cache._paths("aa" + "0" * 62)[1]
+    os.utime(old, (0, 0))
+
+    cache.max_bytes = 2 * entry + entry // 2
+    cache.put_average("cc" + "0" * 62, avg)
+    keys = {key for _, _, key in cache.entries()}
+    assert keys == {"bb" + "0" * 62, "cc" + "0" * 62}
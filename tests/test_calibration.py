@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from calibration import CalibrationModel, fit_calibration
+
+
+def _samples(seed=0, noise=0.2):
+    """Muestras con n conocido; IV decrece y ZNCC crece con n."""
+    rng = np.random.default_rng(seed)
+    n = np.repeat(np.linspace(1.33, 1.50, 9), 3)
+    table = {
+        "IV": 180 - 400 * (n - 1.33) + rng.normal(0, noise, n.size),
+        "ZNCC": 0.5 + 2.5 * (n - 1.33) ** 1.5 + rng.normal(0, noise / 1000, n.size),
+    }
+    return n, table
+
+
+@pytest.mark.parametrize("kind", ["poly", "monotone"])
+def test_fit_then_predict_round_trip(tmp_path, kind):
+    n, table = _samples()
+    model = fit_calibration(n, table, ["IV", "ZNCC"], kind=kind)
+    assert model.warnings == []
+    path = model.save(str(tmp_path / "cal.json"))
+    loaded = CalibrationModel.load(path)
+    assert loaded.to_dict() == model.to_dict()
+
+    truth = np.array([1.34, 1.39, 1.42, 1.49])
+    values = np.stack([model.curves[m].predict(truth) for m in ("IV", "ZNCC")], axis=1)
+    est, std, chi2 = loaded.predict(values, ["IV", "ZNCC"])
+    np.testing.assert_allclose(est, truth, atol=1e-3)
+    assert np.all(std > 0) and np.all(np.isfinite(std))
+    assert np.all(chi2 < 1e-3)
+
+    # Una sola métrica presente por fila; sin ninguna, NaN
+    partial = values.copy()
+    partial[:, 1] = np.nan
+    partial[-1, 0] = np.nan
+    est, std, _ = loaded.predict(partial, ["IV", "ZNCC"])
+    np.testing.assert_allclose(est[:-1], truth[:-1], atol=1e-3)
+    assert np.isnan(est[-1]) and np.isnan(std[-1])
+
+
+def test_non_monotone_fit_warns_or_is_rejected():
+    n, table = _samples()
+    table["ZNCC"] = np.cos((n - 1.33) * 30)
+    model = fit_calibration(n, table, ["ZNCC"])
+    assert not model.summary()["ZNCC"]["monotone"]
+    assert any("ZNCC" in w for w in model.warnings)
+    with pytest.raises(ValueError):
+        fit_calibration(n, table, ["ZNCC"], strict=True)
+
+    monotone = fit_calibration(n, table, ["ZNCC"], kind="monotone", strict=True)
+    assert monotone.summary()["ZNCC"]["monotone"]
+
+
+def test_capped_degree_is_reported():
+    model = fit_calibration([1.33, 1.40, 1.47], {"IV": [10.0, 8.0, 5.0]}, ["IV"], degree=3)
+    assert model.curves["IV"].degree == 1
+    assert model.warnings and "IV" in model.warnings[0]
@@ -0,0 +1,51 @@
+import warnings
+
+import numpy as np
+
+from backend.speckle_processor_zip import BatchedFrameMetrics, compute_rssd, compute_zncc
+
+
+def _reference():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (48, 64)).astype(np.uint8)
+
+
+def test_frame_metrics_match_per_frame_functions():
+    ref = _reference()
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(0, 256, ref.shape).astype(np.uint8) for _ in range(5)]
+
+    engine = BatchedFrameMetrics(ref, batch_size=2)
+    for frame in frames:
+        engine.add(frame)
+    series = engine.result()["series"]
+
+    np.testing.assert_allclose(series["zncc"], [compute_zncc(ref, f) for f in frames],
+                               rtol=1e-4, atol=1e-6)
+    np.testing.assert_allclose(series["rssd"], [compute_rssd(ref, f) for f in frames],
+                               rtol=1e-5)
+
+
+def test_constant_frame_gives_zero_zncc():
+    ref = _reference()
+    engine = BatchedFrameMetrics(ref, batch_size=4)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        engine.add(ref)
+        engine.add(np.zeros_like(ref))
+        result = engine.result()
+
+    zncc = result["series"]["zncc"]
+    assert np.isfinite(zncc).all()
+    assert zncc[1] == 0.0
+    expected = np.mean(ref.astype(np.float64) ** 2)
+    assert abs(result["series"]["rssd"][1] - expected) <= 1e-6 * expected
+
+
+def test_frame_equal_to_reference_has_zero_rssd():
+    ref = _reference()
+    engine = BatchedFrameMetrics(ref)
+    engine.add(ref.copy())
+    result = engine.result()
+    assert result["rssd"] == 0.0
+    assert abs(result["zncc"] - 1.0) < 1e-6
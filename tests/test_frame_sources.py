@@ -0,0 +1,53 @@
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from frame_sources import TiffStackSource
+from io_utils import iter_images
+
+
+def _frames(dtype=np.uint16, count=7):
+    rng = np.random.default_rng(0)
+    high = np.iinfo(dtype).max
+    return [rng.integers(0, high, (40, 56), endpoint=True).astype(dtype)
+            for _ in range(count)]
+
+
+def _read_all(path, threads, roi=None):
+    return list(iter_images(path, threads=threads, progress=False, dtype=None, roi=roi))
+
+
+def _assert_identical(got, expected):
+    assert len(got) == len(expected)
+    for a, b in zip(got, expected):
+        assert a.dtype == b.dtype
+        np.testing.assert_array_equal(a, b)
+
+
+@pytest.mark.parametrize("dtype", [np.uint8, np.uint16])
+def test_folder_frames_identical_with_threads(tmp_path, dtype):
+    frames = _frames(dtype)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(str(tmp_path / f"frame_{i:03d}.png"), frame)
+
+    _assert_identical(_read_all(str(tmp_path), threads=1), frames)
+    _assert_identical(_read_all(str(tmp_path), threads=4), frames)
+
+
+@pytest.mark.parametrize("compression", [None, "tiff_lzw"])
+def test_tiff_stack_frames_identical_with_threads(tmp_path, compression):
+    frames = _frames(np.uint16)
+    path = str(tmp_path / "stack.tif")
+    images = [Image.fromarray(f) for f in frames]
+    images[0].save(path, save_all=True, append_images=images[1:], compression=compression)
+
+    with TiffStackSource(path) as source:
+        # Sin compresión se lee del archivo mapeado; con LZW, con PIL
+        assert source.memmapped == (compression is None)
+
+    roi = {"x": 5, "y": 3, "w": 20, "h": 30}
+    expected = [f[3:33, 5:25] for f in frames]
+    serial = _read_all(path, threads=1, roi=roi)
+    _assert_identical(serial, expected)
+    _assert_identical(_read_all(path, threads=4, roi=roi), serial)
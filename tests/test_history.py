@@ -0,0 +1,74 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.orm import sessionmaker
+
+from backend.database import Base, make_engine
+from backend.models import Sample
+from backend.routers.reference import parse_fields, query_history
+
+
+@pytest.fixture
+def db():
+    engine = make_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    start = datetime(2025, 11, 13, 12, 0, 0)
+    # Varias filas por instante: el orden se desempata por id
+    for i in range(23):
+        session.add(Sample(filename=f"f{i % 3}", zncc=i / 100,
+                           created_at=start + timedelta(minutes=i // 4)))
+    session.commit()
+    yield session
+    session.close()
+    engine.dispose()
+
+
+def _all_pages(db, limit, **filters):
+    args = {"filename": None, "date_from": None, "date_to": None, **filters}
+    pages, cursor = [], None
+    while True:
+        page = query_history(db, limit, cursor, parse_fields(None), **args)
+        pages.append(page["items"])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+def _expected(db, **filters):
+    q = db.query(Sample)
+    if filters.get("filename"):
+        q = q.filter(Sample.filename == filters["filename"])
+    rows = q.all()
+    return [r.id for r in sorted(rows, key=lambda r: (r.created_at, r.id), reverse=True)]
+
+
+@pytest.mark.parametrize("limit", [1, 4, 5, 23, 100])
+def test_cursor_pages_cover_all_rows_once_in_order(db, limit):
+    pages = _all_pages(db, limit)
+    ids = [item["id"] for page in pages for item in page]
+    assert ids == _expected(db)
+    assert all(len(page) == limit for page in pages[:-1])
+    assert 0 < len(pages[-1]) <= limit
+
+
+def test_cursor_pages_with_filename_filter(db):
+    pages = _all_pages(db, 3, filename="f1")
+    ids = [item["id"] for page in pages for item in page]
+    assert ids == _expected(db, filename="f1")
+
+
+def test_field_projection(db):
+    page = query_history(db, 2, None, parse_fields("zncc"), None, None, None)
+    assert set(page["items"][0]) == {"id", "zncc", "created_at"}
+    summary = parse_fields("summary")
+    assert "ops" not in summary and "rssd_unit" in summary
+    with pytest.raises(HTTPException):
+        parse_fields("zncc,nope")
+
+
+def test_unknown_cursor_is_rejected(db):
+    with pytest.raises(HTTPException) as e:
+        query_history(db, 5, 10_000, parse_fields(None), None, None, None)
+    assert e.value.status_code == 400
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from local_maps import LocalMapEngine, WindowGrid, analyze_local_maps, local_maps
+from metrics import IV, ZNCC, rSSD
+
+
+def _pair(shape=(50, 60), seed=0):
+    rng = np.random.default_rng(seed)
+    ref = rng.integers(0, 4096, shape).astype(np.uint16)
+    frames = [(0.6 * ref + rng.integers(0, 1600, shape)).astype(np.uint16)
+              for _ in range(3)]
+    return frames, ref
+
+
+def _direct(image, reference, window, stride):
+    """Métricas de metrics.py sobre el recorte de cada ventana."""
+    image = image.astype(np.float64)
+    reference = reference.astype(np.float64)
+    rows = range(0, image.shape[0] - window + 1, stride)
+    cols = range(0, image.shape[1] - window + 1, stride)
+    out = {m: np.empty((len(rows), len(cols))) for m in ("IV", "ZNCC", "rSSD")}
+    for i, r in enumerate(rows):
+        for j, c in enumerate(cols):
+            a = image[r:r + window, c:c + window]
+            b = reference[r:r + window, c:c + window]
+            out["IV"][i, j] = IV(a)
+            out["ZNCC"][i, j] = ZNCC(a, b)
+            out["rSSD"][i, j] = rSSD(a, b)
+    return out
+
+
+def _assert_maps_close(got, expected):
+    for m, values in expected.items():
+        np.testing.assert_allclose(got[m], values, rtol=1e-4, atol=1e-4 * np.abs(values).max())
+
+
+@pytest.mark.parametrize("window,stride", [(8, 4), (16, 5), (50, 1)])
+def test_single_image_matches_window_crops(window, stride):
+    frames, ref = _pair()
+    got = local_maps(frames[0], ref, window, stride)
+    _assert_maps_close(got, _direct(frames[0], ref, window, stride))
+
+
+def test_frame_maps_and_mean_over_batches():
+    frames, ref = _pair()
+    engine = analyze_local_maps(frames, ref, window=12, stride=6, batch_size=2,
+                                keep_frames=True)
+    per_frame = [_direct(f, ref, 12, 6) for f in frames]
+    frame_maps = engine.frame_maps()
+    for k, expected in enumerate(per_frame):
+        _assert_maps_close({m: v[k] for m, v in frame_maps.items()}, expected)
+    _assert_maps_close(engine.maps(), {m: np.mean([p[m] for p in per_frame], axis=0)
+                                       for m in per_frame[0]})
+
+
+def test_uniform_window_gives_zero_zncc():
+    _, ref = _pair()
+    frame = np.full(ref.shape, 100, dtype=np.uint16)
+    got = local_maps(frame, ref, window=10, stride=10)
+    assert np.all(got["ZNCC"] == 0)
+    assert np.all(got["IV"] == 100)
+
+
+def test_grid_rejects_window_larger_than_image():
+    with pytest.raises(ValueError):
+        WindowGrid((20, 30), window=32)
+    with pytest.raises(ValueError):
+        LocalMapEngine(np.zeros((20, 30)), window=32)
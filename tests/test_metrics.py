@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from metrics import IV, ZNCC, ReferenceStats, compute_all, rSSD
+
+
+def _pair(shape=(300, 200), mean=100.0, std=20.0, seed=0):
+    rng = np.random.default_rng(seed)
+    ref = rng.normal(mean, std, shape)
+    sample = 0.7 * ref + rng.normal(mean * 0.3, std, shape)
+    return sample, ref
+
+
+def _legacy(I, I0):
+    return {"IV": IV(I), "ZNCC": ZNCC(I, I0), "rSSD": rSSD(I, I0)}
+
+
+@pytest.mark.parametrize("block_rows", [1, 7, 64, 256, 1000])
+def test_compute_all_matches_per_metric_functions(block_rows):
+    sample, ref = _pair()
+    got = compute_all(sample, ref, block_rows=block_rows)
+    expected = _legacy(sample, ref)
+    for key in expected:
+        assert got[key] == pytest.approx(expected[key], rel=1e-10)
+
+
+def test_compute_all_with_reference_stats_and_integer_frames():
+    sample, ref = _pair()
+    sample = np.clip(sample, 0, 255).astype(np.uint8)
+    ref = np.clip(ref, 0, 255).astype(np.uint8)
+    stats = ReferenceStats(ref, block_rows=32)
+
+    got = compute_all(sample, stats)
+    expected = _legacy(sample.astype(np.float64), ref.astype(np.float64))
+    for key in expected:
+        assert got[key] == pytest.approx(expected[key], rel=1e-10)
+
+
+def test_compute_all_high_mean_low_contrast():
+    # Media alta y poco contraste: las sumas sin centrar pierden los dígitos
+    sample, ref = _pair(mean=30000.0, std=0.003)
+    got = compute_all(sample.astype(np.float32), ref.astype(np.float32))
+    expected = _legacy(sample.astype(np.float32).astype(np.float64),
+                       ref.astype(np.float32).astype(np.float64))
+    assert got["ZNCC"] == pytest.approx(expected["ZNCC"], abs=1e-6)
+    assert got["rSSD"] == pytest.approx(expected["rSSD"], rel=1e-6)
+
+
+def test_compute_all_rejects_shape_mismatch():
+    sample, ref = _pair()
+    with pytest.raises(ValueError):
+        compute_all(sample[:-1], ref)
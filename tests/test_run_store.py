@@ -0,0 +1,76 @@
+import cv2
+import numpy as np
+import pytest
+
+from io_utils import iter_images
+from run_store import RunStore, describe_source
+
+
+def _frames(count=11, shape=(24, 32)):
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 4096, shape).astype(np.uint16) for _ in range(count)]
+
+
+def test_frames_average_and_maps_round_trip(tmp_path):
+    store = RunStore(str(tmp_path / "store"), chunk_frames=4)
+    frames = _frames()
+
+    assert store.write_frames("s1", iter(frames)) == len(frames)
+    assert store.frame_count("s1") == len(frames)
+    np.testing.assert_array_equal(store.read_frames("s1"), np.stack(frames))
+    # Rango que cruza bloques, con ROI
+    roi = {"x": 2, "y": 3, "w": 10, "h": 8}
+    np.testing.assert_array_equal(store.read_frames("s1", 3, 9, roi=roi),
+                                  np.stack(frames[3:9])[:, 3:11, 2:12])
+    streamed = list(iter_images(store.frame_source("s1"), progress=False, dtype=None))
+    np.testing.assert_array_equal(np.stack(streamed), np.stack(frames))
+
+    avg = np.mean(frames, axis=0)
+    store.write_average("s1", avg)
+    assert store.has_average("s1")
+    np.testing.assert_array_equal(store.read_average("s1"), avg.astype(np.float32))
+
+    maps = {"ZNCC": np.linspace(0, 1, 12).reshape(3, 4)}
+    frame_maps = {"ZNCC": np.zeros((len(frames), 3, 4))}
+    store.write_maps("s1", maps, window=8, stride=4, frame_maps=frame_maps)
+    np.testing.assert_array_equal(store.read_map("s1", "ZNCC"), maps["ZNCC"].astype(np.float32))
+    assert store.read_map("s1", "ZNCC", frames=True).shape == (len(frames), 3, 4)
+    with pytest.raises(KeyError):
+        store.read_map("s1", "rSSD")
+
+    index = store.write_index()
+    assert index["samples"]["s1"]["frames"]["count"] == len(frames)
+    assert RunStore(store.root).index() == index
+
+
+def test_rewriting_frames_drops_previous_chunks(tmp_path):
+    store = RunStore(str(tmp_path), chunk_frames=4)
+    store.write_frames("s1", _frames(count=10))
+    fewer = _frames(count=3)
+    store.write_frames("s1", fewer)
+    assert store.frame_count("s1") == 3
+    np.testing.assert_array_equal(store.read_frames("s1"), np.stack(fewer))
+
+
+def test_source_mismatch_counts_as_absent(tmp_path):
+    raw = tmp_path / "raw"
+    raw.mkdir()
+    frames = _frames(count=3)
+    for i, frame in enumerate(frames):
+        cv2.imwrite(str(raw / f"frame_{i:03d}.png"), frame)
+    source = describe_source(str(raw))
+    other_roi = describe_source(str(raw), roi={"x": 0, "y": 0, "w": 8, "h": 8})
+    assert source != other_roi
+
+    store = RunStore(str(tmp_path / "store"))
+    store.write_frames("s1", frames, source=source)
+    store.write_average("s1", np.mean(frames, axis=0), source=source)
+
+    assert store.frame_count("s1", source) == 3
+    assert store.has_average("s1", source)
+    assert store.frame_count("s1", other_roi) == 0
+    assert not store.has_average("s1", other_roi)
+    with pytest.raises(KeyError):
+        store.read_average("s1", other_roi)
+    with pytest.raises(KeyError):
+        store.frame_source("s1", other_roi)
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from spectrum import SpectrumEngine, analyze_spectrum
+
+
+def _speckle(shape, grain, seed):
+    """Ruido suavizado con un filtro gaussiano en frecuencia (grano ~ grain px)."""
+    rng = np.random.default_rng(seed)
+    fy = np.fft.fftfreq(shape[0])[:, None]
+    fx = np.fft.fftfreq(shape[1])[None, :]
+    kernel = np.exp(-(fx ** 2 + fy ** 2) * (np.pi * grain) ** 2 / 2)
+    field = np.fft.ifft2(np.fft.fft2(rng.normal(size=shape)) * kernel).real
+    return (1000 + 200 * field / field.std()).astype(np.float32)
+
+
+def _direct(frame):
+    """Espectro radial y autocorrelación en x e y con fft2 completa."""
+    h, w = frame.shape
+    x = frame.astype(np.float64) - frame.mean(dtype=np.float64)
+    power = np.abs(np.fft.fft2(x)) ** 2 / x.size
+    n = min(h, w)
+    ring = np.rint(n * np.hypot(np.fft.fftfreq(h)[:, None], np.fft.fftfreq(w)[None, :]))
+    psd = np.array([power[ring == k].mean() for k in range(n // 2 + 1)])
+    acf = np.fft.ifft2(power).real
+    return psd, acf[0, :w // 2 + 1] / acf[0, 0], acf[:h // 2 + 1, 0] / acf[0, 0]
+
+
+def _fwhm(profile):
+    k = int(np.argmax(profile < 0.5))
+    hi, lo = profile[k - 1], profile[k]
+    return 2 * (k - 1 + (hi - 0.5) / (hi - lo))
+
+
+@pytest.mark.parametrize("shape", [(64, 64), (48, 70), (51, 40)])
+def test_engine_matches_direct_fft(shape):
+    frames = [_speckle(shape, grain=3 + i, seed=i) for i in range(5)]
+    engine = analyze_spectrum(frames, batch_size=2, keep_psd=True)
+    result = engine.result()
+    psd_frames = engine.psd_frames()
+
+    assert result["n_images"] == len(frames)
+    for i, frame in enumerate(frames):
+        psd, acf_x, acf_y = _direct(frame)
+        np.testing.assert_allclose(psd_frames[i], psd, rtol=1e-3, atol=1e-6 * psd.max())
+        assert result["series"]["grain_x"][i] == pytest.approx(_fwhm(acf_x), rel=1e-3)
+        assert result["series"]["grain_y"][i] == pytest.approx(_fwhm(acf_y), rel=1e-3)
+
+    mean_psd = np.mean([_direct(f)[0] for f in frames], axis=0)
+    np.testing.assert_allclose(result["psd"], mean_psd, rtol=1e-3, atol=1e-6 * mean_psd.max())
+
+
+def test_constant_frame_has_no_grain():
+    engine = SpectrumEngine((32, 32), batch_size=4)
+    engine.add(np.full((32, 32), 7.0))
+    result = engine.result()
+    assert result["grain"] is None
+    assert result["series"]["grain"] == [None]
@@ -0,0 +1,291 @@
+"""
+Instrumentación liviana de los caminos críticos: temporizadores, contadores
+y gauges en un registro por proceso.
+
+    from timing import timed, count
+
+    @timed("compute_all")
+    def compute_all(...): ...
+
+    with timed("filter_stage", stage="gaussian"):
+        ...
+    count("frames_decoded")
+
+Cada temporizador acumula un histograma de duraciones (<nombre>_seconds,
+con cubetas fijas) más el total y el máximo; cuesta dos perf_counter() y un
+lock por llamada. El mismo registro produce el texto de Prometheus que sirve
+/metrics en la API y el resumen por etapa que imprime main.py. Los procesos
+hijos tienen su propio registro: snapshot() / merge() lo traen al padre.
+"""
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# Cubetas de duración (segundos), de medio milisegundo a medio minuto
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+                   0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+PROMETHEUS_PREFIX = "spr_"
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count", "max")
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # la última es +Inf
+        self.sum = 0.0
+        self.count = 0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        for i, c in enumerate(other["counts"]):
+            self.counts[i] += c
+        self.sum += other["sum"]
+        self.count += other["count"]
+        self.max = max(self.max, other["max"])
+
+    def as_dict(self):
+        return {"counts": list(self.counts), "sum": self.sum,
+                "count": self.count, "max": self.max}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    """Histogramas, contadores y gauges indexados por (nombre, etiquetas)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def observe(self, name, value, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            hist = self.histograms.get(key)
+            if hist is None:
+                hist = self.histograms[key] = Histogram()
+            hist.observe(value)
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self._lock:
+            self.gauges[_key(name, labels)] = value
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+    # ------------------------------------------------------------
+    # Entre procesos
+    # ------------------------------------------------------------
+    def snapshot(self):
+        """Copia serializable (pickle/JSON) del registro."""
+        with self._lock:
+            return {
+                "histograms": [[n, list(l), h.as_dict()]
+                               for (n, l), h in self.histograms.items()],
+                "counters": [[n, list(l), v] for (n, l), v in self.counters.items()],
+                "gauges": [[n, list(l), v] for (n, l), v in self.gauges.items()],
+            }
+
+    def merge(self, snapshot):
+        """Suma un snapshot (p. ej. de un proceso hijo) a este registro."""
+        with self._lock:
+            for name, labels, data in snapshot["histograms"]:
+                key = (name, tuple(tuple(kv) for kv in labels))
+                hist = self.histograms.get(key)
+                if hist is None:
+                    hist = self.histograms[key] = Histogram()
+                hist.merge(data)
+            for name, labels, value in snapshot["counters"]:
+                key = (name, tuple(tuple(kv) for kv in labels))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, value in snapshot["gauges"]:
+                key = (name, tuple(tuple(kv) for kv in labels))
+                self.gauges[key] = max(self.gauges.get(key, value), value)
+
+    # ------------------------------------------------------------
+    # Salidas
+    # ------------------------------------------------------------
+    def render_prometheus(self, prefix=PROMETHEUS_PREFIX):
+        """Formato de texto de Prometheus (versión 0.0.4)."""
+        rss, peak = process_memory()
+        with self._lock:
+            histograms = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+
+        lines = []
+        typed = set()
+
+        def header(name, kind):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), hist in histograms:
+            metric = f"{prefix}{name}_seconds"
+            header(metric, "histogram")
+            cumulative = 0
+            for bound, c in zip(hist.buckets + (float("inf"),), hist.counts):
+                cumulative += c
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{metric}_bucket{_labels(labels, le=le)} {cumulative}")
+            lines.append(f"{metric}_sum{_labels(labels)} {hist.sum!r}")
+            lines.append(f"{metric}_count{_labels(labels)} {hist.count}")
+        for (name, labels), value in counters:
+            metric = f"{prefix}{name}_total"
+            header(metric, "counter")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+        for (name, labels), value in gauges:
+            metric = f"{prefix}{name}"
+            header(metric, "gauge")
+            lines.append(f"{metric}{_labels(labels)} {value}")
+
+        if rss is not None:
+            header("process_resident_memory_bytes", "gauge")
+            lines.append(f"process_resident_memory_bytes {rss}")
+        if peak is not None:
+            header(f"{prefix}process_peak_resident_memory_bytes", "gauge")
+            lines.append(f"{prefix}process_peak_resident_memory_bytes {peak}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """Filas (nombre, etiquetas, llamadas, total s, media ms, máx ms), de mayor a menor total."""
+        with self._lock:
+            rows = [
+                (name, _label_text(labels), h.count, h.sum,
+                 1000 * h.sum / h.count if h.count else 0.0, 1000 * h.max)
+                for (name, labels), h in self.histograms.items()
+            ]
+        return sorted(rows, key=lambda r: r[3], reverse=True)
+
+    def format_summary(self, title="Tiempos por etapa"):
+        rows = self.summary()
+        _, peak = process_memory()
+        out = [f"\n=== {title} ===",
+               f"{'etapa':<34}{'llamadas':>9}{'total s':>10}{'media ms':>10}{'máx ms':>10}"]
+        for name, labels, n, total, mean, top in rows:
+            label = f"{name}{{{labels}}}" if labels else name
+            out.append(f"{label:<34}{n:>9}{total:>10.2f}{mean:>10.2f}{top:>10.1f}")
+        with self._lock:
+            counters = sorted(self.counters.items())
+            gauges = sorted(self.gauges.items())
+        for (name, labels), value in counters + gauges:
+            label = f"{name}{{{_label_text(labels)}}}" if labels else name
+            out.append(f"{label:<34}{value:>9}")
+        if peak is not None:
+            out.append(f"Pico de memoria (RSS): {peak / 2**20:.0f} MB")
+        return "\n".join(out)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels, **extra):
+    items = list(labels) + list(extra.items())
+    if not items:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in items) + "}"
+
+
+def _label_text(labels):
+    return ",".join(f"{k}={v}" for k, v in labels)
+
+
+def process_memory():
+    """
+    (RSS actual, pico de RSS) del proceso en bytes. Sin el módulo resource
+    (Windows) se usa psutil si está instalado; si no, ambos son None.
+    """
+    if resource is None:
+        if psutil is None:
+            return None, None
+        info = psutil.Process().memory_info()
+        return info.rss, max(info.rss, getattr(info, "peak_wset", info.rss))
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak if sys.platform == "darwin" else peak * 1024
+    try:
+        with open("/proc/self/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        rss = peak
+    return rss, max(rss, peak)
+
+
+registry = Registry()
+
+
+class timed:
+    """
+    Temporizador: context manager o decorador. Registra la duración en el
+    histograma <name>_seconds con las etiquetas dadas.
+    """
+    __slots__ = ("name", "labels", "registry", "_start")
+
+    def __init__(self, name, registry=None, **labels):
+        self.name = name
+        self.labels = labels
+        self.registry = registry
+        self._start = None
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        (self.registry or registry).observe(
+            self.name, time.perf_counter() - self._start, **self.labels
+        )
+        return False
+
+    def __call__(self, fn):
+        name, labels, reg = self.name, self.labels, self.registry
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                (reg or registry).observe(name, time.perf_counter() - start, **labels)
+        return wrapper
+
+
+def count(name, value=1, **labels):
+    """Suma value al contador <name>_total."""
+    registry.inc(name, value, **labels)